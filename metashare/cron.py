@@ -59,7 +59,21 @@ update_interval_settings = "{} {} {} {} {}".format( \
 @kronos.register(update_interval_settings)
 def run_digest_update():
     call_command('update_digests', interactive=False)
+
+# every night remove synchronization change journal entries which are older
+# than SYNC_JOURNAL_MAX_AGE days
+@kronos.register("42 3 * * *")
+def run_sync_journal_pruning():
+    LOGGER.info("Will now prune the synchronization change journal.")
+    call_command('prune_sync_journal', interactive=False)
     
+# every night compute the content hashes of the objects which have been changed
+# outside of imports, e.g., in the metadata editor
+@kronos.register("22 3 * * *")
+def run_content_hash_backfill():
+    LOGGER.info("Will now compute the missing content hashes.")
+    call_command('backfill_content_hashes', interactive=False)
+
 # update the GeoIP database every first day of the month
 @kronos.register("12 4 1 * *")
 def run_update_geoip_db():
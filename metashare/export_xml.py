@@ -74,25 +74,35 @@ if __name__ == "__main__":
     ERRONEOUS_EXPORTS = 0
     RESOURCE_NO = 0
     from metashare.repository.models import resourceInfoType_model
+    from metashare.repository.export_prefetch import prefetched_for_export
     from metashare.xml_utils import to_xml_string
+    # the number of resources whose object graphs are loaded at once
+    EXPORT_CHUNK_SIZE = 100
+    # skip resources marked as deleted
+    RESOURCE_IDS = list(resourceInfoType_model.objects \
+      .filter(storage_object__deleted=False).values_list('id', flat=True))
     with ZipFile(sys.argv[1], 'w') as out:
-        for resource in resourceInfoType_model.objects.all():
-            # skip rsources marked as deleted
-            if resource.storage_object.deleted == True:
-                continue
-            try:
-                RESOURCE_NO += 1
-                root_node = resource.export_to_elementtree()
-                xml_string = to_xml_string(
-                  root_node, encoding="utf-8").encode('utf-8')
-                resource_filename = 'resource-{0}.xml'.format(RESOURCE_NO)
-                out.writestr(resource_filename, xml_string)
-                SUCCESSFUL_EXPORTS += 1
-            
-            except Exception:
-                ERRONEOUS_EXPORTS += 1
-                print 'Could not export resource id={0}!'.format(resource.id)
-                print traceback.format_exc()
+        for start in range(0, len(RESOURCE_IDS), EXPORT_CHUNK_SIZE):
+            resources = list(resourceInfoType_model.objects.filter(
+              id__in=RESOURCE_IDS[start:start + EXPORT_CHUNK_SIZE]) \
+              .order_by('id'))
+            with prefetched_for_export(resources):
+                for resource in resources:
+                    try:
+                        RESOURCE_NO += 1
+                        root_node = resource.export_to_elementtree()
+                        xml_string = to_xml_string(
+                          root_node, encoding="utf-8").encode('utf-8')
+                        resource_filename = 'resource-{0}.xml' \
+                          .format(RESOURCE_NO)
+                        out.writestr(resource_filename, xml_string)
+                        SUCCESSFUL_EXPORTS += 1
+
+                    except Exception:
+                        ERRONEOUS_EXPORTS += 1
+                        print 'Could not export resource id={0}!'.format(
+                          resource.id)
+                        print traceback.format_exc()
     
     print "Done. Successfully exported {0} files from the database, errors " \
       "occured in {1} cases.".format(SUCCESSFUL_EXPORTS, ERRONEOUS_EXPORTS)
@@ -0,0 +1,28 @@
+from haystack.backends.solr_backend import SolrEngine, SolrSearchBackend
+
+from metashare.repository.search_cache import invalidate_search_results
+
+
+class MetashareSolrSearchBackend(SolrSearchBackend):
+    """
+    A Solr search backend which invalidates the cached search results whenever
+    it changes the search index.
+    """
+    def update(self, *args, **kwargs):
+        super(MetashareSolrSearchBackend, self).update(*args, **kwargs)
+        invalidate_search_results()
+
+    def remove(self, *args, **kwargs):
+        super(MetashareSolrSearchBackend, self).remove(*args, **kwargs)
+        invalidate_search_results()
+
+    def clear(self, *args, **kwargs):
+        super(MetashareSolrSearchBackend, self).clear(*args, **kwargs)
+        invalidate_search_results()
+
+
+class MetashareSolrEngine(SolrEngine):
+    """
+    The Solr search engine with the `MetashareSolrSearchBackend`.
+    """
+    backend = MetashareSolrSearchBackend
@@ -24,11 +24,27 @@ except ImportError:
 
 
 def print_usage():
-    print "\n\tusage: {0} [--id-file=idfile] <file.xml|archive.zip> [<file.xml|archive." \
-      "zip> ...]\n".format(sys.argv[0])
+    print "\n\tusage: {0} [--id-file=idfile] [--bulk] [--batch-size=n] [--jobs=n] " \
+      "<file.xml|archive.zip> [<file.xml|archive.zip> ...]\n" \
+      .format(sys.argv[0])
     print "  --id-file=idfile : print identifier of imported resources in idfile"
+    print "  --bulk : import in batched transactions and only index the " \
+      "imported resources instead of rebuilding the whole index"
+    print "  --batch-size=n : number of resources to import per transaction " \
+      "in bulk mode; implies --bulk"
+    print "  --jobs=n : number of processes to parse XML records with in parallel"
     return
 
+
+def open_files(filenames):
+    """
+    Yields pairs of opened file handles and file names for the given file
+    names; each file is closed when the next one is requested.
+    """
+    for filename in filenames:
+        with open(filename, 'rb') as temp_file:
+            yield temp_file, filename
+
 if __name__ == "__main__":
     os.environ['DJANGO_SETTINGS_MODULE'] = 'metashare.settings'
     PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
@@ -39,21 +55,52 @@ if __name__ == "__main__":
         print_usage()
         sys.exit(-1)
     
-    # Check command line options for --id-file
+    # Check command line options for --id-file, --bulk, --batch-size and --jobs
     id_filename = None
+    bulk_import = False
+    batch_size = None
+    jobs = 1
     arg_num=1
-    if sys.argv[arg_num].startswith("--id-file="):
-        opt_len = len("--id-file=")
-        id_filename = sys.argv[arg_num][opt_len:]
-        arg_num = arg_num + 1
-        if len(id_filename) == 0:
+    while arg_num < len(sys.argv) and sys.argv[arg_num].startswith("--"):
+        if sys.argv[arg_num].startswith("--id-file="):
+            opt_len = len("--id-file=")
+            id_filename = sys.argv[arg_num][opt_len:]
+            if len(id_filename) == 0:
+                print "Incorrect option"
+                print_usage()
+                sys.exit(-1)
+        elif sys.argv[arg_num] == "--bulk":
+            bulk_import = True
+        elif sys.argv[arg_num].startswith("--batch-size="):
+            opt_len = len("--batch-size=")
+            try:
+                batch_size = int(sys.argv[arg_num][opt_len:])
+            except ValueError:
+                batch_size = 0
+            if batch_size < 1:
+                print "Incorrect option"
+                print_usage()
+                sys.exit(-1)
+            bulk_import = True
+        elif sys.argv[arg_num].startswith("--jobs="):
+            opt_len = len("--jobs=")
+            try:
+                jobs = int(sys.argv[arg_num][opt_len:])
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                print "Incorrect option"
+                print_usage()
+                sys.exit(-1)
+        else:
             print "Incorrect option"
             print_usage()
             sys.exit(-1)
-        if len(sys.argv) < 3:
-            print_usage()
-            sys.exit(-1)
-        
+        arg_num = arg_num + 1
+    if len(sys.argv) <= arg_num:
+        print_usage()
+        sys.exit(-1)
+
 
     # Check that SOLR is running, or else all resources will stay at status INTERNAL:
     from metashare.repository import verify_at_startup
@@ -65,19 +112,29 @@ if __name__ == "__main__":
     
     successful_imports = []
     erroneous_imports = []
-    from metashare.xml_utils import import_from_file
+    timings = []
+    from metashare.xml_utils import import_from_file, bulk_import_from_files, \
+        BULK_IMPORT_BATCH_SIZE
     from metashare.storage.models import PUBLISHED, MASTER
     from metashare.repository.supermodel import OBJECT_XML_CACHE
     
     # Clean cache before starting the import process.
     OBJECT_XML_CACHE.clear()
     
-    for filename in sys.argv[arg_num:]:
-        temp_file = open(filename, 'rb')
-        success, failure = import_from_file(temp_file, filename, PUBLISHED, MASTER)
-        successful_imports += success
-        erroneous_imports += failure
-        temp_file.close()
+    if bulk_import:
+        # the bulk import takes care of indexing the imported resources itself
+        successful_imports, erroneous_imports = bulk_import_from_files(
+          open_files(sys.argv[arg_num:]), PUBLISHED, MASTER,
+          batch_size=batch_size or BULK_IMPORT_BATCH_SIZE, processes=jobs,
+          timings=timings)
+    else:
+        for filename in sys.argv[arg_num:]:
+            temp_file = open(filename, 'rb')
+            success, failure = import_from_file(temp_file, filename, PUBLISHED,
+              MASTER, processes=jobs, timings=timings)
+            successful_imports += success
+            erroneous_imports += failure
+            temp_file.close()
     
     print "Done.  Successfully imported {0} files into the database, errors " \
       "occurred in {1} cases.".format(len(successful_imports), len(erroneous_imports))
@@ -88,6 +145,15 @@ if __name__ == "__main__":
                 print "\t{}: {}".format(descriptor, ' '.join(exception.args))
             else:
                 print "\t{}: {}".format(descriptor, exception.args)
+    if len(timings) > 0:
+        print "Parsing took {0:.1f}s, importing into the database took " \
+          "{1:.1f}s in total.".format(sum(t[1] for t in timings),
+                                      sum(t[2] for t in timings))
+        print "The slowest files to import were:"
+        for descriptor, parse_time, import_time in \
+                sorted(timings, key=lambda t: t[1] + t[2], reverse=True)[:10]:
+            print "\t{0}: parsing {1:.2f}s, importing {2:.2f}s".format(
+              descriptor, parse_time, import_time)
     
     # Salvatore:
     # This is useful for tracking where the resource is stored.
@@ -100,9 +166,13 @@ if __name__ == "__main__":
         id_file.close()
 
     # Be nice and cleanup cache...
-    _cache_size = sum([len(x) for x in OBJECT_XML_CACHE.values()])
+    _cache_size = OBJECT_XML_CACHE.size()
     OBJECT_XML_CACHE.clear()
-    print "Cleared OBJECT_XML_CACHE ({} bytes)".format(_cache_size)
+    if _cache_size is None:
+        print "Cleared OBJECT_XML_CACHE"
+    else:
+        print "Cleared OBJECT_XML_CACHE ({} bytes)".format(_cache_size)
     
-    from django.core.management import call_command
-    call_command('rebuild_index', interactive=False)
+    if not bulk_import:
+        from django.core.management import call_command
+        call_command('rebuild_resource_index', jobs=jobs)
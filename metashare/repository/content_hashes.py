@@ -0,0 +1,152 @@
+"""
+Keeps the content hashes of schema model instances, which are used by the
+check for duplicates during imports, and their cached serialized XML up to
+date.
+
+The content hash of an instance is computed from its field values and from
+the content hashes of the instances that it owns and of the reusable entities
+that it refers to (see `SchemaModel.compute_content_hash()`). Imports compute
+the content hashes of the instances which they create, bottom-up. Whenever an
+instance is changed outside of an import, the content hashes and the cached
+XML of the instance and of all instances which contain it, directly or
+indirectly, are therefore reset. The reset content hashes are computed again
+by the `backfill_content_hashes` management command, which runs every night,
+or when they are needed. This way a stored content hash or cached XML is
+never outdated.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from metashare.repository.export_prefetch import MAX_LOOKUP_IDS
+from metashare.repository.object_xml_cache import model_object_xml_cache_key
+from metashare.repository.supermodel import OBJECT_XML_CACHE, SchemaModel, \
+    is_import_in_progress
+
+# the state of the content hash invalidation of the current thread
+_INVALIDATION = threading.local()
+
+
+def _get_containers(model, pks):
+    """
+    Returns a dictionary which maps models to the sets of the pks of their
+    instances which directly contain the instances of the given model with
+    the given pks, i.e., their owners, the instances which refer to them and
+    the superclass instances of subclass instances.
+    """
+    result = defaultdict(set)
+    pks = list(pks)
+    for _parent_model in model._meta.parents:
+        result[_parent_model].update(pks)
+    _back_to_fields = [_field for _field in model._meta.fields
+                       if _field.name.startswith('back_to_')]
+    _relations = [_rel for _rel in model._meta.get_all_related_objects()
+        if not _rel.field.rel.parent_link
+            and not _rel.field.name.startswith('back_to_')]
+    _relations.extend(model._meta.get_all_related_many_to_many_objects())
+    # only schema models are serialized to XML
+    _relations = [_rel for _rel in _relations
+                  if issubclass(_rel.model, SchemaModel)]
+    for _start in range(0, len(pks), MAX_LOOKUP_IDS):
+        _chunk = pks[_start:_start + MAX_LOOKUP_IDS]
+        if _back_to_fields:
+            for _values in model.objects.filter(pk__in=_chunk).values_list(
+                    *[_field.attname for _field in _back_to_fields]):
+                for _field, _pk in zip(_back_to_fields, _values):
+                    if _pk is not None:
+                        result[_field.rel.to].add(_pk)
+        for _rel in _relations:
+            result[_rel.model].update(_rel.model.objects.filter(
+                **{'{}__in'.format(_rel.field.name): _chunk}) \
+                .values_list('pk', flat=True))
+    return result
+
+
+def reset_content_hashes(model, pks, containers_only=False):
+    """
+    Resets the content hashes and the cached XML of the instances of the
+    given model with the given pks and of all instances which contain them.
+
+    If containers_only is True, then the given instances themselves are left
+    untouched. Nothing is reset while objects are imported in the current
+    thread as imports only create new instances.
+    """
+    if getattr(_INVALIDATION, 'suspended', False) or is_import_in_progress():
+        return
+    _seen = defaultdict(set)
+    if containers_only:
+        _seen[model].update(pks)
+        _pending = _get_containers(model, pks)
+    else:
+        _pending = defaultdict(set)
+        _pending[model].update(pks)
+    while _pending:
+        _model, _pks = _pending.popitem()
+        _pks = list(_pks - _seen[_model])
+        if not _pks:
+            continue
+        _seen[_model].update(_pks)
+        for _pk in _pks:
+            OBJECT_XML_CACHE.delete(model_object_xml_cache_key(_model, _pk))
+        for _start in range(0, len(_pks), MAX_LOOKUP_IDS):
+            _model.objects.filter(content_hash__isnull=False,
+                pk__in=_pks[_start:_start + MAX_LOOKUP_IDS]) \
+                .update(content_hash=None)
+        for _container_model, _container_pks \
+                in _get_containers(_model, _pks).iteritems():
+            _pending[_container_model].update(_container_pks)
+
+
+@contextmanager
+def deleting_owned_instances(obj):
+    """
+    A context manager for deleting the given instance together with the
+    instances which it owns: only the content hashes of the instances which
+    contain the given instance are reset, once, instead of resetting those of
+    the containers of every single deleted instance.
+    """
+    reset_content_hashes(type(obj), [obj.pk], containers_only=True)
+    _INVALIDATION.suspended = True
+    try:
+        yield
+    finally:
+        _INVALIDATION.suspended = False
+
+
+# pylint: disable-msg=W0613
+@receiver(pre_delete)
+def _reset_deleted_instance_containers(sender, instance, **kwargs):
+    """
+    Resets the content hashes of the instances which contain the given
+    schema model instance that is about to be deleted.
+    """
+    if isinstance(instance, SchemaModel):
+        reset_content_hashes(type(instance), [instance.pk],
+                             containers_only=True)
+
+
+# pylint: disable-msg=W0613
+@receiver(m2m_changed)
+def _reset_changed_relation_hashes(sender, instance, action, reverse, model,
+                                   pk_set, **kwargs):
+    """
+    Resets the content hashes of the instances whose many-to-many relations
+    have changed and of all instances which contain them.
+    """
+    if not isinstance(instance, SchemaModel):
+        return
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reset_content_hashes(type(instance), [instance.pk])
+    elif action in ('post_add', 'post_remove') and pk_set:
+        reset_content_hashes(model, pk_set)
+    elif action == 'pre_clear':
+        # the instances which are about to lose the relation are only known
+        # before it is cleared
+        for _field in model._meta.many_to_many:
+            if _field.rel.through is sender:
+                reset_content_hashes(model, model.objects.filter(
+                    **{_field.name: instance}).values_list('pk', flat=True))
@@ -0,0 +1,120 @@
+"""
+Set-based deletion of the owned object graphs of schema model instances as
+done by `SchemaModel.delete_deep()`.
+
+The instances which are owned by an instance, i.e., which are reachable
+through one-to-one fields and reverse foreign keys (`..._set` fields), are
+planned from the schema metadata (`__schema_fields__`) with one query per
+model type and relation. They are then deleted together, table by table in
+dependency order, instead of deleting one instance at a time.
+"""
+
+import logging
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.db.models import OneToOneField
+from django.db.models.deletion import Collector
+from django.db.models.fields import FieldDoesNotExist, related
+
+from metashare.repository.content_hashes import deleting_owned_instances
+from metashare.repository.export_prefetch import MAX_LOOKUP_IDS
+from metashare.repository.models import resourceInfoType_model
+from metashare.repository.reference_index import removing_references_in_bulk
+from metashare.repository.supermodel import SubclassableModel
+from metashare.settings import LOG_HANDLER
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+
+def plan_deep_deletion(obj):
+    """
+    Returns a dictionary which maps models to the sets of the pks of their
+    instances which are owned by the given instance, including the instance
+    itself.
+
+    Many-to-one and many-to-many relations, i.e., reusable entities, are not
+    followed.
+    """
+    _planned = defaultdict(set)
+    _pending = defaultdict(set)
+    _pending[type(obj)].add(obj.pk)
+    while _pending:
+        model, pks = _pending.popitem()
+        pks = list(pks - _planned[model])
+        if not pks:
+            continue
+        _planned[model].update(pks)
+        if issubclass(model, SubclassableModel):
+            _plan_subclasses(model, pks, _pending)
+        for _field_name in model.get_fields_flat():
+            _plan_field(model, _field_name, pks, _pending)
+    return _planned
+
+
+def _plan_subclasses(model, pks, pending):
+    """
+    Schedules the subclass instances of the SubclassableModel instances with
+    the given pks for being planned.
+    """
+    for _subclass in model.__subclasses__():
+        if _subclass._meta.abstract or _subclass._meta.proxy:
+            continue
+        for _start in range(0, len(pks), MAX_LOOKUP_IDS):
+            pending[_subclass].update(_subclass.objects.filter(
+                pk__in=pks[_start:_start + MAX_LOOKUP_IDS]) \
+                .values_list('pk', flat=True))
+
+
+def _plan_field(model, field_name, pks, pending):
+    """
+    Schedules the instances which are owned by the instances of the given
+    model with the given pks through the given field for being planned.
+    """
+    _descriptor = getattr(model, field_name, None)
+    if isinstance(_descriptor, related.ForeignRelatedObjectsDescriptor):
+        _child_model = _descriptor.related.model
+        _lookup = '{}__in'.format(_descriptor.related.field.name)
+        for _start in range(0, len(pks), MAX_LOOKUP_IDS):
+            pending[_child_model].update(_child_model.objects.filter(
+                **{_lookup: pks[_start:_start + MAX_LOOKUP_IDS]}) \
+                .values_list('pk', flat=True))
+        return
+    try:
+        _field = model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        return
+    if isinstance(_field, OneToOneField):
+        for _start in range(0, len(pks), MAX_LOOKUP_IDS):
+            pending[_field.rel.to].update(_pk for _pk in model.objects \
+                .filter(pk__in=pks[_start:_start + MAX_LOOKUP_IDS]) \
+                .values_list(_field.attname, flat=True) if _pk is not None)
+
+
+@transaction.commit_on_success
+def delete_deep(obj, keep_stats=False):
+    """
+    Deletes the given instance together with all instances which it owns;
+    see `SchemaModel.delete_deep()`.
+    """
+    _plan = plan_deep_deletion(obj)
+    with removing_references_in_bulk(_plan), deleting_owned_instances(obj):
+        if isinstance(obj, resourceInfoType_model):
+            # the deletion of a resource also updates the statistics and the
+            # recommendations
+            _plan[type(obj)].discard(obj.pk)
+            obj.delete(keep_stats=keep_stats)
+        _collector = Collector(
+            using=router.db_for_write(type(obj), instance=obj))
+        for _model, _pks in _plan.iteritems():
+            _pks = list(_pks)
+            for _start in range(0, len(_pks), MAX_LOOKUP_IDS):
+                _collector.collect(_model.objects.filter(
+                    pk__in=_pks[_start:_start + MAX_LOOKUP_IDS]))
+        # deletes the collected instances model by model in dependency order
+        _collector.delete()
+    LOGGER.debug(u'Deleted {0} owned instances.'.format(
+        sum(len(_pks) for _pks in _plan.itervalues())))
@@ -12,11 +12,12 @@ from metashare.repository.models import personInfoType_model, \
     targetResourceInfoType_model, languageVarietyInfoType_model, \
     sizeInfoType_model, annotationInfoType_model, videoFormatInfoType_model, \
     imageFormatInfoType_model, resolutionInfoType_model, \
-    audioSizeInfoType_model
-from metashare.storage.models import MASTER
+    audioSizeInfoType_model, LookupEntry
 import logging
 from metashare.settings import LOG_HANDLER
-from metashare.repository.model_utils import get_root_resources
+from metashare.repository.lookup_index import get_organization_label, \
+    get_project_label
+from metashare.repository.reference_index import count_resources
 
 # Setup logging support.
 LOGGER = logging.getLogger(__name__)
@@ -35,78 +36,77 @@ def print_query_results(results):
             LOGGER.debug(u'No results')
     return
 
-class PersonLookup(ModelLookup):
-    model = personInfoType_model
+class IndexedLookup(ModelLookup):
+    '''
+    A reusable base class for lookups which search the names of the master
+    copies in the `LookupEntry` index (see lookup_index.py) with a single
+    query rather than loading and matching all instances by hand.
+
+    The found items are index entries; the editor widgets may still pass
+    actual model instances for the initial values of their fields.
+    '''
+    # whether the labels tell how many resources use an item
+    show_usage_count = True
 
     def get_query(self, request, term):
-        #results = super(PersonLookup, self).get_query(request, term)
-        # Since MultiTextFields cannot be searched using query sets (they are base64-encoded and pickled),
-        # we must do the searching by hand.
-        # Note: this is inefficient, but in practice fast enough it seems (tested with >1000 resources)
-        lcterm = term.lower()
-        def matches(person):
-            'Helper function to group the search code for a person'
-            for multifield in (person.surname, person.givenName):
-                for field in multifield.itervalues():
-                    if lcterm in field.lower():
-                        return True
-            return False
-        persons = self.get_queryset().filter(copy_status = MASTER)
-        if term == '*':
-            results = persons
-        else:
-            results = [p for p in persons if matches(p)]
+        results = LookupEntry.objects.filter(
+            model_name=self.model.__name__, master=True)
+        if term != '*':
+            results = results.filter(names__contains=term.lower())
+        results = results.order_by('object_id')
         print_query_results(results)
         return results
 
+    def get_item_id(self, item):
+        if isinstance(item, LookupEntry):
+            return item.object_id
+        return super(IndexedLookup, self).get_item_id(item)
+
+    def get_item_value(self, item):
+        if isinstance(item, LookupEntry):
+            return item.value
+        return super(IndexedLookup, self).get_item_value(item)
+
+    def get_item_label(self, item):
+        if isinstance(item, LookupEntry):
+            return item.label
+        return self.get_instance_label(item)
+
+    def get_instance_label(self, item):
+        '''
+        Returns the label of the given model instance.
+        '''
+        return super(IndexedLookup, self).get_item_label(item)
+
     def format_item(self, item):
-        fmt_item = super(PersonLookup, self).format_item(item)
-        count = get_root_resources(item).__len__()
+        fmt_item = super(IndexedLookup, self).format_item(item)
+        if not self.show_usage_count:
+            return fmt_item
+        if isinstance(item, LookupEntry):
+            count = item.usage_count
+        else:
+            count = count_resources(item)
         lab = fmt_item['label']
         fmt_item['label'] = ungettext(_AUTO_SUGGEST_SG_TPL,
             _AUTO_SUGGEST_PL_TPL, count) % {'label': lab, 'count': count}
         return fmt_item
 
-class GenericUnicodeLookup(ModelLookup):
+class PersonLookup(IndexedLookup):
+    model = personInfoType_model
+
+class GenericUnicodeLookup(IndexedLookup):
     '''
-    A reusable base class for lookups that have to be carried out by hand
-    (rather than using querysets to do an efficient database search),
-    doing string matching on the unicode string representing a database item.
+    A reusable base class for lookups of superclass models which are done on
+    the unicode string representing a database item and whose items are
+    annotated with their actual subclass.
     '''
-    def get_query(self, request, term):
-        # Since Subclassables and some other classes cannot be searched using query sets,
-        # we must do the searching by hand.
-        # Note: this is inefficient, but in practice fast enough it seems (tested with >1000 resources)
-        lcterm = term.lower()
-        def matches(item):
-            'Helper function to group the search code for a database item'
-            if hasattr(item, 'as_subclass'):
-                if hasattr(item.as_subclass(), 'copy_status'):
-                    if item.as_subclass().copy_status != MASTER:
-                        return False 
-            return lcterm in unicode(item).lower()
-        
-        items = self.get_queryset()
-        if term == '*':
-            results = items
-        else:
-            results = [p for p in items if matches(p)]
-        results = self.filter_results(results)
-        print_query_results(results)
-        return results
-    
     def format_item(self, item):
         fmt_item = super(GenericUnicodeLookup, self).format_item(item)
-        count = get_root_resources(item).__len__()
-        lab = fmt_item['label']
-        fmt_item['label'] = ungettext(_AUTO_SUGGEST_SG_TPL,
-            _AUTO_SUGGEST_PL_TPL, count) % {'label': lab, 'count': count}
-        if hasattr(item, 'as_subclass'):
+        if isinstance(item, LookupEntry):
+            fmt_item['cls'] = item.subclass
+        elif hasattr(item, 'as_subclass'):
             fmt_item['cls'] = item.as_subclass().__class__.__name__.lower()
         return fmt_item
-    
-    def filter_results(self, results):
-        return results
 
 class ActorLookup(GenericUnicodeLookup):
     model = actorInfoType_model
@@ -119,10 +119,6 @@ class DocumentationLookup(GenericUnicodeLookup):
     '''
     model = documentationInfoType_model
 
-    def filter_results(self, results):
-        filtered_results = [p for p in results if p.as_subclass().__class__ == documentInfoType_model]
-        return filtered_results
-
 class MembershipDummyLookup(ModelLookup):
     '''
         Dummy class for use with OneToOneWidget.
@@ -183,75 +179,18 @@ class AudioSizeDummyLookup(ModelLookup):
     model = audioSizeInfoType_model
 
 
-class ProjectLookup(ModelLookup):
+class ProjectLookup(IndexedLookup):
     model = projectInfoType_model
-    search_fields = ('projectName__contains', )
-    filters = {}
-    
-    def get_query(self, request, term):
-        lcterm = term.lower()
-        
-        def matches(project):
-            'Helper function to group the search code for a project'
-            for multifield in (project.projectName, project.projectShortName):
-                for field in multifield.itervalues():
-                    if lcterm in field.lower():
-                        return True
-            return False
-        
-        projects = self.get_queryset().filter(copy_status = MASTER)
-        if term == '*':
-            results = projects
-        else:
-            results = [p for p in projects if matches(p)]
-        print_query_results(results)
-        return results
-    
-    def get_item_label(self, item):
-        short_names = ''.join(item.projectShortName.itervalues())
-        names = ''.join(item.projectName.itervalues())
-        res = u'%s: %s' % (short_names, names)
-        return res
-    
-    def get_item_id(self, item):
-        return item.id
 
-    def format_item(self, item):
-        fmt_item = super(ProjectLookup, self).format_item(item)
-        count = get_root_resources(item).__len__()
-        lab = fmt_item['label']
-        fmt_item['label'] = ungettext(_AUTO_SUGGEST_SG_TPL,
-            _AUTO_SUGGEST_PL_TPL, count) % {'label': lab, 'count': count}
-        return fmt_item
-    
-class OrganizationLookup(ModelLookup):
+    def get_instance_label(self, item):
+        return get_project_label(item)
+
+class OrganizationLookup(IndexedLookup):
     model = organizationInfoType_model
-    
-    def get_query(self, request, term):
-        # Since MultiTextFields cannot be searched using query sets (they are base64-encoded and pickled),
-        # we must do the searching by hand.
-        # Note: this is inefficient, but in practice fast enough it seems (tested with >1000 resources)
-        lcterm = term.lower()
-        def matches(org):
-            'Helper function to group the search code for a person'
-            for multifield in (org.organizationShortName, org.organizationName):
-                for field in multifield.itervalues():
-                    if lcterm in field.lower():
-                        return True
-            return False
-        orgs = self.get_queryset().filter(copy_status = MASTER)
-        if term == '*':
-            results = orgs
-        else:
-            results = [p for p in orgs if matches(p)]
-        print_query_results(results)
-        return results
+    show_usage_count = False
 
-    def get_item_label(self, item):
-        short_names = ''.join(item.organizationShortName.itervalues())
-        names = ''.join(item.organizationName.itervalues())
-        res = u'%s: %s' % (short_names, names)
-        return res
+    def get_instance_label(self, item):
+        return get_organization_label(item)
     
 
 class DocumentLookup(GenericUnicodeLookup):
@@ -1,6 +1,7 @@
 
 from django.conf import settings
 from metashare.repository.model_utils import get_root_resources
+from metashare.repository.reference_index import count_resources
 
 def find_related_objects(inst):
     inst_model = inst.__class__
@@ -61,8 +62,6 @@ class AdminRelatedInfo(object):
     related_resources.allow_tags = True
     
     def num_related_resources(self, obj):
-        rel_objects = get_root_resources(obj)
-        count = rel_objects.__len__()
-        return count
+        return count_resources(obj)
     
     
\ No newline at end of file
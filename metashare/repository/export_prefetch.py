@@ -0,0 +1,222 @@
+"""
+Batched loading of the object graphs of schema model instances for exporting
+them to XML with a constant number of database queries per model type.
+
+The related objects which `SchemaModel.export_to_elementtree()` would
+otherwise load one query at a time are planned from the schema metadata
+(`__schema_fields__`), loaded with one query per model type and relation and
+attached to the instances, from where the export picks them up.
+"""
+
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models.fields import FieldDoesNotExist, related
+
+from metashare.repository.supermodel import SubclassableModel
+from metashare.settings import LOG_HANDLER
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+# the maximum number of ids in a single `__in` lookup; SQLite does not allow
+# more than 999 query parameters
+MAX_LOOKUP_IDS = 500
+
+
+@contextmanager
+def prefetched_for_export(objects):
+    """
+    A context manager which prefetches everything that is required for
+    exporting the given schema model instances and which discards the
+    prefetched data again when leaving the context, so that later exports do
+    not see outdated data.
+    """
+    _prepared = prefetch_for_export(objects)
+    try:
+        yield
+    finally:
+        clear_export_prefetch(_prepared)
+
+
+def prefetch_for_export(objects):
+    """
+    Loads the complete object graphs of the given schema model instances which
+    are required for exporting them using `export_to_elementtree()`.
+
+    Returns a list of all instances of the object graphs which have been
+    prepared; see clear_export_prefetch().
+    """
+    _prefetcher = _ExportPrefetcher()
+    _prefetcher.add(objects)
+    _prefetcher.run()
+    return _prefetcher.prepared.values()
+
+
+def clear_export_prefetch(objects):
+    """
+    Discards the data which has been prefetched for the given instances as
+    returned by prefetch_for_export().
+    """
+    for obj in objects:
+        for _attr in ('_export_prefetched', '_export_subclass'):
+            if _attr in obj.__dict__:
+                delattr(obj, _attr)
+
+
+def _chunks(values):
+    """
+    Yields the given list of values in chunks of at most MAX_LOOKUP_IDS.
+    """
+    for _start in range(0, len(values), MAX_LOOKUP_IDS):
+        yield values[_start:_start + MAX_LOOKUP_IDS]
+
+
+def _in_bulk(model, ids):
+    """
+    Returns a dictionary mapping the given primary keys to instances of the
+    given model.
+    """
+    _result = {}
+    for _chunk in _chunks(list(ids)):
+        _result.update(model.objects.in_bulk(_chunk))
+    return _result
+
+
+class _ExportPrefetcher(object):
+    """
+    Walks object graphs breadth-first, one batch of instances of the same
+    model type at a time.
+    """
+    def __init__(self):
+        # maps (model, primary key) to the single instance which represents
+        # the corresponding object in all prefetched graphs
+        self.prepared = {}
+        # maps models to the lists of their instances which are still to be
+        # prepared
+        self._pending = defaultdict(list)
+
+    def add(self, objects):
+        """
+        Returns the representative instances for the given instances and
+        schedules the new ones for being prepared.
+        """
+        _result = []
+        for obj in objects:
+            _key = (type(obj), obj.pk)
+            if _key not in self.prepared:
+                self.prepared[_key] = obj
+                self._pending[type(obj)].append(obj)
+            _result.append(self.prepared[_key])
+        return _result
+
+    def run(self):
+        """
+        Prepares all scheduled instances including the ones discovered in the
+        meantime.
+        """
+        while self._pending:
+            model, objects = self._pending.popitem()
+            if issubclass(model, SubclassableModel):
+                self._resolve_subclasses(model, objects)
+            if model.__schema_name__ == 'SUBCLASSABLE':
+                # the export is delegated to the subclass instances
+                continue
+            for obj in objects:
+                obj._export_prefetched = {}
+            _ids = [obj.pk for obj in objects]
+            for _xsd_field, _model_field, _ in model.__schema_fields__:
+                if _model_field in objects[0]._export_prefetched:
+                    # the same model field may be listed for several XSD names
+                    continue
+                self._prefetch_field(model, _model_field, objects, _ids)
+
+    def _prefetch_field(self, model, model_field, objects, ids):
+        """
+        Loads the related objects of the given model field for all given
+        instances with the given primary keys.
+        """
+        _descriptor = getattr(model, model_field, None)
+        if isinstance(_descriptor, related.ForeignRelatedObjectsDescriptor):
+            self._prefetch_reverse_foreign_key(_descriptor.related, model_field,
+                                               objects, ids)
+            return
+        try:
+            _field = model._meta.get_field_by_name(model_field)[0]
+        except FieldDoesNotExist:
+            return
+        if isinstance(_field, related.ManyToManyField):
+            self._prefetch_many_to_many(_field, objects, ids)
+        elif isinstance(_field, related.ForeignKey) \
+                and _field.rel.get_related_field().primary_key:
+            self._prefetch_foreign_key(_field, objects)
+
+    def _prefetch_foreign_key(self, field, objects):
+        """
+        Fills Django's cache of the given foreign key or one-to-one field.
+        """
+        _targets = _in_bulk(field.rel.to, set(getattr(obj, field.attname)
+          for obj in objects if getattr(obj, field.attname) is not None))
+        _cache_name = field.get_cache_name()
+        for obj in objects:
+            _target = _targets.get(getattr(obj, field.attname))
+            if _target is not None:
+                setattr(obj, _cache_name, self.add([_target])[0])
+
+    def _prefetch_many_to_many(self, field, objects, ids):
+        """
+        Loads the objects of the given many-to-many field, ordered by id.
+        """
+        _through = field.rel.through
+        _source = field.m2m_field_name()
+        _target = field.m2m_reverse_field_name()
+        _links = []
+        for _chunk in _chunks(ids):
+            _links.extend(_through.objects \
+              .filter(**{'{}__in'.format(_source): _chunk}) \
+              .values_list(_source, _target))
+        _targets = _in_bulk(field.rel.to, set(_t for _, _t in _links))
+        _related = defaultdict(list)
+        for _source_id, _target_id in sorted(_links, key=lambda l: l[1]):
+            if _target_id in _targets:
+                _related[_source_id].append(_targets[_target_id])
+        for obj in objects:
+            obj._export_prefetched[field.name] = self.add(_related[obj.pk])
+
+    def _prefetch_reverse_foreign_key(self, relation, model_field, objects,
+                                      ids):
+        """
+        Loads the objects of the given reverse foreign key relation (e.g., a
+        `..._model_set` field), ordered by id.
+        """
+        _field = relation.field
+        _related = defaultdict(list)
+        for _chunk in _chunks(ids):
+            for _child in relation.model.objects \
+                    .filter(**{'{}__in'.format(_field.name): _chunk}) \
+                    .order_by('id'):
+                _related[getattr(_child, _field.attname)].append(_child)
+        for obj in objects:
+            obj._export_prefetched[model_field] = self.add(_related[obj.pk])
+
+    def _resolve_subclasses(self, model, objects):
+        """
+        Determines the subclass instances of the given SubclassableModel
+        instances as returned by `as_subclass()`.
+        """
+        _unresolved = dict((obj.pk, obj) for obj in objects)
+        for _subclass in model.__subclasses__():
+            if not _unresolved:
+                break
+            if _subclass._meta.abstract or _subclass._meta.proxy:
+                continue
+            for _pk, _sub_instance in \
+                    _in_bulk(_subclass, _unresolved.keys()).iteritems():
+                _unresolved.pop(_pk)._export_subclass = \
+                    self.add([_sub_instance])[0]
+        for obj in _unresolved.itervalues():
+            # as_subclass() must not look for subclass instances again
+            obj._export_subclass = obj
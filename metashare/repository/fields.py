@@ -1,4 +1,5 @@
 import base64
+import json
 from django.contrib.admin import widgets
 
 try:
@@ -10,6 +11,7 @@ from django import forms
 from django.core import exceptions, validators
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q
 from django.utils.encoding import force_unicode
 from django.utils.functional import curry
 from django.utils.text import capfirst
@@ -25,6 +27,35 @@ from metashare.repository.editor import form_fields
 # related Django code inside django.db.models.fields in case of problems.
 
 
+def encode_multitext(values):
+    """
+    Returns the DB representation of the given list of `MultiTextField`
+    values, a JSON array without any superfluous whitespace.
+    """
+    return json.dumps([force_unicode(value) for value in values],
+                      ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_multitext(value):
+    """
+    Returns the list of values of the given DB representation of a
+    `MultiTextField`, either in JSON or in the legacy Base64-encoded, pickle'd
+    format.
+    """
+    # the Base64 alphabet does not contain brackets
+    if value.startswith('['):
+        return json.loads(value)
+    return pickle.loads(base64.b64decode(value))
+
+
+def is_legacy_multitext(value):
+    """
+    Returns whether the given DB representation of a `MultiTextField` is in
+    the legacy Base64-encoded, pickle'd format.
+    """
+    return bool(value) and not value.startswith('[')
+
+
 # pylint: disable-msg=E1102
 class MetaBooleanField(models.NullBooleanField):
     """
@@ -66,13 +97,15 @@ class MultiTextField(models.Field):
     """
     TextField which allows storage of several Strings in one field.
     
-    NOTE: due to the Base64-encoded String that is used to store the value(s)
-    of a MultiTextField, it is NOT POSSIBLE to access value(s) from instances
-    of this field type in QuerySet operations!
+    The value(s) of a MultiTextField are stored as a compact JSON array of
+    (unescaped) unicode Strings, e.g., `["first","second"]`. This allows for
+    simple text lookups in QuerySet operations like `url__icontains='foo'`;
+    note, however, that such lookups match the JSON representation and not
+    the single values.
     
-    If you need to work on MultiTextField instances for filtering, etc. you
-    have to retrieve the "real" object instances and check the respective
-    fields of type MultiTextField using "obj.attr" field access.
+    Values which have been stored in the legacy Base64-encoded, pickle'd
+    format can still be read; they are converted when the object is saved
+    again or when running the `migrate_multitext_fields` management command.
     
     Django will auto-magically convert the raw database representation of the
     MultiTextField value(s) to a Python list of Strings during runtime.
@@ -161,13 +194,11 @@ class MultiTextField(models.Field):
         if not value:
             value = []
 
-        # Before converting the value to Base64-encoded, pickle'd format, we
-        # have to assert that we are treating a list or tuple type!
+        # Before converting the value to JSON, we have to assert that we are
+        # treating a list or tuple type!
         assert(isinstance(value, list) or isinstance(value, tuple))
         
-        # We convert the value list into a Base64-encoded String that contains
-        # a pickle'd representation of value.
-        return base64.b64encode(pickle.dumps(value))
+        return encode_multitext(value)
 
     def to_python(self, value):
         # If we don't have a value, we return an empty list.
@@ -178,11 +209,12 @@ class MultiTextField(models.Field):
         if isinstance(value, list):
             return value
 
-        # Otherwise, we expect value to be a Base64-encoded String which in
-        # turn contains a pickle'd Python list.  We try to decode and loads
-        # this into a Python list which is returned as this field's value.
+        # Otherwise, we expect value to be a JSON array or a legacy
+        # Base64-encoded String which in turn contains a pickle'd Python list.
+        # We try to decode this into a Python list which is returned as this
+        # field's value.
         try:
-            return pickle.loads(base64.b64decode(value))
+            return decode_multitext(value)
 
         # In case of problems, we create a list containing information about
         # the exception we have encountered. This is useful for debugging.
@@ -190,6 +222,27 @@ class MultiTextField(models.Field):
             return [u'Exception for value {} ({})'.format(value, type(value))]
 
 
+class _MultiSelectCodec(object):
+    """
+    The precomputed tables for encoding and decoding the values of a
+    `MultiSelectField` with the given choices.
+    """
+    def __init__(self, choices):
+        # the number of hexadecimal digits of an encoded value
+        self.num_digits = 1 + len(choices) / 4
+        # maps choice values to their index positions
+        self.indices = dict((choice[0], index)
+                            for index, choice in enumerate(choices))
+        # (choice value, bit mask) tuples in the order of the choices
+        self.masks = [(choice[0], 1 << (self.num_digits * 4 - 1 - index))
+                      for index, choice in enumerate(choices)]
+        self.masks_dict = dict(self.masks)
+        # maps choice values to their human-readable labels
+        self.labels = dict(choices)
+        # maps encoded values to the tuples of their choice values
+        self.decoded = {}
+
+
 # pylint: disable-msg=W0201
 class MultiSelectField(models.Field):
     """
@@ -197,31 +250,40 @@ class MultiSelectField(models.Field):
     """
     __metaclass__ = models.SubfieldBase
 
-    # Maps 1-digit hexadecimal numbers to their corresponding bit quadruples.
-    __HEX_TO_BITS__ = {
-      'f': (1,1,1,1), 'e': (1,1,1,0), 'd': (1,1,0,1), 'c': (1,1,0,0),
-      'b': (1,0,1,1), 'a': (1,0,1,0), '9': (1,0,0,1), '8': (1,0,0,0),
-      '7': (0,1,1,1), '6': (0,1,1,0), '5': (0,1,0,1), '4': (0,1,0,0),
-      '3': (0,0,1,1), '2': (0,0,1,0), '1': (0,0,0,1), '0': (0,0,0,0)
-    }
-    
-    # Maps bit quadruples to their hexadecimal correspondents.
-    __BITS_TO_HEX__ = {
-      (1,1,1,1): 'f', (1,1,1,0): 'e', (1,1,0,1): 'd', (1,1,0,0): 'c',
-      (1,0,1,1): 'b', (1,0,1,0): 'a', (1,0,0,1): '9', (1,0,0,0): '8',
-      (0,1,1,1): '7', (0,1,1,0): '6', (0,1,0,1): '5', (0,1,0,0): '4',
-      (0,0,1,1): '3', (0,0,1,0): '2', (0,0,0,1): '1', (0,0,0,0): '0'
-    }
+    # The selected choices are stored as a hexadecimal String which encodes a
+    # bit vector of 1 + len(choices) / 4 * 4 bits; the most significant bit
+    # denotes whether the first choice is selected, the next bit whether the
+    # second choice is selected, etc.
+    #
+    # Example: if we have 3 possible choices A, B, C and our value list
+    # contains [A, C], we would store the bit vector 1010, i.e., 'a'.
+
+    # the maximum number of decoded values which are remembered per field
+    MAX_DECODED_VALUES = 1000
+
+    # the hexadecimal digits whose bits at index positions 0..3 are set
+    __HEX_DIGITS_WITH_BIT__ = tuple(
+      ''.join('{0:x}{0:X}'.format(digit) for digit in range(16)
+              if digit & (8 >> _pos))
+      for _pos in range(4))
+
+    def _get_codec(self):
+        """
+        Returns the tables for encoding and decoding values of this field,
+        which are only computed once per field.
+        """
+        try:
+            return self._codec
+        except AttributeError:
+            self._codec = _MultiSelectCodec(self.choices)
+            return self._codec
 
     @classmethod
     def _get_FIELD_display(cls, self, field):
         """
         Returns a String containing the "human-readable" values of the field.
         """
-        values = getattr(self, field.attname)
-        choices_dict = dict(field.choices)
-        return u', '.join([force_unicode(choices_dict.get(value, value),
-          strings_only=True) for value in values])
+        return u', '.join(cls._get_FIELD_display_list(self, field))
 
     @classmethod
     def _get_FIELD_display_list(cls, self, field):
@@ -229,10 +291,32 @@ class MultiSelectField(models.Field):
         Returns a list containing the "human-readable" values of the field.
         """
         values = getattr(self, field.attname)
-        choices_dict = dict(field.choices)
+        choices_dict = field._get_codec().labels
         return [force_unicode(choices_dict.get(value, value),
           strings_only=True) for value in values]
 
+    def get_includes_query(self, *values, **kwargs):
+        """
+        Returns a `Q` object which selects all model instances whose value of
+        this field includes all of the given choice values.
+
+        The query is evaluated in the database by checking the hexadecimal
+        digits which contain the bits of the given choices. Any `lookup_path`
+        keyword argument is used instead of the field name, e.g., for
+        filtering the instances of another model by a related model's field.
+        """
+        lookup = '{0}__regex'.format(kwargs.get('lookup_path', self.name))
+        indices = self._get_codec().indices
+        query = Q()
+        for value in values:
+            if value not in indices:
+                raise ValueError(u'{0} is not a valid choice of {1}'
+                                 .format(value, self.name))
+            index = indices[value]
+            query &= Q(**{lookup: u'^.{{{0}}}[{1}]'.format(index / 4,
+                self.__HEX_DIGITS_WITH_BIT__[index % 4])})
+        return query
+
     def contribute_to_class(self, cls, name):
         """
         Adds get_FOO_display(), get_FOO_display_list() methods to this class.
@@ -300,36 +384,13 @@ class MultiSelectField(models.Field):
         # an exception for ill-typed values.
         assert(isinstance(value, list))
 
-        # We now want to convert the list of values into a bit vector matching
-        # the values' index positions inside list(enumerate(self.choices))...
-        #
-        # For this, we first create a list of "bits", defaulting to 0.  The
-        # length of this list is (1 + len(self.choices) / 4) * 4 as we will
-        # convert quadruples of (a,b,c,d) to their hexadecimal counterparts.
-        # 
-        # The resulting list already has the right amount of zero padding.
-        bits = [0] * (1 + len(self.choices) / 4) * 4
-
-        # We iterate over the enumerated choices and compare each choice value
-        # with the current list of selected values.  If there is a match, we
-        # store a 1 in the right index position of the bits list.
-        #
-        # Example: if we have 3 possible choices A, B, C and our value list
-        # contains [A, C], we would create the following bits list [1,0,1].
-        for index, choice in enumerate(self.choices):
-            if choice[0] in value:
-                bits[index] = 1
-
-        # The bits list has to be converted into a hexadecimal String.  To do
-        # so, we take all (1 + len(self.choicese) / 4) quadruples inside the
-        # bits list and map them to their hexadecimal correspondent.
-        values = ''
-        for index in range(len(bits)/4):
-            offset = index * 4
-            values += self.__BITS_TO_HEX__[tuple(bits[offset:offset+4])]
-
-        # Finally, we return the resulting hexadecimal String.
-        return values
+        # We combine the bit masks of all selected choices and format the
+        # resulting bit vector as a zero-padded hexadecimal String.
+        codec = self._get_codec()
+        bits = 0
+        for _value in set(value):
+            bits |= codec.masks_dict.get(_value, 0)
+        return '{0:0{1}x}'.format(bits, codec.num_digits)
 
     def to_python(self, value):
         """
@@ -347,26 +408,26 @@ class MultiSelectField(models.Field):
         # raise an exception for ill-typed values.
         assert(isinstance(value, basestring))
 
-        # We iterate over all characters of the hexadecimal String and convert
-        # it to the corresponding bits quadruple.  Using these data, we can
-        # then compute the index positions of selected choices for this field.
-        indices = []
-        for index in range(len(value.lower())):
-            offset = index * 4
-            _value = self.__HEX_TO_BITS__[value[index]]
-            for _pos in range(4):
-                if _value[_pos]:
-                    indices.append(offset + _pos)
-
-        # Now that we know the index positions of all selected choices, we
-        # simply have to convert these to the corresponding choice values.
-        values = []
-        for index, choice in enumerate(self.choices):
-            if index in indices:
-                values.append(choice[0])
+        # Values which have been decoded before are looked up; there is only a
+        # limited number of different combinations of choices in practice.
+        codec = self._get_codec()
+        decoded = codec.decoded
+        try:
+            return list(decoded[value])
+        except KeyError:
+            pass
+
+        # We convert the hexadecimal String into the bit vector and collect
+        # the values of all choices whose bits are set, in the order of the
+        # choices.
+        bits = int(value, 16)
+        values = tuple(choice for choice, mask in codec.masks if bits & mask)
+        if len(decoded) >= self.MAX_DECODED_VALUES:
+            decoded.clear()
+        decoded[value] = values
 
         # Finally, we return the list of selected choice values.
-        return values
+        return list(values)
 
     def validate(self, value, model_instance):
         """
@@ -392,6 +453,66 @@ class MultiSelectField(models.Field):
         return self.get_prep_value(self._get_val_from_obj(obj))
 
 
+class DefaultCachingDict(dict):
+    """
+    A dictionary which remembers its default value as determined by the
+    `default_retriever` of a `DictField` until the dictionary is changed.
+
+    `DictField`s decode their DB values into instances of this class, so the
+    default value of a field, e.g., the resource name in the preferred
+    language, is only determined once per model instance.
+    """
+    def get_default(self, retriever):
+        """
+        Returns the default value of this dictionary as determined by the
+        given retriever function.
+        """
+        _cached = self.__dict__.get('_default')
+        if _cached is None or _cached[0] is not retriever:
+            _cached = (retriever, retriever(self))
+            self._default = _cached
+        return _cached[1]
+
+    def _changed(self):
+        """
+        Discards the remembered default value.
+        """
+        self.__dict__.pop('_default', None)
+
+    def __getstate__(self):
+        # the remembered default value is not pickled as its retriever may not
+        # be picklable
+        return {}
+
+    def __setitem__(self, key, value):
+        self._changed()
+        super(DefaultCachingDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        super(DefaultCachingDict, self).__delitem__(key)
+
+    def clear(self):
+        self._changed()
+        super(DefaultCachingDict, self).clear()
+
+    def pop(self, *args):
+        self._changed()
+        return super(DefaultCachingDict, self).pop(*args)
+
+    def popitem(self):
+        self._changed()
+        return super(DefaultCachingDict, self).popitem()
+
+    def setdefault(self, key, default=None):
+        self._changed()
+        return super(DefaultCachingDict, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._changed()
+        super(DefaultCachingDict, self).update(*args, **kwargs)
+
+
 class DictField(models.Field):
     """
     A model field which represents a Python dictionary.
@@ -502,8 +623,9 @@ class DictField(models.Field):
         # assert that we are treating a dictionary
         assert(isinstance(value, dict))
         # we convert the value list into a Base64-encoded String that contains
-        # a pickle'd representation of value
-        return base64.b64encode(pickle.dumps(value))
+        # a pickle'd representation of value; the DB representation always
+        # contains a plain dictionary
+        return base64.b64encode(pickle.dumps(dict(value)))
 
     def to_python(self, value):
         """
@@ -517,18 +639,21 @@ class DictField(models.Field):
             return value
         # create an empty dictionary for empty values
         if not value:
-            return {}
+            return DefaultCachingDict()
         # otherwise, we expect value to be a Base64-encoded String which in turn
         # contains a pickle'd Python list. We try to decode and load this into a
         # Python dict which is returned as this field's value.
-        return pickle.loads(base64.b64decode(value))
+        return DefaultCachingDict(pickle.loads(base64.b64decode(value)))
 
     @classmethod
     def _get_default_FIELD(cls, self, field):
         """
         Returns the default value of the given field instance.
         """
-        return field.default_retriever(getattr(self, field.attname))
+        value = getattr(self, field.attname)
+        if isinstance(value, DefaultCachingDict):
+            return value.get_default(field.default_retriever)
+        return field.default_retriever(value)
 
     def contribute_to_class(self, cls, name):
         """
@@ -0,0 +1,316 @@
+"""
+The searchable name index of the reusable entities (persons, organizations,
+projects, documents, etc.) which are suggested by the autocompletion of the
+metadata editor.
+
+Every master copy of a looked up model instance has a `LookupEntry` with its
+lowercase names, its label and value in the autocompletion and the number of
+resources which use it, so that the editor lookups can be answered with a
+single query instead of loading and matching all instances by hand. The usage
+counts are taken from the reverse-reference index (see reference_index.py).
+
+The entries and the references are kept up to date by the signal receivers
+below. Both indexes are filled by `syncdb` when their tables are created in
+a database with existing resources; they can be recreated at any time with
+the `rebuild_lookup_index` management command.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from metashare.repository.deep_deletion import plan_deep_deletion
+from metashare.repository.models import LookupEntry, ResourceReference, \
+    resourceInfoType_model, personInfoType_model, \
+    organizationInfoType_model, actorInfoType_model, projectInfoType_model, \
+    documentationInfoType_model, documentInfoType_model, \
+    targetResourceInfoType_model
+from metashare.repository.reference_index import add_references, \
+    count_resources, get_owners, get_planned_keys, get_reference_key, \
+    get_resource_ids, get_usage_counts, remove_instance_references, \
+    remove_resource_references, update_resource_references
+from metashare.repository.supermodel import SchemaModel, \
+    is_import_in_progress, post_import
+from metashare.settings import LOG_HANDLER
+from metashare.storage.models import MASTER
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+def get_organization_label(org):
+    """
+    Returns the label of the given organization in the autocompletion.
+    """
+    return u'%s: %s' % (''.join(org.organizationShortName.itervalues()),
+                        ''.join(org.organizationName.itervalues()))
+
+
+def get_project_label(project):
+    """
+    Returns the label of the given project in the autocompletion.
+    """
+    return u'%s: %s' % (''.join(project.projectShortName.itervalues()),
+                        ''.join(project.projectName.itervalues()))
+
+
+def _get_values(*dicts):
+    """
+    Returns the list of all values of the given `DictField` values.
+    """
+    return [_value for _dict in dicts for _value in _dict.itervalues()]
+
+
+def _get_unicode_names(obj):
+    """
+    Returns the names of the given instance which is looked up by its unicode
+    representation.
+    """
+    return [unicode(obj)]
+
+
+def _get_document_names(obj):
+    """
+    Returns the names of the given documentation instance which is only looked
+    up if it is a structured document.
+    """
+    if isinstance(obj, documentInfoType_model):
+        return [unicode(obj)]
+    return None
+
+
+# the looked up models with functions returning the names of an instance (or
+# None if the instance is not to be looked up at all) and its label; the
+# order of the models is irrelevant
+_LOOKUP_MODELS = (
+    (personInfoType_model,
+     lambda obj: _get_values(obj.surname, obj.givenName), unicode),
+    (organizationInfoType_model,
+     lambda obj: _get_values(obj.organizationShortName, obj.organizationName),
+     get_organization_label),
+    (actorInfoType_model, _get_unicode_names, unicode),
+    (projectInfoType_model,
+     lambda obj: _get_values(obj.projectName, obj.projectShortName),
+     get_project_label),
+    (documentationInfoType_model, _get_document_names, unicode),
+    (documentInfoType_model, _get_unicode_names, unicode),
+    (targetResourceInfoType_model, _get_unicode_names, unicode),
+)
+
+# the models whose instances are looked up
+LOOKUP_MODELS = tuple(_model for _model, _, _ in _LOOKUP_MODELS)
+
+# the models whose instances have the entries for all of their looked up
+# superclass models, too
+_LEAF_MODELS = (personInfoType_model, organizationInfoType_model,
+    projectInfoType_model, documentInfoType_model,
+    targetResourceInfoType_model)
+
+# maps the name of every looked up model to the names of the looked up models,
+# i.e., itself and its superclasses, whose entries of an instance of the model
+# have the same usage count
+_LOOKUP_MODEL_NAMES = dict((_model.__name__, [_superclass.__name__
+    for _superclass in LOOKUP_MODELS if issubclass(_model, _superclass)])
+    for _model in LOOKUP_MODELS)
+
+
+def update_lookup_entries(objects, usage_counts=None):
+    """
+    Creates or updates the index entries of the given looked up instances.
+
+    The number of resources which use an instance is taken from the
+    reverse-reference index unless it is given in the usage_counts dictionary
+    as returned by `get_usage_counts()`.
+    """
+    _seen = set()
+    for obj in objects:
+        if hasattr(obj, 'as_subclass'):
+            obj = obj.as_subclass()
+        _key = get_reference_key(obj)
+        if obj.pk is None or _key in _seen:
+            continue
+        _seen.add(_key)
+        if usage_counts is not None:
+            _count = usage_counts.get(_key, 0)
+        else:
+            _count = count_resources(obj)
+        for _model, _get_names, _get_label in _LOOKUP_MODELS:
+            if not isinstance(obj, _model):
+                continue
+            _names = _get_names(obj)
+            if _names is None:
+                LookupEntry.objects.filter(model_name=_model.__name__,
+                                           object_id=obj.pk).delete()
+                continue
+            _fields = {
+                'names': u'\n'.join(_name.lower() for _name in _names),
+                'label': _get_label(obj),
+                'value': unicode(obj),
+                'subclass': obj.__class__.__name__.lower(),
+                'master': getattr(obj, 'copy_status', MASTER) == MASTER,
+                'usage_count': _count,
+            }
+            if not LookupEntry.objects.filter(model_name=_model.__name__,
+                                              object_id=obj.pk) \
+                    .update(**_fields):
+                LookupEntry.objects.create(model_name=_model.__name__,
+                                           object_id=obj.pk, **_fields)
+
+
+def update_lookup_usage_counts(keys):
+    """
+    Updates the usage counts in the index entries of the instances with the
+    given reverse-reference index keys whose references have changed.
+    """
+    for _model_name, _pk in keys:
+        _model_names = _LOOKUP_MODEL_NAMES.get(_model_name)
+        if _model_names:
+            LookupEntry.objects.filter(model_name__in=_model_names,
+                object_id=_pk).update(usage_count=ResourceReference.objects \
+                    .filter(model_name=_model_name, object_id=_pk).count())
+
+
+def remove_lookup_entries(obj):
+    """
+    Removes the index entries of the given looked up instance.
+    """
+    LookupEntry.objects.filter(object_id=obj.pk, model_name__in=[
+        _model.__name__ for _model in LOOKUP_MODELS
+        if isinstance(obj, _model)]).delete()
+
+
+def _update_resource(resource):
+    """
+    Updates the references of the given resource and the usage counts of the
+    looked up instances whose references have changed.
+    """
+    update_lookup_usage_counts(update_resource_references(resource))
+
+
+@transaction.commit_on_success
+def rebuild_lookup_index():
+    """
+    Recreates the index entries of all looked up instances and returns their
+    number.
+
+    The usage counts are taken from the reverse-reference index, which is
+    expected to be up to date; see `rebuild_reference_index()`.
+    """
+    _counts = get_usage_counts()
+    LookupEntry.objects.all().delete()
+    _count = 0
+    for _model in _LEAF_MODELS:
+        _objects = list(_model.objects.all())
+        update_lookup_entries(_objects, _counts)
+        _count += len(_objects)
+    LOGGER.info('Indexed {0} looked up instances.'.format(_count))
+    return _count
+
+
+# pylint: disable-msg=W0613
+@receiver(post_save)
+def _update_saved_lookup_entries(sender, instance, raw=False, **kwargs):
+    """
+    Updates the index entries of the given looked up instance.
+    """
+    if not raw and isinstance(instance, LOOKUP_MODELS):
+        update_lookup_entries([instance])
+
+
+# pylint: disable-msg=W0613
+@receiver(post_delete)
+def _remove_deleted_lookup_entries(sender, instance, **kwargs):
+    """
+    Removes the references and, for looked up instances, the index entries of
+    the given deleted schema model instance.
+    """
+    if isinstance(instance, SchemaModel):
+        remove_instance_references(instance)
+    if isinstance(instance, LOOKUP_MODELS):
+        remove_lookup_entries(instance)
+
+
+# pylint: disable-msg=W0613
+@receiver(m2m_changed)
+def _update_changed_resource_references(sender, instance, action, reverse,
+                                        model, pk_set, **kwargs):
+    """
+    Updates the references of all resources which contain either side of a
+    changed many-to-many relation between schema models.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear') \
+            or not isinstance(instance, SchemaModel) \
+            or not issubclass(model, SchemaModel) or is_import_in_progress():
+        return
+    _changed = [instance]
+    if reverse and pk_set:
+        # the instances of the other side contain the given instance now
+        _changed.extend(model.objects.filter(pk__in=pk_set))
+    for _resource in resourceInfoType_model.objects.filter(
+            pk__in=get_resource_ids(*_changed)):
+        _update_resource(_resource)
+
+
+def _add_part_references(part):
+    """
+    Adds the given part of a resource, together with the parts which it owns,
+    to the references of the resources which contain its owners.
+    """
+    _resource_ids = get_resource_ids(*get_owners(part))
+    if _resource_ids:
+        update_lookup_usage_counts(add_references(_resource_ids,
+            get_planned_keys(plan_deep_deletion(part))))
+
+
+# pylint: disable-msg=W0613
+@receiver(post_save)
+def _add_saved_part_references(sender, instance, raw=False, **kwargs):
+    """
+    Adds the given saved part of a resource, together with the parts which it
+    owns, to the references of the resources which contain its owners.
+
+    The parts which are saved during imports are added once the import has
+    finished; see `_add_imported_references()`.
+    """
+    if raw or not isinstance(instance, SchemaModel) \
+            or isinstance(instance, resourceInfoType_model) \
+            or is_import_in_progress():
+        return
+    _add_part_references(instance)
+
+
+# pylint: disable-msg=W0613
+@receiver(post_save, sender=resourceInfoType_model)
+def _update_saved_resource_references(sender, instance, raw=False,
+                                      **kwargs):
+    """
+    Updates the references of the given saved resource, whose object graph
+    has usually been changed before.
+    """
+    if not raw and not is_import_in_progress():
+        _update_resource(instance)
+
+
+# pylint: disable-msg=W0613
+@receiver(post_import)
+def _add_imported_references(sender, instance, **kwargs):
+    """
+    Updates the references of the given imported resource, or adds those of
+    the given imported part of a resource, once for the complete import.
+    """
+    if isinstance(instance, resourceInfoType_model):
+        _update_resource(instance)
+    else:
+        _add_part_references(instance)
+
+
+# pylint: disable-msg=W0613
+@receiver(post_delete, sender=resourceInfoType_model)
+def _remove_deleted_resource_references(sender, instance, **kwargs):
+    """
+    Removes the references of the given deleted resource and updates the
+    usage counts of the looked up instances which it has used.
+    """
+    update_lookup_usage_counts(remove_resource_references(instance.pk))
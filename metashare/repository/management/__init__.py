@@ -96,6 +96,22 @@ def set_site_from_django_url(app, created_models, verbosity, **kwargs):
         site.name = 'META-SHARE'
         site.save()
 
+def populate_lookup_index(app, created_models, verbosity, **kwargs):
+    '''
+    Fill the reverse-reference index and the name index of the editor
+    autocompletion when their tables have been created in a database which
+    already contains resources.
+    '''
+    from metashare.repository.lookup_index import rebuild_lookup_index
+    from metashare.repository.models import LookupEntry, ResourceReference, \
+        resourceInfoType_model
+    from metashare.repository.reference_index import rebuild_reference_index
+    if (ResourceReference in created_models or LookupEntry in created_models) \
+            and resourceInfoType_model.objects.exists():
+        if verbosity >= 1:
+            print 'Indexing the references and names of existing resources'
+        rebuild_reference_index()
+        rebuild_lookup_index()
 
 
 
@@ -111,3 +127,6 @@ signals.post_syncdb.connect(setup_group_global_editors,
 
 signals.post_syncdb.connect(set_site_from_django_url,
     sender=repository_models, dispatch_uid = "metashare.repository.management.set_site_from_django_url")
+
+signals.post_syncdb.connect(populate_lookup_index,
+    sender=repository_models, dispatch_uid = "metashare.repository.management.populate_lookup_index")
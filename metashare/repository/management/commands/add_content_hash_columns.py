@@ -0,0 +1,67 @@
+"""
+Management utility to add the `content_hash` column of the schema models to
+the tables of a database which has been created before the column existed;
+syncdb only creates missing tables, not missing columns.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import get_app, get_models
+
+from metashare import settings
+from metashare.repository.supermodel import SchemaModel
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(settings.LOG_HANDLER)
+
+
+class Command(BaseCommand):
+
+    help = 'Adds the missing content_hash columns of the schema models'
+
+    def handle(self, *args, **options):
+        """
+        Add the content_hash column to all schema model tables without it.
+        """
+        _count = add_content_hash_columns()
+        LOGGER.info("added {} content_hash columns".format(_count))
+
+
+@transaction.commit_on_success
+def add_content_hash_columns():
+    """
+    Adds the content_hash column and its index to all schema model tables
+    which do not have it, yet, and returns the number of changed tables.
+
+    The content hashes of existing objects are computed by the
+    `backfill_content_hashes` command.
+    """
+    _cursor = connection.cursor()
+    _quote_name = connection.ops.quote_name
+    _count = 0
+    for _model in get_models(get_app('repository')):
+        if not issubclass(_model, SchemaModel):
+            continue
+        _field = [_field for _field in _model._meta.local_fields
+                  if _field.name == 'content_hash']
+        if not _field:
+            # the column is found in the table of the superclass model
+            continue
+        _field = _field[0]
+        _table = _model._meta.db_table
+        if _field.column in [_column[0] for _column in connection \
+                .introspection.get_table_description(_cursor, _table)]:
+            continue
+        _cursor.execute('ALTER TABLE {0} ADD COLUMN {1} {2} NULL'.format(
+            _quote_name(_table), _quote_name(_field.column),
+            _field.db_type(connection=connection)))
+        for _sql in connection.creation.sql_indexes_for_field(_model, _field,
+                                                              no_style()):
+            _cursor.execute(_sql)
+        LOGGER.info(u'added the content_hash column to {}'.format(_table))
+        _count += 1
+    return _count
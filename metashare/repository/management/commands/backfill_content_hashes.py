@@ -0,0 +1,67 @@
+"""
+Management utility to compute the missing content hashes of the schema model
+instances, e.g., after adding the `content_hash` columns to an existing
+database or for instances which have been changed in the metadata editor.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import get_app, get_models
+
+from metashare import settings
+from metashare.repository.export_prefetch import MAX_LOOKUP_IDS
+from metashare.repository.supermodel import SchemaModel
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(settings.LOG_HANDLER)
+
+
+class Command(BaseCommand):
+
+    help = 'Computes the missing content hashes of the schema models'
+
+    def handle(self, *args, **options):
+        """
+        Compute the content hashes of all schema model instances without one.
+        """
+        _count = backfill_content_hashes()
+        LOGGER.info("computed {} content hashes".format(_count))
+
+
+def backfill_content_hashes():
+    """
+    Computes and stores the content hashes of all schema model instances
+    which do not have one and returns their number.
+
+    The missing content hashes of contained instances are computed together
+    with those of their containers.
+    """
+    _count = 0
+    for _model in get_models(get_app('repository')):
+        if not issubclass(_model, SchemaModel):
+            continue
+        _pks = list(_model.objects.filter(content_hash__isnull=True)
+                    .values_list('pk', flat=True))
+        for _start in range(0, len(_pks), MAX_LOOKUP_IDS):
+            _count += _backfill_content_hashes(_model,
+                _pks[_start:_start + MAX_LOOKUP_IDS])
+    return _count
+
+
+@transaction.commit_on_success
+def _backfill_content_hashes(model, pks):
+    """
+    Computes and stores the missing content hashes of the instances of the
+    given model with the given pks and returns their number.
+    """
+    _count = 0
+    for _obj in model.objects.filter(pk__in=pks):
+        # the content hash may have been computed together with the one of a
+        # containing instance in the meantime
+        if _obj.content_hash is None:
+            _obj.get_content_hash()
+            _count += 1
+    return _count
@@ -0,0 +1,72 @@
+"""
+Management utility to convert all `MultiTextField` values which are still
+stored in the legacy Base64-encoded, pickle'd format to the JSON format.
+"""
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import get_app, get_models
+
+from metashare import settings
+from metashare.repository.fields import MultiTextField, decode_multitext, \
+    is_legacy_multitext
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(settings.LOG_HANDLER)
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', action='store', dest='batch_size',
+                    type='int', default=500, help='number of values which '
+                    'are converted in a single transaction; defaults to 500'),
+    )
+
+    help = 'Converts all MultiTextField values in the legacy format to JSON'
+
+    def handle(self, *args, **options):
+        """
+        Convert the values of all MultiTextFields of the repository models.
+        """
+        _batch_size = options.get('batch_size', 500)
+        _count = 0
+        for _model in get_models(get_app('repository')):
+            for _field in _model._meta.local_fields:
+                if isinstance(_field, MultiTextField):
+                    _count += migrate_multitext_field(_model, _field,
+                                                      _batch_size)
+        LOGGER.info("converted {} MultiTextField values".format(_count))
+
+
+def migrate_multitext_field(model, field, batch_size=500):
+    """
+    Converts the legacy values of the given `MultiTextField` of the given
+    model to JSON and returns the number of converted values.
+    """
+    # the raw DB representations are not converted by `values_list()`
+    _legacy = [(pk, value) for pk, value
+               in model._default_manager.values_list('pk', field.attname)
+               if isinstance(value, basestring) and is_legacy_multitext(value)]
+    for _start in range(0, len(_legacy), batch_size):
+        _migrate_values(model, field, _legacy[_start:_start + batch_size])
+    if _legacy:
+        LOGGER.info(u'converted {} values of {}.{}'.format(len(_legacy),
+                    model.__name__, field.name))
+    return len(_legacy)
+
+
+@transaction.commit_on_success
+def _migrate_values(model, field, values):
+    """
+    Stores the given (primary key, legacy value) tuples of the given field of
+    the given model in the JSON format.
+    """
+    for _pk, _value in values:
+        # the field converts the decoded list into JSON when saving it
+        model._default_manager.filter(pk=_pk) \
+            .update(**{field.attname: decode_multitext(_value)})
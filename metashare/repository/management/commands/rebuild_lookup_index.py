@@ -0,0 +1,32 @@
+"""
+Management utility to recreate the reverse-reference index of all resources
+and the searchable name index of the reusable entities which are suggested by
+the autocompletion of the metadata editor.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from metashare import settings
+from metashare.repository.lookup_index import rebuild_lookup_index
+from metashare.repository.reference_index import rebuild_reference_index
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(settings.LOG_HANDLER)
+
+
+class Command(BaseCommand):
+
+    help = 'Recreates the reverse-reference index and the name index of ' \
+        'the editor autocompletion'
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the reverse-reference index and the lookup index.
+        """
+        _references = rebuild_reference_index()
+        _count = rebuild_lookup_index()
+        LOGGER.info("indexed {} references and {} looked up instances"
+                    .format(_references, _count))
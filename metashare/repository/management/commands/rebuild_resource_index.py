@@ -0,0 +1,50 @@
+"""
+Management utility to recreate the search index entries of all published
+resources in chunks and in parallel.
+"""
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from metashare import settings
+from metashare.repository.search_indexes import rebuild_lr_index
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(settings.LOG_HANDLER)
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('-j', '--jobs', action='store', dest='jobs', type='int',
+                    default=1, help='number of worker processes preparing '
+                    'the search index entries; defaults to 1'),
+        make_option('-b', '--batch-size', action='store', dest='batch_size',
+                    type='int', default=100, help='number of resources which '
+                    'are indexed and committed together; defaults to 100'),
+        make_option('-r', '--resume', action='store_true', dest='resume',
+                    default=False, help='continue an interrupted reindexing '
+                    'instead of starting from scratch'),
+        make_option('--progress-file', action='store', dest='progress_file',
+                    default=None, help='file for recording the reindexing '
+                    'progress; defaults to a file in LOCK_DIR'),
+    )
+
+    help = 'Recreates the search index entries of all published resources'
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the resource index.
+        """
+        try:
+            _count = rebuild_lr_index(options.get('batch_size', 100),
+                options.get('jobs', 1), options.get('resume', False),
+                options.get('progress_file', None))
+        except:
+            LOGGER.error('Reindexing failed; it can be continued with the '
+                         '--resume option.', exc_info=True)
+            raise
+        LOGGER.info("indexed {} resources".format(_count))
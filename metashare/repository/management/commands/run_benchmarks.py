@@ -0,0 +1,116 @@
+"""
+Management utility to measure the performance of some hot code paths which
+are not worth timing in the unit tests.
+"""
+import base64
+import cPickle as pickle
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.test.client import RequestFactory
+
+from metashare.repository import views
+from metashare.repository.fields import encode_multitext
+from metashare.repository.models import communicationInfoType_model, \
+    identificationInfoType_model
+from metashare.settings import DJANGO_BASE
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--runs', action='store', dest='runs', type='int',
+                    default=10000, help='number of runs of each measured '
+                    'operation; defaults to 10000'),
+    )
+
+    help = 'Measures the performance of some hot code paths'
+
+    def handle(self, *args, **options):
+        """
+        Run all benchmarks and print their results.
+        """
+        _runs = options['runs']
+        for _benchmark in (benchmark_multitext_field,
+                           benchmark_default_value,
+                           benchmark_filters_structure):
+            for _line in _benchmark(_runs):
+                self.stdout.write(_line + '\n')
+
+
+def _time(func, runs):
+    """
+    Returns the number of seconds which the given number of calls of the given
+    function take.
+    """
+    _start = time.time()
+    for _ in xrange(runs):
+        func()
+    return time.time() - _start
+
+
+def benchmark_multitext_field(runs):
+    """
+    Compares loading and saving `MultiTextField` values in the legacy pickle
+    format and in the JSON format.
+    """
+    _values = [u'http://www.example.org/', u'\u00fcber "quoted"', u'']
+    _field = communicationInfoType_model._meta.get_field('url')
+    _legacy = base64.b64encode(pickle.dumps(_values))
+    _json = encode_multitext(_values)
+    for _name, _load, _save in (
+            ('legacy', lambda: pickle.loads(base64.b64decode(_legacy)),
+             lambda: base64.b64encode(pickle.dumps(_values))),
+            ('JSON', lambda: _field.to_python(_json),
+             lambda: _field.get_prep_value(_values))):
+        yield '{0} MultiTextField format: {1} loads in {2:.3f} s, {1} saves ' \
+            'in {3:.3f} s, {4} characters'.format(_name, runs,
+                _time(_load, runs), _time(_save, runs), len(_save()))
+
+
+def benchmark_default_value(runs):
+    """
+    Compares accessing the default resource name of a plain dictionary and of
+    a dictionary which remembers its default value.
+    """
+    _names = {u'de': u'Der Name', u'en': u'The name'}
+    for _name, _info in (
+            ('plain', identificationInfoType_model(resourceName=dict(_names))),
+            # the DB representation of the resource name is decoded on
+            # assignment
+            ('cached', identificationInfoType_model(resourceName=
+                base64.b64encode(pickle.dumps(_names))))):
+        yield '{0} resource name accesses with {1} dictionary: {2:.3f} s' \
+            .format(runs, _name, _time(_info.get_default_resourceName, runs))
+
+
+def benchmark_filters_structure(runs, top_level_items=60, sub_filter_items=20):
+    """
+    Measures the creation of the filters structure of the search page from a
+    realistic facet payload.
+    """
+    _facet_fields = {}
+    for _name, _label, _facet_id, _parent_id in views._FILTER_LABELS:
+        _count = _parent_id and sub_filter_items or top_level_items
+        # Solr returns the items sorted by count, including empty ones
+        _facet_fields[_name] = [(u'someValue{0}'.format(i), _count - i)
+                                for i in range(_count + 1)]
+    _facet_fields['resourceTypeFilter'][:4] = [(u'corpus', 500),
+        (u'lexicalConceptualResource', 300), (u'languageDescription', 200),
+        (u'toolService', 100)]
+    _selected = ['languageNameFilter_exact:someValue{0}'.format(i)
+                 for i in range(5)] + ['resourceTypeFilter_exact:corpus',
+                 'resourceTypeFilter_exact:toolService',
+                 'corpusAnnotationTypeFilter_exact:someValue1']
+    _view = views.MetashareFacetedSearchView()
+    _view.request = RequestFactory().get(
+        '/{0}repository/search/'.format(DJANGO_BASE),
+        data={'selected_facets': _selected})
+    # the filters structure is considerably more expensive than the other
+    # measured operations
+    _runs = max(1, runs / 200)
+    yield 'created the filters structure of {0} selected facets in {1:.2f} ' \
+        'ms on average'.format(len(_selected), _time(lambda:
+            _view._create_filters_structure(_facet_fields), _runs) * 1000
+            / _runs)
@@ -9,6 +9,9 @@ from django.db.models import OneToOneField, Sum
 from metashare.repository.models import resourceInfoType_model, \
     corpusInfoType_model, lexicalConceptualResourceInfoType_model, \
     languageDescriptionInfoType_model, toolServiceInfoType_model
+from metashare.repository.export_prefetch import MAX_LOOKUP_IDS
+from metashare.repository.reference_index import get_resource_ids, \
+    is_index_complete
 from metashare.settings import LOG_HANDLER
 from metashare.stats.models import LRStats
 
@@ -58,9 +61,19 @@ def get_root_resources(*instances):
     
     If any of the given instances is a `resourceInfoType_model` itself, then
     this instance will be in the returned set, too. The returned set can be
-    empty.
+    empty. The resources are taken from the reverse-reference index (see
+    reference_index.py); only if the index is incomplete, they are searched
+    backwards through the model graph.
     """
-    return _get_root_resources(set(), *instances)
+    _instances = [instance for instance in instances if instance]
+    if not is_index_complete():
+        return _get_root_resources(set(), *_instances)
+    result = set()
+    _ids = list(get_resource_ids(*_instances))
+    for _start in range(0, len(_ids), MAX_LOOKUP_IDS):
+        result.update(resourceInfoType_model.objects.filter(
+            pk__in=_ids[_start:_start + MAX_LOOKUP_IDS]))
+    return result
 
 
 def _get_root_resources(ignore, *instances):
@@ -274,6 +287,17 @@ def get_lr_stat_action_count(obj_identifier, stats_action):
     else:
         return 0
 
+def get_lr_stat_action_counts(obj_identifiers, stats_action):
+    """
+    Returns a dictionary mapping the given storage object identifiers to the
+    counts of the given stats action for the corresponding resources.
+
+    Identifiers without any stats for the action are not contained.
+    """
+    return dict(LRStats.objects \
+        .filter(lrid__in=obj_identifiers, action=stats_action) \
+        .values_list('lrid').annotate(Sum('count')))
+
 def get_lr_master_url(resource):
     """
     Returns the full URL of the master copy of the given resource object.
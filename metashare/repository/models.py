@@ -204,6 +204,9 @@ class resourceInfoType_model(SchemaModel):
               'aborting!'.format(self.storage_object))
             return
         
+        # the search facets have to be computed again
+        ResourceFacetSnapshot.objects.filter(
+            lrid=self.storage_object.identifier).delete()
         self.storage_object.save()
         # REMINDER: the SOLR indexer in search_indexes.py relies on us
         # calling storage_object.save() from resourceInfoType_model.save().
@@ -228,6 +231,8 @@ class resourceInfoType_model(SchemaModel):
             # delete recommendations
             ResourceCountPair.objects.filter(lrid=self.storage_object.identifier).delete()
             ResourceCountDict.objects.filter(lrid=self.storage_object.identifier).delete()
+        ResourceFacetSnapshot.objects.filter(
+            lrid=self.storage_object.identifier).delete()
             
         # Call delete() method from super class with all arguments but keep_stats
         super(resourceInfoType_model, self).delete(*args, **kwargs)
@@ -7911,3 +7916,77 @@ class documentUnstructuredString_model(InvisibleStringModel, documentationInfoTy
             # pylint: disable-msg=W0201
             self.id = _compute_documentationInfoType_key()
         super(documentUnstructuredString_model, self).save(*args, **kwargs)
+
+
+class ResourceFacetSnapshot(models.Model):
+    """
+    The search facet values of a language resource as computed when the
+    resource was last indexed; the values are reused for reindexing the
+    resource as long as its metadata has not changed.
+    """
+    # the storage object identifier of the language resource,
+    # NOT the pk of the resource!
+    lrid = models.CharField(max_length=64, unique=True)
+
+    # the storage object revision and modification date for which the facet
+    # values have been computed
+    revision = models.PositiveIntegerField()
+    modified = models.DateTimeField()
+
+    # the JSON serialized dictionary of the facet values
+    facets = models.TextField()
+
+
+class LookupEntry(models.Model):
+    """
+    An entry of the searchable name index of the reusable entities (persons,
+    organizations, projects, documents, etc.) which are suggested by the
+    autocompletion of the metadata editor; see lookup_index.py.
+    """
+    # the name of the looked up model and the pk of the looked up instance;
+    # subclass instances have entries for their superclass models, too
+    model_name = models.CharField(max_length=100)
+    object_id = models.IntegerField()
+
+    # the lowercase names by which the instance can be found, one per line
+    names = models.TextField()
+
+    # the label and the value of the instance in the autocompletion
+    label = models.TextField()
+    value = models.TextField()
+
+    # the lowercase class name of the instance
+    subclass = models.CharField(max_length=100)
+
+    # whether the instance is a master copy; only these are suggested
+    master = models.BooleanField(default=True)
+
+    # the number of resources which use the instance
+    usage_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('model_name', 'object_id')
+
+
+class ResourceReference(models.Model):
+    """
+    An entry of the reverse-reference index which maps the instances of the
+    object graph of a resource, in particular the reusable entities, to the
+    resource; see reference_index.py.
+    """
+    # the name of the most specific model of the referenced instance and its
+    # pk
+    model_name = models.CharField(max_length=100)
+    object_id = models.IntegerField()
+
+    # the id of the resource which contains the instance
+    resource_id = models.IntegerField(db_index=True)
+
+    class Meta:
+        unique_together = ('model_name', 'object_id', 'resource_id')
+
+
+# the searchable name index, the reverse-reference index and the content
+# hashes are maintained by signal receivers which require the models above
+# pylint: disable-msg=W0611
+from metashare.repository import content_hashes, lookup_index
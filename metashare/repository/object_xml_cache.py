@@ -0,0 +1,174 @@
+"""
+Caches for the serialized XML of model objects which are used by the duplicate
+detection during imports.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from django.core.cache import get_cache
+
+from metashare.settings import LOG_HANDLER, OBJECT_XML_CACHE_BACKEND, \
+    OBJECT_XML_CACHE_MAX_BYTES, OBJECT_XML_CACHE_TIMEOUT
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+
+def object_xml_cache_key(obj):
+    """
+    Returns the key under which the serialized XML of the given model object
+    is cached.
+    """
+    return model_object_xml_cache_key(type(obj), obj.id)
+
+
+def model_object_xml_cache_key(model, pk):
+    """
+    Returns the key under which the serialized XML of the object of the given
+    model with the given pk is cached.
+    """
+    return '{}_{}'.format(model.__name__.lower(), pk)
+
+
+class LocalObjectXmlCache(object):
+    """
+    A thread-safe, per-process cache which evicts the least recently used
+    entries as soon as the cached values exceed the given number of bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value cached under the given key or None.
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                # re-insert the entry as the most recently used one
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Caches the given value under the given key.
+        """
+        with self._lock:
+            old_value = self._entries.pop(key, None)
+            if old_value is not None:
+                self._size -= len(old_value)
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def delete(self, key):
+        """
+        Removes the value cached under the given key, if any.
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._size -= len(value)
+
+    def clear(self):
+        """
+        Removes all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def size(self):
+        """
+        Returns the number of bytes of all cached values.
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoObjectXmlCache(object):
+    """
+    A cache which stores its values in the given cache of Django's cache
+    framework so that it can be shared between processes.
+
+    All keys contain a content version which is changed by clear() as most
+    cache backends cannot remove a subset of their entries at once.
+    """
+    VERSION_KEY = 'object_xml_cache_version'
+
+    def __init__(self, cache_alias, timeout):
+        self._cache = get_cache(cache_alias)
+        self.timeout = timeout
+
+    def _version(self):
+        """
+        Returns the current content version of the cache.
+        """
+        version = self._cache.get(self.VERSION_KEY)
+        if version is None:
+            version = 1
+            self._cache.add(self.VERSION_KEY, version, None)
+        return version
+
+    def _versioned_key(self, key):
+        return 'object_xml_{}_{}'.format(self._version(), key)
+
+    def get(self, key):
+        """
+        Returns the value cached under the given key or None.
+        """
+        return self._cache.get(self._versioned_key(key))
+
+    def set(self, key, value):
+        """
+        Caches the given value under the given key.
+        """
+        self._cache.set(self._versioned_key(key), value, self.timeout)
+
+    def delete(self, key):
+        """
+        Removes the value cached under the given key, if any.
+        """
+        self._cache.delete(self._versioned_key(key))
+
+    def clear(self):
+        """
+        Invalidates all cached values.
+        """
+        self._version()
+        try:
+            self._cache.incr(self.VERSION_KEY)
+        except ValueError:
+            # the version key has been evicted in the meantime
+            self._cache.add(self.VERSION_KEY, 1, None)
+
+    def size(self):
+        """
+        Returns None as the size of the values cached by Django is unknown.
+        """
+        return None
+
+
+def create_object_xml_cache():
+    """
+    Returns a new object XML cache as configured in the settings.
+    """
+    if OBJECT_XML_CACHE_BACKEND == 'local':
+        return LocalObjectXmlCache(OBJECT_XML_CACHE_MAX_BYTES)
+    LOGGER.debug('Using Django cache "{0}" for the object XML cache.'
+                 .format(OBJECT_XML_CACHE_BACKEND))
+    return DjangoObjectXmlCache(OBJECT_XML_CACHE_BACKEND,
+                                OBJECT_XML_CACHE_TIMEOUT)
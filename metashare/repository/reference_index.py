@@ -0,0 +1,277 @@
+"""
+The reverse-reference index which maps all instances of the object graphs of
+the resources, in particular the reusable entities (persons, organizations,
+projects, documents, etc.), to the resources which contain them.
+
+The index answers which resources use an instance, and how many, with a
+single query instead of searching backwards through all relations of the
+instance. The references of a resource are replaced with the instances of
+its current object graph whenever the resource is saved or a many-to-many
+relation in its graph changes. Parts which are saved on their own, e.g., in
+inlines or popups of the metadata editor, are added to the references of the
+resources which contain their owners. While objects are imported, the
+references are only updated once the import has finished. The signal receivers
+which take care of this are found in lookup_index.py.
+"""
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Count, OneToOneField
+
+from metashare.repository.export_prefetch import prefetch_for_export, \
+    clear_export_prefetch, MAX_LOOKUP_IDS
+from metashare.repository.models import ResourceReference, \
+    resourceInfoType_model
+from metashare.repository.supermodel import is_import_in_progress
+from metashare.settings import LOG_HANDLER
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+# the maximum number of references which are inserted together; SQLite does
+# not allow more than 999 query parameters
+_MAX_INSERTED_REFERENCES = 300
+
+# the state of the reference removal of the current thread
+_REMOVAL = threading.local()
+
+
+def get_reference_key(obj):
+    """
+    Returns the key of the given model instance in the index, i.e., the name
+    of its most specific model and its pk.
+    """
+    if hasattr(obj, 'as_subclass'):
+        obj = obj.as_subclass()
+    return (obj.__class__.__name__, obj.pk)
+
+
+def get_resource_ids(*instances):
+    """
+    Returns the set of the ids of the resources which contain the given model
+    instances; a resource contains itself.
+    """
+    result = set()
+    _pks = defaultdict(set)
+    for obj in instances:
+        if obj is None or obj.pk is None:
+            continue
+        if isinstance(obj, resourceInfoType_model):
+            result.add(obj.pk)
+        else:
+            _model_name, _pk = get_reference_key(obj)
+            _pks[_model_name].add(_pk)
+    for _model_name, _model_pks in _pks.iteritems():
+        _model_pks = list(_model_pks)
+        for _start in range(0, len(_model_pks), MAX_LOOKUP_IDS):
+            result.update(ResourceReference.objects.filter(
+                model_name=_model_name,
+                object_id__in=_model_pks[_start:_start + MAX_LOOKUP_IDS]) \
+                .values_list('resource_id', flat=True))
+    return result
+
+
+def is_index_complete():
+    """
+    Returns whether the index contains the references of all resources.
+
+    This is not the case before the index has been filled in a database with
+    existing resources (see `rebuild_reference_index()`) and while objects are
+    imported in the current thread.
+    """
+    return not is_import_in_progress() \
+        and (ResourceReference.objects.exists()
+             or not resourceInfoType_model.objects.exists())
+
+
+def count_resources(obj):
+    """
+    Returns the number of resources which contain the given model instance.
+    """
+    return len(get_resource_ids(obj))
+
+
+def get_usage_counts():
+    """
+    Returns a dictionary which maps the keys of all referenced instances to
+    the number of resources which contain them.
+    """
+    return dict(((_model_name, _pk), _count) for _model_name, _pk, _count
+        in ResourceReference.objects.values_list('model_name', 'object_id') \
+            .annotate(Count('resource_id')).order_by())
+
+
+def _get_graph_keys(resource):
+    """
+    Returns the set of the keys of all instances in the object graph of the
+    given resource, except for the resource itself.
+    """
+    _prepared = prefetch_for_export([resource])
+    try:
+        return set(get_reference_key(_obj) for _obj in _prepared
+                   if not isinstance(_obj, resourceInfoType_model))
+    finally:
+        clear_export_prefetch(_prepared)
+
+
+def _create_references(resource_id, keys):
+    """
+    Inserts the references of the resource with the given id to the instances
+    with the given keys.
+    """
+    _references = [ResourceReference(model_name=_model_name, object_id=_pk,
+                                     resource_id=resource_id)
+                   for _model_name, _pk in keys]
+    for _start in range(0, len(_references), _MAX_INSERTED_REFERENCES):
+        ResourceReference.objects.bulk_create(
+            _references[_start:_start + _MAX_INSERTED_REFERENCES])
+
+
+def _group_keys(keys):
+    """
+    Returns a dictionary which maps the model names of the given keys to the
+    lists of their pks.
+    """
+    result = defaultdict(list)
+    for _model_name, _pk in keys:
+        result[_model_name].append(_pk)
+    return result
+
+
+def update_resource_references(resource):
+    """
+    Replaces the references of the given resource with the instances of its
+    current object graph.
+
+    Returns the set of the keys of the instances whose references have
+    changed.
+    """
+    _keys = _get_graph_keys(resource)
+    _old_keys = set(ResourceReference.objects.filter(resource_id=resource.pk)
+                    .values_list('model_name', 'object_id'))
+    for _model_name, _pks in _group_keys(_old_keys - _keys).iteritems():
+        for _start in range(0, len(_pks), MAX_LOOKUP_IDS):
+            ResourceReference.objects.filter(resource_id=resource.pk,
+                model_name=_model_name,
+                object_id__in=_pks[_start:_start + MAX_LOOKUP_IDS]).delete()
+    _create_references(resource.pk, _keys - _old_keys)
+    return _keys ^ _old_keys
+
+
+def get_owners(obj):
+    """
+    Returns the list of the instances which own the given model instance,
+    i.e., which refer to it through a one-to-one field or to which it refers
+    through a `back_to_...` foreign key.
+    """
+    result = []
+    for _field in obj._meta.fields:
+        if _field.name.startswith('back_to_'):
+            result.append(getattr(obj, _field.name))
+    for _rel in obj._meta.get_all_related_objects():
+        if isinstance(_rel.field, OneToOneField) \
+                and not _rel.field.rel.parent_link:
+            result.extend(_rel.model.objects.filter(**{_rel.field.name: obj}))
+    return result
+
+
+def get_planned_keys(planned):
+    """
+    Returns the set of the keys of the instances in the given dictionary which
+    maps models to the sets of the pks of their instances, as returned by
+    `plan_deep_deletion()`.
+
+    Instances which are contained under several models of a subclass
+    hierarchy get the key of their most specific model.
+    """
+    result = set()
+    for _model, _pks in planned.iteritems():
+        _pks = set(_pks)
+        for _other_model, _other_pks in planned.iteritems():
+            if _other_model is not _model and issubclass(_other_model, _model):
+                _pks.difference_update(_other_pks)
+        result.update((_model.__name__, _pk) for _pk in _pks)
+    return result
+
+
+def add_references(resource_ids, keys):
+    """
+    Adds the missing references of the resources with the given ids to the
+    instances with the given keys.
+
+    Returns the set of the keys of the instances whose references have
+    changed.
+    """
+    result = set()
+    _model_names = set(_model_name for _model_name, _ in keys)
+    for _resource_id in resource_ids:
+        _missing = keys - set(ResourceReference.objects.filter(
+            resource_id=_resource_id, model_name__in=_model_names) \
+                .values_list('model_name', 'object_id'))
+        _create_references(_resource_id, _missing)
+        result.update(_missing)
+    return result
+
+
+def remove_resource_references(resource_id):
+    """
+    Removes all references of the resource with the given id and returns the
+    set of the keys of the instances which have been referenced.
+    """
+    _references = ResourceReference.objects.filter(resource_id=resource_id)
+    _keys = set(_references.values_list('model_name', 'object_id'))
+    _references.delete()
+    return _keys
+
+
+def remove_instance_references(obj):
+    """
+    Removes all references to the given deleted model instance unless the
+    references are removed in bulk; see `removing_references_in_bulk()`.
+    """
+    if getattr(_REMOVAL, 'in_bulk', False):
+        return
+    # deleting an instance also deletes its most specific subclass instance,
+    # under whose model name the references are stored
+    ResourceReference.objects.filter(model_name=obj.__class__.__name__,
+                                     object_id=obj.pk).delete()
+
+
+@contextmanager
+def removing_references_in_bulk(planned):
+    """
+    A context manager for deleting the instances in the given dictionary
+    which maps models to the sets of the pks of their instances: their
+    references are removed together afterwards instead of one instance at a
+    time.
+    """
+    _REMOVAL.in_bulk = True
+    try:
+        yield
+    finally:
+        _REMOVAL.in_bulk = False
+    for _model_name, _pks in _group_keys(get_planned_keys(planned)) \
+            .iteritems():
+        for _start in range(0, len(_pks), MAX_LOOKUP_IDS):
+            ResourceReference.objects.filter(model_name=_model_name,
+                object_id__in=_pks[_start:_start + MAX_LOOKUP_IDS]).delete()
+
+
+@transaction.commit_on_success
+def rebuild_reference_index():
+    """
+    Recreates the references of all resources and returns their number.
+    """
+    ResourceReference.objects.all().delete()
+    _count = 0
+    for _resource in resourceInfoType_model.objects.all().iterator():
+        _keys = _get_graph_keys(_resource)
+        _create_references(_resource.pk, _keys)
+        _count += len(_keys)
+    LOGGER.info('Indexed {0} references of resources.'.format(_count))
+    return _count
@@ -0,0 +1,118 @@
+"""
+A cache for the results of the faceted search which is invalidated as a whole
+whenever the search index changes.
+"""
+import logging
+import time
+from hashlib import md5
+
+from django.core.cache import cache
+
+from metashare.settings import LOG_HANDLER, SEARCH_RESULT_CACHE_TIMEOUT, \
+    SEARCH_RESULT_COUNTER_SORT_CACHE_TIMEOUT
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+# the cache key of the current generation of the search index; all cached
+# search results contain the generation for which they are valid
+GENERATION_KEY = 'search_results_generation'
+
+# the sort orders of the search results which depend on the view and download
+# counters
+COUNTER_SORTS = ('dl_count_desc', 'view_count_desc')
+
+
+def _get_generation():
+    """
+    Returns the current generation of the search index.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # start with a value which has never been used before, as results of
+        # earlier generations may still be cached
+        generation = int(time.time() * 1000)
+        if not cache.add(GENERATION_KEY, generation):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def invalidate_search_results():
+    """
+    Invalidates all cached search results; to be called on every change of
+    the search index.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # there is no generation, yet, or it has been evicted
+        cache.set(GENERATION_KEY, int(time.time() * 1000))
+
+
+def search_results_cache_key(request):
+    """
+    Returns the key under which the search results for the given search
+    request are cached, i.e., for its query, selected facets, sorting and page
+    in the current generation of the search index.
+    """
+    _params = sorted((key, sorted(values))
+                     for key, values in request.GET.lists())
+    return 'search_results_{0}'.format(
+        md5(repr((_get_generation(), _params))).hexdigest())
+
+
+def search_results_cache_timeout(request):
+    """
+    Returns the number of seconds for which the search results for the given
+    search request are cached; results which are sorted by the view or
+    download counters are only cached for a short time as changes of the
+    counters do not invalidate the cached results.
+    """
+    _sort = request.GET.getlist('sort')
+    if _sort and _sort[0] in COUNTER_SORTS:
+        return SEARCH_RESULT_COUNTER_SORT_CACHE_TIMEOUT
+    return SEARCH_RESULT_CACHE_TIMEOUT
+
+
+class CachedSearchResults(object):
+    """
+    A stand-in for a `SearchQuerySet` which serves the result count, the
+    results of a page and the facet counts from the cache; only what is not
+    cached, yet, is requested from the search index.
+    """
+    def __init__(self, sqs, cache_key, timeout=SEARCH_RESULT_CACHE_TIMEOUT):
+        self._sqs = sqs
+        self._cache_key = cache_key
+        self._timeout = timeout
+        self._entry = cache.get(cache_key) or {}
+
+    def _cached(self, key, compute):
+        """
+        Returns the cached value for the given key, computing and caching it
+        with the given function first if necessary.
+        """
+        if key not in self._entry:
+            self._entry[key] = compute()
+            cache.set(self._cache_key, self._entry, self._timeout)
+        return self._entry[key]
+
+    def count(self):
+        return self._cached('count', self._sqs.count)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self._cached(('slice', k.start, k.stop, k.step),
+                                lambda: list(self._sqs[k]))
+        return self._sqs[k]
+
+    def facet_counts(self):
+        return self._cached('facet_counts', self._sqs.facet_counts)
+
+    def __getattr__(self, name):
+        # everything else is taken from the original `SearchQuerySet`
+        return getattr(self._sqs, name)
@@ -1,24 +1,35 @@
+import json
 import logging
 import os
 import re
+import threading
+from functools import wraps
+from multiprocessing import Pool
 
 from haystack.indexes import CharField, IntegerField, RealTimeSearchIndex
 from haystack import indexes, connections as haystack_connections, \
     connection_router as haystack_connection_router
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.db.models import signals
+from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext as _
 from unidecode import unidecode
 
 from metashare.repository import model_utils
 from metashare.repository.models import resourceInfoType_model, \
+    ResourceFacetSnapshot, \
     corpusInfoType_model, \
     toolServiceInfoType_model, lexicalConceptualResourceInfoType_model, \
     languageDescriptionInfoType_model
+from metashare.repository.search_cache import invalidate_search_results
 from metashare.repository.search_fields import LabeledCharField, \
     LabeledMultiValueField
 from metashare.storage.models import StorageObject, INGESTED, PUBLISHED
-from metashare.settings import LOG_HANDLER
+from metashare.settings import LOG_HANDLER, INDEX_DOCUMENT_CACHE_TIMEOUT, \
+    LOCK_DIR
 from metashare.stats.model_utils import DOWNLOAD_STAT, VIEW_STAT
 
 
@@ -39,6 +50,224 @@ def update_lr_index_entry(res_obj):
         .update_object(res_obj)
 
 
+def update_lr_index_entries(res_ids, batch_size=100, commit=True):
+    """
+    Updates/creates the search index entries for the language resources with
+    the given ids in batches of the given size.
+
+    Only published resources which have not been deleted are indexed. In
+    contrast to update_lr_index_entry() this also works while indexing is
+    disabled during an import. If `commit` is False, the changes only become
+    visible with the next commit of the search index.
+    """
+    _alias = haystack_connection_router.for_write()
+    _index = haystack_connections[_alias].get_unified_index() \
+        .get_index(resourceInfoType_model)
+    _backend = haystack_connections[_alias].get_backend()
+    res_ids = list(res_ids)
+    for _start in range(0, len(res_ids), batch_size):
+        _batch = _index.index_queryset() \
+            .filter(id__in=res_ids[_start:_start + batch_size])
+        if _batch:
+            _backend.update(_index, _batch, commit=commit)
+
+
+def rebuild_lr_index(batch_size=100, processes=1, resume=False,
+                     progress_file=None):
+    """
+    Recreates the search index entries of all published language resources.
+
+    The resources are indexed in chunks of the given size, in the order of
+    their ids; if more than one process is requested, the chunks are prepared
+    and sent to the search index by this many worker processes in parallel.
+    The search index is committed after each chunk and the id of the last
+    resource of all chunks done so far is written to the given progress file.
+    If `resume` is True, the search index is not cleared and all resources up
+    to the id in the progress file are skipped.
+
+    Returns the number of indexed resources.
+    """
+    if progress_file is None:
+        progress_file = os.path.join(LOCK_DIR, 'lr_index_progress')
+    _alias = haystack_connection_router.for_write()
+    _last_id = 0
+    if resume and os.path.isfile(progress_file):
+        with open(progress_file) as _in:
+            _last_id = int(_in.read().strip() or 0)
+        LOGGER.info('Resuming the reindexing after resource #{0}.'
+                    .format(_last_id))
+    elif not resume:
+        call_command('clear_index', interactive=False, using=_alias)
+    _index = haystack_connections[_alias].get_unified_index() \
+        .get_index(resourceInfoType_model)
+    _backend = haystack_connections[_alias].get_backend()
+    _ids = list(_index.index_queryset().filter(id__gt=_last_id) \
+                .order_by('id').values_list('id', flat=True))
+    _chunks = [_ids[_start:_start + batch_size]
+               for _start in range(0, len(_ids), batch_size)]
+    _pool = None
+    if processes > 1 and len(_chunks) > 1:
+        # the worker processes must not share the database connection of this
+        # process; each one opens its own connection
+        connection.close()
+        _pool = Pool(min(processes, len(_chunks)))
+    try:
+        if _pool is None:
+            _results = (_index_lr_chunk(_chunk) for _chunk in _chunks)
+        else:
+            _results = _pool.imap(_index_lr_chunk, _chunks)
+        _count = 0
+        # the chunks are finished in order so that the progress file always
+        # denotes a state up to which all resources have been indexed
+        for _chunk in _chunks:
+            _count += _results.next()
+            _backend.conn.commit()
+            invalidate_search_results()
+            with open(progress_file, 'w') as _out:
+                _out.write(str(_chunk[-1]))
+            LOGGER.info('Indexed {0} of {1} resources.'
+                        .format(_count, len(_ids)))
+    finally:
+        if _pool is not None:
+            # all chunks are done unless an error occurred, in which case the
+            # remaining ones are abandoned
+            _pool.terminate()
+            _pool.join()
+    if os.path.isfile(progress_file):
+        os.remove(progress_file)
+    return _count
+
+
+def _index_lr_chunk(res_ids):
+    """
+    Sends the search index entries of the language resources with the given
+    ids to the search index without committing it.
+
+    Returns the number of resources.
+    """
+    update_lr_index_entries(res_ids, len(res_ids), commit=False)
+    return len(res_ids)
+
+
+def update_lr_index_counters(res_ids, batch_size=100):
+    """
+    Updates the view and download counts in the search index entries of the
+    language resources with the given ids in batches of the given size.
+
+    The search index entries are recreated from the documents which have been
+    cached when the resources were last indexed so that only the counts have
+    to be prepared again; the rendered search results do not contain the
+    counts, which are added when the results are shown. Resources without an
+    up-to-date cached document are completely reindexed.
+    """
+    _alias = haystack_connection_router.for_write()
+    _index = haystack_connections[_alias].get_unified_index() \
+        .get_index(resourceInfoType_model)
+    _backend = haystack_connections[_alias].get_backend()
+    res_ids = list(res_ids)
+    for _start in range(0, len(res_ids), batch_size):
+        _docs = {}
+        _outdated = []
+        for obj in _index.index_queryset().select_related('storage_object') \
+                .filter(id__in=res_ids[_start:_start + batch_size]):
+            _storage_object = obj.storage_object
+            _doc = _get_cached_index_document(obj.id,
+                (_storage_object.revision, _storage_object.modified))
+            if _doc is None:
+                _outdated.append(obj.id)
+            else:
+                _docs[_storage_object.identifier] = _doc
+        if _docs:
+            _dl_counts = model_utils.get_lr_stat_action_counts(_docs.keys(),
+                                                               DOWNLOAD_STAT)
+            _view_counts = model_utils.get_lr_stat_action_counts(_docs.keys(),
+                                                                 VIEW_STAT)
+            for _identifier, _doc in _docs.iteritems():
+                _doc['dl_count'] = _dl_counts.get(_identifier, 0)
+                _doc['view_count'] = _view_counts.get(_identifier, 0)
+            # the cached search results are not invalidated: the shown counts
+            # are not taken from the search index and the results which are
+            # sorted by the counts are only cached for a short time
+            _backend.conn.add(_docs.values(), commit=True)
+        if _outdated:
+            LOGGER.debug('No cached search index documents for resources {0}.'
+                         .format(_outdated))
+            update_lr_index_entries(_outdated, batch_size)
+
+
+def _index_document_cache_key(res_id):
+    return 'lr_index_document_{0}'.format(res_id)
+
+
+def _get_cached_index_document(res_id, version):
+    """
+    Returns the cached search index document of the language resource with the
+    given id if it has been prepared for the given storage object revision and
+    modification date; otherwise None.
+    """
+    _cached = cache.get(_index_document_cache_key(res_id))
+    if _cached is not None and _cached[0] == version:
+        return _cached[1]
+    return None
+
+
+# the state of the search index document preparation of the current thread
+_PREPARATION = threading.local()
+
+
+def _facet(prepare_method):
+    """
+    A decorator for the `prepare_*` methods of search facet fields: while
+    preparing a search index document, each facet value is computed only once
+    and it is taken from the facet snapshot of the resource, if possible.
+    """
+    _name = prepare_method.__name__
+    @wraps(prepare_method)
+    def _prepare(self, obj):
+        _facets = getattr(_PREPARATION, 'facets', None)
+        if _facets is None:
+            # not called from resourceInfoType_modelIndex.prepare()
+            return prepare_method(self, obj)
+        if _name not in _facets:
+            _facets[_name] = prepare_method(self, obj)
+        return _facets[_name]
+    return _prepare
+
+
+def _get_facet_snapshot(obj):
+    """
+    Returns the dictionary of the facet values which have been computed for
+    the current metadata of the given resource or None if there are none.
+    """
+    _storage_object = obj.storage_object
+    try:
+        _snapshot = ResourceFacetSnapshot.objects.get(
+            lrid=_storage_object.identifier)
+    except ResourceFacetSnapshot.DoesNotExist:
+        return None
+    if _snapshot.revision != _storage_object.revision \
+            or _snapshot.modified != _storage_object.modified:
+        return None
+    return json.loads(_snapshot.facets)
+
+
+def _save_facet_snapshot(obj, facets):
+    """
+    Saves the given dictionary of facet values as the facet snapshot for the
+    current metadata of the given resource.
+    """
+    _storage_object = obj.storage_object
+    _snapshot, _ = ResourceFacetSnapshot.objects.get_or_create(
+        lrid=_storage_object.identifier,
+        defaults={'revision': _storage_object.revision,
+                  'modified': _storage_object.modified})
+    _snapshot.revision = _storage_object.revision
+    _snapshot.modified = _storage_object.modified
+    # display values may be lazy translation objects
+    _snapshot.facets = json.dumps(facets, default=force_unicode)
+    _snapshot.save()
+
+
 class PatchedRealTimeSearchIndex(RealTimeSearchIndex):
     """
     A patched version of the `RealTimeSearchIndex` which works around Haystack
@@ -420,6 +649,52 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                                                                using=using,
                                                                **kwargs)
 
+    def full_prepare(self, obj):
+        """
+        Returns the search index document for the given resource object.
+
+        In this implementation the document is additionally cached for
+        update_lr_index_counters().
+        """
+        result = super(resourceInfoType_modelIndex, self).full_prepare(obj)
+        _storage_object = obj.storage_object
+        cache.set(_index_document_cache_key(obj.id),
+                  ((_storage_object.revision, _storage_object.modified),
+                   dict(result)),
+                  INDEX_DOCUMENT_CACHE_TIMEOUT)
+        return result
+
+    def prepare(self, obj):
+        """
+        Returns the search index document data for the given resource object.
+
+        In this implementation all facet values are taken from the facet
+        snapshot of the resource if it is up to date; otherwise they are
+        computed and saved as the new facet snapshot.
+        """
+        _snapshot = _get_facet_snapshot(obj)
+        _PREPARATION.facets = _snapshot or {}
+        _PREPARATION.component = None
+        try:
+            result = super(resourceInfoType_modelIndex, self).prepare(obj)
+            if _snapshot is None:
+                _save_facet_snapshot(obj, _PREPARATION.facets)
+        finally:
+            _PREPARATION.facets = None
+            _PREPARATION.component = None
+        return result
+
+    def _get_resource_component(self, obj):
+        """
+        Returns the resource component of the given resource object, i.e., the
+        subclass instance of its `resourceComponentType`.
+        """
+        if getattr(_PREPARATION, 'facets', None) is None:
+            return obj.resourceComponentType.as_subclass()
+        if _PREPARATION.component is None:
+            _PREPARATION.component = obj.resourceComponentType.as_subclass()
+        return _PREPARATION.component
+
     def prepare_dl_count(self, obj):
         """
         Returns the download count for the given resource object.
@@ -434,6 +709,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
         return model_utils.get_lr_stat_action_count(
             obj.storage_object.identifier, VIEW_STAT)
 
+    @_facet
     def prepare_resourceNameSort(self, obj):
         """
         Collect the data to sort the Resource Names
@@ -448,6 +724,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return resourceNameSort
 
+    @_facet
     def prepare_resourceTypeSort(self, obj):
         """
         Collect the data to sort the Resource Types
@@ -467,6 +744,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return resourceTypeSort
 
+    @_facet
     def prepare_mediaTypeSort(self, obj):
         """
         Collect the data to sort the Media Types
@@ -486,6 +764,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return mediaTypeSort
 
+    @_facet
     def prepare_languageNameSort(self, obj):
         """
         Collect the data to sort the Language Names
@@ -505,12 +784,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return languageNameSort
 
+    @_facet
     def prepare_languageNameFilter(self, obj):
         """
         Collect the data to filter the resources on Language Name
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -565,33 +845,38 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_resourceTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type
         """
-        resType = obj.resourceComponentType.as_subclass().resourceType
+        resType = self._get_resource_component(obj).resourceType
         if resType:
             return [resType]
         return []
 
+    @_facet
     def prepare_mediaTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type
         """
         return model_utils.get_resource_media_types(obj)
 
+    @_facet
     def prepare_availabilityFilter(self, obj):
         """
         Collect the data to filter the resources on Availability
         """
         return obj.distributionInfo.get_availability_display()
 
+    @_facet
     def prepare_licenceFilter(self, obj):
         """
         Collect the data to filter the resources on Licence
         """
         return model_utils.get_resource_license_types(obj)
 
+    @_facet
     def prepare_restrictionsOfUseFilter(self, obj):
         """
         Collect the data to filter the resources on Restrictions Of USe
@@ -600,6 +885,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                 obj.distributionInfo.licenceinfotype_model_set.all()
                 for restr in licence_info.get_restrictionsOfUse_display_list()]
 
+    @_facet
     def prepare_validatedFilter(self, obj):
         """
         Collect the data to filter the resources on Validated
@@ -607,6 +893,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
         return [validation_info.validated for validation_info in
                 obj.validationinfotype_model_set.all()]
 
+    @_facet
     def prepare_foreseenUseFilter(self, obj):
         """
         Collect the data to filter the resources on Foreseen Use
@@ -616,6 +903,7 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                     obj.usageInfo.foreseenuseinfotype_model_set.all()]
         return []
 
+    @_facet
     def prepare_useNlpSpecificFilter(self, obj):
         """
         Collect the data to filter the resources on NLP Specific
@@ -626,18 +914,20 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                     for use in use_info.get_useNLPSpecific_display_list()]
         return []
 
+    @_facet
     def prepare_lingualityTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Linguality Type
         """
         return model_utils.get_resource_linguality_infos(obj)
 
+    @_facet
     def prepare_multilingualityTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Multilinguality Type
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -720,12 +1010,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_modalityTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Modality Type
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -799,12 +1090,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_mimeTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Mime Type
         """
         mimeType_list = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -866,12 +1158,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return mimeType_list
 
+    @_facet
     def prepare_bestPracticesFilter(self, obj):
         """
         Collect the data to filter the resources on Best Practices
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -914,12 +1207,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_domainFilter(self, obj):
         """
         Collect the data to filter the resources on Domain
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -975,12 +1269,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_geographicCoverageFilter(self, obj):
         """
         Collect the data to filter the resources on Geographic Coverage
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1039,12 +1334,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_timeCoverageFilter(self, obj):
         """
         Collect the data to filter the resources on Time Coverage
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1100,12 +1396,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_subjectFilter(self, obj):
         """
         Collect the data to filter the resources on Subject
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1139,13 +1436,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_corpusAnnotationTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1171,13 +1469,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_corpusAnnotationFormatFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1203,44 +1502,48 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_languageDescriptionLDTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
         if isinstance(corpus_media, languageDescriptionInfoType_model):
             return [corpus_media.get_languageDescriptionType_display()]
         return []
 
+    @_facet
     def prepare_languageDescriptionEncodingLevelFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
         if isinstance(corpus_media, languageDescriptionInfoType_model) \
                 and corpus_media.languageDescriptionEncodingInfo:
             return corpus_media.languageDescriptionEncodingInfo \
                 .get_encodingLevel_display_list()
         return []
 
+    @_facet
     def prepare_languageDescriptionGrammaticalPhenomenaCoverageFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
         if isinstance(corpus_media, languageDescriptionInfoType_model) \
                 and corpus_media.languageDescriptionEncodingInfo:
             return corpus_media.languageDescriptionEncodingInfo \
                 .get_grammaticalPhenomenaCoverage_display_list()
         return []
 
+    @_facet
     def prepare_lexicalConceptualResourceLRTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for lexicalConceptual
         if isinstance(corpus_media, lexicalConceptualResourceInfoType_model):
@@ -1248,13 +1551,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_lexicalConceptualResourceEncodingLevelFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for lexicalConceptual
         if isinstance(corpus_media, lexicalConceptualResourceInfoType_model):
@@ -1264,13 +1568,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_lexicalConceptualResourceLinguisticInformationFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for lexicalConceptual
         if isinstance(corpus_media, lexicalConceptualResourceInfoType_model):
@@ -1281,13 +1586,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
         return result
     
 
+    @_facet
     def prepare_toolServiceToolServiceTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1295,13 +1601,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_toolServiceToolServiceSubTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1309,13 +1616,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_toolServiceLanguageDependentTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1323,13 +1631,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_toolServiceInputOutputResourceTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1342,13 +1651,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_toolServiceInputOutputMediaTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1359,13 +1669,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_toolServiceAnnotationTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, toolServiceInfoType_model):
             if corpus_media.inputInfo:
@@ -1375,13 +1686,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_toolServiceAnnotationFormatFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1394,13 +1706,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_toolServiceEvaluatedFilter(self, obj):
         """
         Collect the data to filter the resources on Resource Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for toolService
         if isinstance(corpus_media, toolServiceInfoType_model):
@@ -1409,13 +1722,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_textTextGenreFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1426,13 +1740,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
 
+    @_facet
     def prepare_textTextTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1443,13 +1758,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_textRegisterFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1460,13 +1776,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioAudioGenreFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1477,13 +1794,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioSpeechGenreFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1494,13 +1812,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioRegisterFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1511,13 +1830,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioSpeechItemsFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1535,13 +1855,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioNaturalityFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1552,13 +1873,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioConversationalTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1569,13 +1891,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_audioScenarioTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1586,13 +1909,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_videoVideoGenreFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1606,13 +1930,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_videoTypeOfVideoContentFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1640,13 +1965,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_videoNaturalityFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1657,13 +1983,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_videoConversationalTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1674,13 +2001,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_videoScenarioTypeFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1691,13 +2019,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_imageImageGenreFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1710,13 +2039,14 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_imageTypeOfImageContentFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
         result = []
 
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
@@ -1745,11 +2075,12 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
 
         return result
     
+    @_facet
     def prepare_textnumericalTypeOfTnContentFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1759,11 +2090,12 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                     .textNumericalContentInfo.typeOfTextNumericalContent
         return []
     
+    @_facet
     def prepare_textngramBaseItemFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1772,11 +2104,12 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                         .get_baseItem_display()]
         return []
 
+    @_facet
     def prepare_textngramOrderFilter(self, obj):
         """
         Collect the data to filter the resources on Media Type children
         """
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
         # Filter for corpus
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1784,12 +2117,13 @@ class resourceInfoType_modelIndex(PatchedRealTimeSearchIndex,
                 return [str(media_type.corpusTextNgramInfo.ngramInfo.order)]
         return []
 
+    @_facet
     def prepare_languageVarietyFilter(self, obj):
         """
         Collect the data to filter the resources on Language Variety
         """
         result = []
-        corpus_media = obj.resourceComponentType.as_subclass()
+        corpus_media = self._get_resource_component(obj)
 
         if isinstance(corpus_media, corpusInfoType_model):
             media_type = corpus_media.corpusMediaType
@@ -1,8 +1,10 @@
 import datetime
+import hashlib
 import logging
 import re
+import threading
 import urllib
-from Queue import Queue
+from contextlib import contextmanager
 from traceback import format_exc
 from xml.etree.ElementTree import Element, fromstring, tostring
 
@@ -12,12 +14,14 @@ from django.core.exceptions import ValidationError, ObjectDoesNotExist, \
     ImproperlyConfigured
 from django.db import models, IntegrityError
 from django.db.models.fields import related
-from django.db.models.fields.related import ForeignRelatedObjectsDescriptor, \
-    OneToOneField
+from django.db.models.fields.related import ForeignRelatedObjectsDescriptor
+from django.dispatch import Signal
 
 import metashare.repository.models
 from metashare.repository.fields import MultiSelectField, MultiTextField, \
     MetaBooleanField, DictField
+from metashare.repository.object_xml_cache import create_object_xml_cache, \
+    object_xml_cache_key
 from metashare.settings import LOG_HANDLER, \
     CHECK_FOR_DUPLICATE_INSTANCES
 from metashare.storage.models import MASTER
@@ -47,7 +51,46 @@ SCHEMA_URL = 'http://metashare.ilsp.gr/META-XMLSchema/v{0}/' \
 METASHARE_ID_REGEXP = re.compile('<metashareId>.+</metashareId>',
   re.I|re.S|re.U)
 
-OBJECT_XML_CACHE = {}
+# the cache for the serialized XML of objects used in _check_for_duplicates()
+OBJECT_XML_CACHE = create_object_xml_cache()
+
+# the state of the imports from XML of the current thread
+_IMPORTS = threading.local()
+
+# sent for every instance which has been imported from XML, once all imports
+# of the current thread have finished
+post_import = Signal(providing_args=['instance'])
+
+
+def is_import_in_progress():
+    """
+    Returns whether objects are being imported from XML in the current thread.
+    """
+    return getattr(_IMPORTS, 'depth', 0) > 0
+
+
+@contextmanager
+def import_in_progress():
+    """
+    A context manager for importing objects from XML in the current thread.
+
+    While it is active, the content hashes and the reverse-reference index are
+    not updated whenever a single object is saved; the imports compute the
+    content hashes of the objects which they create, and `post_import` is
+    sent for the imported instances once the outermost context is left.
+    """
+    if not is_import_in_progress():
+        _IMPORTS.imported = []
+    _IMPORTS.depth = getattr(_IMPORTS, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _IMPORTS.depth -= 1
+    if not is_import_in_progress():
+        _imported, _IMPORTS.imported = _IMPORTS.imported, []
+        for _instance in _imported:
+            if _instance.pk is not None:
+                post_import.send(sender=type(_instance), instance=_instance)
 
 # This import is required for at least an `eval` in the `_classify` function:
 # pylint: disable-msg=W0611
@@ -114,6 +157,14 @@ class SchemaModel(models.Model):
     __schema_classes__ = {}
     __schema_parent__ = None
     
+    # the MD5 hash of the field values of this object and of the content
+    # hashes of the objects which it contains, without any META-SHARE ids;
+    # computed when the object is imported or when it is needed and reset
+    # whenever the object or an object which it contains changes (see
+    # content_hashes.py)
+    content_hash = models.CharField(max_length=32, null=True, blank=True,
+                                    editable=False, db_index=True)
+
     class Meta:
         """
         This is an abstract super class for all schema models.
@@ -314,14 +365,25 @@ class SchemaModel(models.Model):
 
         return result
 
-    def export_to_elementtree(self, pretty=False, parent_dict=None):
+    def export_to_elementtree(self, pretty=False, parent_dict=None,
+                              prefetch=False):
         """
         Exports this instance to an XML ElementTree. If pretty is True, XML
         elements include an additional attribute 'pretty' with the pretty-print
         name as defined in the model.
         In the given parent directory, a mapping of each element to its parent
         element is stored.
+        If prefetch is True, then all related objects are loaded in batches
+        before the export instead of one at a time during the export; see
+        metashare.repository.export_prefetch for exporting multiple instances.
         """
+        if prefetch:
+            from metashare.repository.export_prefetch import \
+                prefetched_for_export
+            with prefetched_for_export([self]):
+                return self.export_to_elementtree(pretty=pretty,
+                                                  parent_dict=parent_dict)
+
         if parent_dict is None:
             parent_dict = {}
         
@@ -393,9 +455,14 @@ class SchemaModel(models.Model):
                 elif isinstance(_field, DictField):
                     _value = _value.items()
 
-                # For ManyToManyFields, compute all related objects.
+                # For ManyToManyFields, compute all related objects unless
+                # they have been prefetched.
                 if isinstance(_value, models.Manager):
-                    _value = _value.all().order_by('id')
+                    _prefetched = getattr(self, '_export_prefetched', {})
+                    if _model_field in _prefetched:
+                        _value = _prefetched[_model_field]
+                    else:
+                        _value = _value.all().order_by('id')
 
                 # If the value is not yet of list type, we wrap it in a list.
                 elif not isinstance(_value, list):
@@ -517,135 +584,104 @@ class SchemaModel(models.Model):
         if not CHECK_FOR_DUPLICATE_INSTANCES:
             return []
 
-        _was_duplicate = False
-        _related_objects = []
+        # the content hash covers all fields which are serialized to XML and
+        # the objects which this object contains; it has been computed
+        # bottom-up during the import
+        return list(cls.objects.filter(
+            content_hash=_object.get_content_hash()) \
+            .exclude(id=_object.id).order_by('id'))
 
-        # We collect all value constraints in a dictionary.
-        kwargs = {}
-
-        # Build list of field names for this class type.  Using introspection
-        # with cls._meta.get_all_field_names() would not work as it contains
-        # additional fields such as id and related fields that would break our
-        # comparison code.
-        _fields = [x[1] for x in cls.__schema_fields__]
-        _fields.extend([x[1] for x in cls.__schema_attrs__])
-        if hasattr(_object, 'copy_status'):
-            _fields.append('copy_status')
-        
-        if _object.__schema_name__ == "STRINGMODEL":
-            _fields.append("value")
-        
-        # Ensure that "back_to_" pointers are available for checking.
-        for _field in cls._meta.fields:
-            if isinstance(_field, related.ForeignKey):
-                if _field.name.startswith('back_to_') and \
-                  not _field.name in _fields:
-                    _fields.append(_field.name)
-
-        # We iterate over all model fields of the current _object.
-        for field_name in _fields:
-            # OneToMany fields need to be handled later, hence we add these to
-            # our _related_objects list and continue with the loop.
-            if field_name.endswith('_set'):
-                _related_objects.append(field_name)
-                LOGGER.debug(u'Skipping OneToMany "{}"'.format(field_name))
-                continue
-
-            # Retrieve the model field value using getattr().  This is enough
-            # as even if a get_FOO_display() method would exist for a field,
-            # the "raw" values needed to be compared anyway.
-            _value = getattr(_object, field_name, None)
-
-            # Retrieve model field instance to allow type checking.
-            _field = _object._meta.get_field_by_name(field_name)[0]
-
-            # For ManyToManyFields, compute the list of related objects.
-            if isinstance(_field, related.ManyToManyField):
-                _value = _value.all()
-
-                # If there is no related object for this ManyToManyField, we
-                # have to constrain kwargs[field_name] with the None value.
-                if not len(_value):
-                    _value = None
-
-                # We have to use '__in' QuerySet lookup to avoid the "more
-                # than one row returned by a subquery used as an expression"
-                # bug which raises a DatabaseError otherwise.
+    def get_content_xml(self):
+        """
+        Returns the serialised XML String of this object without any
+        META-SHARE related id as used for comparing objects' contents.
+        """
+        cache_key = object_xml_cache_key(self)
+        _value = OBJECT_XML_CACHE.get(cache_key)
+        if _value is None:
+            _value = tostring(self.export_to_elementtree())
+            _value = METASHARE_ID_REGEXP.sub('', _value)
+            OBJECT_XML_CACHE.set(cache_key, _value)
+        return _value
+
+    def get_content_hash(self):
+        """
+        Returns the content hash of this object; if it is not known, then it
+        is computed and stored without saving any other fields of this object.
+        """
+        if self.content_hash is None:
+            self.content_hash = self.compute_content_hash()
+            type(self).objects.filter(id=self.id) \
+                .update(content_hash=self.content_hash)
+        return self.content_hash
 
-                else:
-                    field_name += '__in'
+    def compute_content_hash(self):
+        """
+        Computes the content hash of this object from the values of all fields
+        which are serialized to XML, except for META-SHARE ids, and from the
+        content hashes of the objects which it contains.
 
-            # Finally, OneToOneField instances have to be checked as related
-            # objects and hence need to be put into _related_objects.
-            elif isinstance(_field, related.OneToOneField):
-                LOGGER.debug(u'Skipping OneToOne "{}"'.format(field_name))
-                _related_objects.append(field_name)
-                continue
+        Unlike get_content_xml(), this does not serialize the contained
+        objects again; objects with equal content hashes have equal XML
+        serializations, too.
+        """
+        if self.__schema_name__ == "SUBCLASSABLE":
+            # pylint: disable-msg=E1101
+            return self.as_subclass().compute_content_hash()
 
-            # For ForeignKey instances, we have to check their name first.
-            # "back_to_" fields need to be put into _related_objects, while
-            # "normal" ForeignKey fields can be checked with our QuerySet.
-            elif isinstance(_field, related.ForeignKey):
-                if field_name.startswith('back_to_'):
-                    LOGGER.debug(u'Skipping back_to "{}"'.format(field_name))
-                    _related_objects.append(field_name)
-                    continue
+        _parts = [self.__schema_name__]
+        if self.__schema_name__ == "STRINGMODEL":
+            _parts.append(SchemaModel._python_to_xml(self.value))
+        if hasattr(self, 'copy_status'):
+            _parts.append(self.copy_status)
 
-            # If the field value is not None or the field allows None as value
-            # we set the current value as constraint in our kwargs dictionary.
+        for _xsd_attr, _model_field, _not_used in self.__schema_attrs__:
+            _value = getattr(self, _model_field, None)
             if _value is not None:
-                kwargs[field_name] = _value
-
-            elif _field.null:
-                kwargs[field_name] = None
+                _parts.append((_xsd_attr, SchemaModel._python_to_xml(_value)))
 
-            # Otherwise, we print a message that we skip the current field.
-            else:
-                LOGGER.debug(u'Skipping {0}={1} ({2})'.format(field_name,
-                  _value, type(_field)))
+        for _xsd_field, _model_field, _not_used in self.__schema_fields__:
+            if _xsd_field.split('/')[-1] == 'metashareId':
+                continue
+            _value = getattr(self, _model_field, None)
+            if _value is None or _value == "":
+                continue
 
-        # Use **magic to create a constrained QuerySet from kwargs.
-        query_set = cls.objects.filter(**kwargs).order_by('id')
+            _field = None
+            if not _model_field.endswith('_model_set'):
+                _field = self._meta.get_field_by_name(_model_field)[0]
 
-        _duplicates = []
-        if query_set.count() > 1:
-            # We now know that there may exist at least one duplicate for the
-            # given _object;  we have to check the related objects to be sure.
-            
-            # Convert the current object into its serialised XML String and
-            # remove any META-SHARE related id from this String.
-            cache_key = '{}_{}'.format(type(_object).__name__.lower(),
-              _object.id)
-            if OBJECT_XML_CACHE.has_key(cache_key):
-                _obj_value = OBJECT_XML_CACHE[cache_key]
-            
-            else:
-                _obj_value = tostring(_object.export_to_elementtree())
-                _obj_value = METASHARE_ID_REGEXP.sub('', _obj_value)
-                OBJECT_XML_CACHE[cache_key] = _obj_value
-
-            # Iterate over all potential duplicates, ordered by increasing id.
-            for _candidate in query_set.iterator():
-                # Skip the current candidate if it is our _object itself.
-                if _candidate == _object:
-                    continue
-
-                # Convert candidate into XML String and remove META-SHARE id.
-                cache_key = '{}_{}'.format(type(_candidate).__name__.lower(),
-                  _candidate.id)
-                if OBJECT_XML_CACHE.has_key(cache_key):
-                    _check = OBJECT_XML_CACHE[cache_key]
+            # Normalise the values in the same way as export_to_elementtree().
+            if isinstance(_field, MultiSelectField):
+                _value = sorted(_value)
+            elif isinstance(_field, DictField):
+                _value = sorted(_value.items())
+            if isinstance(_value, models.Manager):
+                _value = _value.all().order_by('id')
+            elif not isinstance(_value, list):
+                _value = [_value]
+
+            _sub_parts = []
+            for _sub_value in _value:
+                # SubclassableModel values are only serialized for the XSD
+                # name of their sub class type.
+                if isinstance(_sub_value, SubclassableModel):
+                    _sub_value = _sub_value.as_subclass()
+                    if _sub_value.__class__.__name__ != \
+                      self.__schema_classes__.get(_xsd_field.split('/')[-1]):
+                        continue
 
+                if isinstance(_sub_value, SchemaModel):
+                    _sub_parts.append(_sub_value.get_content_hash())
+                elif isinstance(_sub_value, tuple):
+                    _sub_parts.append((_sub_value[0], SchemaModel \
+                      ._python_to_xml(_sub_value[1], _field)))
                 else:
-                    _check = tostring(_candidate.export_to_elementtree())
-                    _check = METASHARE_ID_REGEXP.sub('', _check)
-                    OBJECT_XML_CACHE[cache_key] = _check
+                    _sub_parts.append(
+                      SchemaModel._python_to_xml(_sub_value, _field))
+            _parts.append((_xsd_field, _sub_parts))
 
-                # If both XML Strings are equal, we have found a duplicate!
-                if _obj_value == _check:
-                    _duplicates.append(_candidate)
-
-        return _duplicates
+        return hashlib.md5(repr(_parts)).hexdigest()
 
     @staticmethod
     def _cleanup(objects, only_remove_duplicates=False):
@@ -677,11 +713,7 @@ class SchemaModel(models.Model):
             if obj.id:
                 try:
                     LOGGER.debug(u'Deleting object {0}'.format(obj))
-                    cache_key = '{}_{}'.format(type(obj).__name__.lower(),
-                      obj.id)
-
-                    if OBJECT_XML_CACHE.has_key(cache_key):
-                        OBJECT_XML_CACHE.pop(cache_key)
+                    OBJECT_XML_CACHE.delete(object_xml_cache_key(obj))
 
                     if obj.__schema_name__ == "resourceInfo":
                         storage_object = obj.storage_object
@@ -694,7 +726,6 @@ class SchemaModel(models.Model):
         
         return _objects
 
-    # pylint: disable-msg=R0911
     @classmethod
     def import_from_elementtree(
       cls, element_tree, cleanup=True, parent=None, copy_status=MASTER):
@@ -707,6 +738,27 @@ class SchemaModel(models.Model):
 
         Returns (None, [], error_msg) in case of errors.
         """
+        _outermost = not getattr(_IMPORTS, 'importing_object', False)
+        with import_in_progress():
+            _IMPORTS.importing_object = True
+            try:
+                result = cls._import_from_elementtree(element_tree,
+                  cleanup=cleanup, parent=parent, copy_status=copy_status)
+            finally:
+                if _outermost:
+                    _IMPORTS.importing_object = False
+            if _outermost and result[0] is not None:
+                _IMPORTS.imported.append(result[0])
+            return result
+
+    # pylint: disable-msg=R0911
+    @classmethod
+    def _import_from_elementtree(
+      cls, element_tree, cleanup, parent, copy_status):
+        """
+        Imports the given XML ElementTree into an instance of type cls; see
+        import_from_elementtree().
+        """
         LOGGER.debug(u'parent: {0}'.format(parent))
         
         # We ignore name space information in tags, hence we remove it.
@@ -1086,6 +1138,11 @@ class SchemaModel(models.Model):
             _object.full_clean()
             _object.save()
 
+            # All objects which the current _object contains have been
+            # imported and hashed before, so its content hash can be computed
+            # from theirs.
+            _object.get_content_hash()
+
             # Check if the current _object instance is a duplicate.
             _duplicates = cls._check_for_duplicates(_object)
             _was_duplicate = len(_duplicates) > 0
@@ -1281,10 +1338,22 @@ class SchemaModel(models.Model):
         '''
             Override the superclass method to trigger cache updating.
         '''
+        if not is_import_in_progress():
+            # the content hash is computed again when it is needed
+            self.content_hash = None
         super(SchemaModel, self).save(force_insert, force_update, using)
         cache_key = '{}_{}'.format(self.__schema_name__, self.id)
         #print u'deleting {}_{}'.format(self.__schema_name__, self.id)
         cache.delete(cache_key)
+        # the serialized XML of this object may have changed, and with it the
+        # content hashes and the cached XML of this object and of all objects
+        # which contain it; imports compute the content hashes of the objects
+        # which they create themselves
+        OBJECT_XML_CACHE.delete(object_xml_cache_key(self))
+        if not is_import_in_progress():
+            from metashare.repository.content_hashes import \
+                reset_content_hashes
+            reset_content_hashes(type(self), [self.id], containers_only=True)
 
 
     def delete_deep(self, keep_stats=False):
@@ -1301,31 +1370,10 @@ class SchemaModel(models.Model):
         This method is not automatically hooked into the default django
         delete mechanism; it needs to be called explicitly.
         '''
-        # Basic idea: do a breadth-first search, and delete each node when its children have ben enqueued.
-        to_delete = Queue()
-        to_delete.put(self)
-        while not to_delete.empty():
-            obj = to_delete.get()
-            if isinstance(obj, SubclassableModel):
-                obj = obj.as_subclass()
-            for fieldname in obj.get_fields_flat():
-                if fieldname.endswith("_set"):
-                    # a reverse foreign key
-                    related_mgr = getattr(obj, fieldname)
-                    for child in related_mgr.all():
-                        to_delete.put(child)
-                else:
-                    field = obj._meta.get_field(fieldname)
-                    if isinstance(field, OneToOneField):
-                        child = getattr(obj, fieldname)
-                        if child is not None:
-                            to_delete.put(child)
-            if obj.__class__.__name__ == 'resourceInfoType_model':
-                # if instance is a resource, pass the keep_stats parameter
-                obj.delete(keep_stats=keep_stats)
-            else:
-                # ignore keep_stats parameter for all other types
-                obj.delete()
+        # the descendants are collected per model type and deleted together
+        # in a single transaction
+        from metashare.repository.deep_deletion import delete_deep
+        delete_deep(self, keep_stats=keep_stats)
             
 class SubclassableModel(SchemaModel):
     """
@@ -1337,6 +1385,12 @@ class SubclassableModel(SchemaModel):
         return self.__class__.__name__
 
     def as_subclass(self):
+        # the subclass instance may have been prefetched for an export
+        _prefetched = getattr(self, '_export_subclass', None)
+        if _prefetched is self:
+            return self
+        elif _prefetched is not None:
+            return _prefetched.as_subclass()
         # pylint: disable-msg=E1101
         subclasses = self.__class__.__subclasses__()
         for subclass in subclasses:
@@ -1,4 +1,5 @@
 from django import template
+from django.template.loader import render_to_string
 
 from metashare.repository import model_utils
 from metashare.stats.model_utils import DOWNLOAD_STAT, VIEW_STAT
@@ -7,6 +8,12 @@ from metashare.stats.model_utils import DOWNLOAD_STAT, VIEW_STAT
 # module level "register" variable as required by Django
 register = template.Library()
 
+# the placeholder in the indexed search result snippets which is replaced by
+# the current access statistics when the search results are shown; the counts
+# are not indexed so that recording a view or download does not require
+# rendering the snippet again
+ACCESS_STATS_MARKER = u'<!--accessStats-->'
+
 
 def get_download_count(identifier):
     """
@@ -30,3 +37,38 @@ def get_view_count(identifier):
     return model_utils.get_lr_stat_action_count(identifier, VIEW_STAT)
 
 register.filter('get_view_count', get_view_count)
+
+
+def access_stats_marker():
+    """
+    Template tag which outputs the placeholder for the access statistics in a
+    search result snippet.
+    """
+    return ACCESS_STATS_MARKER
+
+register.simple_tag(access_stats_marker)
+
+
+def with_access_stats(result):
+    """
+    Template filter which returns the rendered search result snippet of the
+    given search result with the download and view counts which have been set
+    as its `dl_count` and `view_count` attributes.
+
+    Snippets which have been indexed before the placeholder was introduced
+    still contain the access statistics of their indexing time; they are shown
+    as they are until the index is rebuilt. Snippets without any access
+    statistics get the current ones appended.
+    """
+    _rendered = result.rendered_result
+    if ACCESS_STATS_MARKER not in _rendered \
+            and u'class="accessStats"' in _rendered:
+        return _rendered
+    _stats = render_to_string('repository/resource_access_stats.html',
+        {'dl_count': getattr(result, 'dl_count', 0),
+         'view_count': getattr(result, 'view_count', 0)})
+    if ACCESS_STATS_MARKER not in _rendered:
+        return _rendered + _stats
+    return _rendered.replace(ACCESS_STATS_MARKER, _stats, 1)
+
+register.filter('with_access_stats', with_access_stats)
@@ -19,9 +19,10 @@ from metashare.repository import models
 from metashare.repository.editor.lookups import PersonLookup, ActorLookup, \
     DocumentationLookup, DocumentLookup, ProjectLookup, OrganizationLookup, \
     TargetResourceLookup
+from metashare.repository.lookup_index import rebuild_lookup_index
 from metashare.repository.models import languageDescriptionInfoType_model, \
     lexicalConceptualResourceInfoType_model, personInfoType_model,\
-    resourceInfoType_model
+    resourceInfoType_model, LookupEntry
 from metashare.settings import DJANGO_BASE, ROOT_PATH, LOG_HANDLER
 from metashare.storage.models import PUBLISHED, INGESTED, INTERNAL, REMOTE, \
     StorageObject
@@ -901,6 +902,28 @@ class LookupTest(TestCase):
         self.assertContains(response, 'Nice project',
             msg_prefix='a superuser must see the lookup for TargetResource.')
 
+    def test_lookup_index_knows_resource_usage(self):
+        """
+        Verifies that the lookup index which has been maintained during the
+        import knows how often the looked up instances are used and that it
+        equals a rebuilt index.
+        """
+        entries = LookupEntry.objects.filter(
+            model_name='personInfoType_model', names__contains=u'mapelli')
+        self.assertTrue(entries.exists())
+        for entry in entries:
+            self.assertEqual(1, entry.usage_count)
+        response = LookupTest.client.get(reverse(get_lookup,
+            args=(force_unicode(PersonLookup.name()),)), {'term': 'mapelli'})
+        self.assertContains(response, 'Valérie Mapelli')
+        self.assertContains(response, '(used 1 time)')
+        fields = ('model_name', 'object_id', 'names', 'label', 'value',
+                  'subclass', 'master', 'usage_count')
+        maintained_entries = sorted(LookupEntry.objects.values_list(*fields))
+        rebuild_lookup_index()
+        self.assertEqual(maintained_entries,
+                         sorted(LookupEntry.objects.values_list(*fields)))
+
 
 class DataUploadTests(TestCase):
     """
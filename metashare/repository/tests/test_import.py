@@ -7,9 +7,16 @@ from django.test.client import Client
 
 from metashare import test_utils
 from metashare.accounts.models import EditorGroup
+from metashare.repository.management.commands.backfill_content_hashes \
+    import backfill_content_hashes
 from metashare.repository.models import documentUnstructuredString_model, \
-    documentInfoType_model
+    documentInfoType_model, personInfoType_model
+from metashare.repository.object_xml_cache import LocalObjectXmlCache, \
+    object_xml_cache_key
+from metashare.repository.supermodel import OBJECT_XML_CACHE
 from metashare.settings import DJANGO_BASE, ROOT_PATH, LOG_HANDLER
+from metashare.storage.models import PUBLISHED, MASTER
+from metashare.xml_utils import bulk_import_from_files, import_from_file
 
 # Setup logging support.
 LOGGER = logging.getLogger(__name__)
@@ -92,6 +99,104 @@ class ImportTest(TestCase):
         self.assertEqual(1, len(failures), 'Could not import file {} -- successes is {}, failures is {}'.format(_currfile, successes, failures))
         self.assertEquals('broken.xml', failures[0][0])
 
+    def test_parallel_import(self):
+        """
+        Asserts that parsing the records of a zip archive in parallel processes
+        yields the same results as the sequential import.
+        """
+        _currfile = '{}/repository/fixtures/onegood_onebroken.zip'.format(ROOT_PATH)
+        _timings = []
+        with open(_currfile, 'rb') as _zip:
+            successes, failures = import_from_file(_zip, _currfile, PUBLISHED,
+                MASTER, processes=2, timings=_timings)
+        self.assertEqual(1, len(successes), 'successes is {}, failures is {}'
+                         .format(successes, failures))
+        self.assertEqual(1, len(failures), 'successes is {}, failures is {}'
+                         .format(successes, failures))
+        self.assertEquals('broken.xml', failures[0][0])
+        self.assertEqual(2, len(_timings))
+
+    def test_bulk_import(self):
+        """
+        Asserts that the bulk import imports all good records of several files
+        in small batches and writes their storage folders.
+        """
+        _files = ['{}/repository/fixtures/tworesources.zip'.format(ROOT_PATH),
+          '{}/repository/fixtures/onegood_onebroken.zip'.format(ROOT_PATH)]
+        successes, failures = bulk_import_from_files(
+          [(open(_file, 'rb'), _file) for _file in _files], PUBLISHED, MASTER,
+          batch_size=2)
+        self.assertEqual(3, len(successes), 'successes is {}, failures is {}'
+                         .format(successes, failures))
+        self.assertEqual(1, len(failures), 'successes is {}, failures is {}'
+                         .format(successes, failures))
+        self.assertEquals('broken.xml', failures[0][0])
+        for resource in successes:
+            self.assertEqual(PUBLISHED,
+                             resource.storage_object.publication_status)
+            self.assertIsNotNone(resource.storage_object.digest_checksum)
+
+    def test_duplicate_detection_uses_content_hashes(self):
+        """
+        Asserts that reusable entities are recognized as duplicates when
+        importing them again and that their content hashes are stored.
+        """
+        _currfile = '{}/repository/fixtures/testfixture.xml'.format(ROOT_PATH)
+        test_utils.import_xml_or_zip(_currfile)
+        _person_count = personInfoType_model.objects.count()
+        successes, _ = test_utils.import_xml_or_zip(_currfile)
+        self.assertEqual(1, len(successes))
+        self.assertEqual(_person_count, personInfoType_model.objects.count())
+        self.assertTrue(personInfoType_model.objects
+                        .filter(content_hash__isnull=False).exists())
+
+    def test_content_hashes_are_reset_when_contained_objects_change(self):
+        """
+        Asserts that importing an object stores its content hash, that the
+        content hashes of a changed object and of the objects which contain
+        it are reset and that the backfill computes them again.
+        """
+        _currfile = '{}/repository/fixtures/testfixture.xml'.format(ROOT_PATH)
+        test_utils.import_xml_or_zip(_currfile)
+        _person = personInfoType_model.objects \
+            .filter(communicationInfo__isnull=False)[0]
+        _old_hash = _person.content_hash
+        self.assertIsNotNone(_old_hash)
+        self.assertEqual(_old_hash, _person.compute_content_hash())
+        _communication = _person.communicationInfo
+        _communication.email = [u'changed@example.org']
+        _communication.save()
+        self.assertIsNone(type(_communication).objects
+                          .get(pk=_communication.pk).content_hash)
+        self.assertIsNone(personInfoType_model.objects
+                          .get(pk=_person.pk).content_hash)
+        backfill_content_hashes()
+        _new_hash = personInfoType_model.objects.get(pk=_person.pk) \
+            .content_hash
+        self.assertIsNotNone(_new_hash)
+        self.assertNotEqual(_old_hash, _new_hash)
+
+    def test_cached_xml_is_evicted_when_contained_objects_change(self):
+        """
+        Asserts that the cached XML of the objects which contain a changed
+        object is evicted.
+        """
+        _currfile = '{}/repository/fixtures/testfixture.xml'.format(ROOT_PATH)
+        test_utils.import_xml_or_zip(_currfile)
+        _person = personInfoType_model.objects \
+            .filter(communicationInfo__isnull=False)[0]
+        _old_xml = _person.get_content_xml()
+        self.assertEqual(_old_xml,
+                         OBJECT_XML_CACHE.get(object_xml_cache_key(_person)))
+        _communication = _person.communicationInfo
+        _communication.email = [u'changed@example.org']
+        _communication.save()
+        self.assertIsNone(OBJECT_XML_CACHE.get(object_xml_cache_key(_person)))
+        _new_xml = personInfoType_model.objects.get(pk=_person.pk) \
+            .get_content_xml()
+        self.assertNotEqual(_old_xml, _new_xml)
+        self.assertIn('changed@example.org', _new_xml)
+
     def test_import_bug_1(self):
         """
         This constellation caused an import error with a Postgres DB backend.
@@ -145,3 +250,39 @@ class ImportTest(TestCase):
           {'resource': resourcefile}, follow=True)
         self.assertNotContains(response, '<td>{}</td>'.format(ImportTest.test_editor_group.name),
           msg_prefix='expected the system to set None as editor group to the resource.')
+
+
+class ObjectXmlCacheTest(TestCase):
+    """
+    Tests the cache for the serialized XML of objects used during imports.
+    """
+
+    def test_least_recently_used_entries_are_evicted(self):
+        _cache = LocalObjectXmlCache(10)
+        _cache.set('a', 'xxxx')
+        _cache.set('b', 'xxxx')
+        self.assertEqual('xxxx', _cache.get('a'))
+        # 'b' is now the least recently used entry
+        _cache.set('c', 'xxxx')
+        self.assertIsNone(_cache.get('b'))
+        self.assertEqual('xxxx', _cache.get('a'))
+        self.assertEqual('xxxx', _cache.get('c'))
+        self.assertEqual(8, _cache.size())
+
+    def test_values_exceeding_the_budget_are_not_cached(self):
+        _cache = LocalObjectXmlCache(10)
+        _cache.set('a', 'xxxx')
+        _cache.set('b', 'x' * 11)
+        self.assertIsNone(_cache.get('b'))
+        self.assertEqual('xxxx', _cache.get('a'))
+
+    def test_delete_and_clear(self):
+        _cache = LocalObjectXmlCache(10)
+        _cache.set('a', 'xxxx')
+        _cache.set('b', 'xx')
+        _cache.delete('a')
+        self.assertIsNone(_cache.get('a'))
+        self.assertEqual(2, _cache.size())
+        _cache.clear()
+        self.assertEqual(0, len(_cache))
+        self.assertEqual(0, _cache.size())
@@ -1,16 +1,28 @@
+import base64
+import cPickle as pickle
 import sys
 import logging
 
 from difflib import unified_diff
 
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 
 from xml.etree.ElementTree import fromstring, register_namespace
 
 from metashare import test_utils
+from metashare.repository.deep_deletion import plan_deep_deletion
+from metashare.repository.export_prefetch import prefetched_for_export
+from metashare.repository.fields import decode_multitext, encode_multitext, \
+    DefaultCachingDict
 from metashare.repository.models import resourceInfoType_model, \
-    SCHEMA_NAMESPACE, lingualityInfoType_model
+    SCHEMA_NAMESPACE, lingualityInfoType_model, communicationInfoType_model, \
+    modalityInfoType_model, identificationInfoType_model, ResourceReference, \
+    personInfoType_model, sizeInfoType_model
 from metashare.repository.model_utils import get_root_resources
+from metashare.repository.reference_index import get_resource_ids, \
+    count_resources, rebuild_reference_index
 from metashare.settings import ROOT_PATH, LOG_HANDLER
 from metashare.xml_utils import to_xml_string
 
@@ -93,6 +105,26 @@ class ModelTest(TestCase):
         self.assertEqual(_import_xml, _export_xml,
              msg='For file {0}, export differs from import:\n{1}'.format(_roundtrip, diff))
 
+    def test_prefetched_export_equals_export(self):
+        """
+        Checks that exporting resources with prefetched object graphs yields
+        the same XML as exporting them one query at a time.
+        """
+        _ids = [self.resource_id] + [test_utils.import_xml(
+            '{0}/repository/fixtures/{1}'.format(ROOT_PATH, _fixture)).id
+          for _fixture in ('roundtrip.xml', 'ILSP10.xml')]
+        _expected = dict((_res.id, to_xml_string(_res.export_to_elementtree(),
+                                                 encoding="utf-8"))
+          for _res in resourceInfoType_model.objects.filter(id__in=_ids))
+        _resources = list(resourceInfoType_model.objects.filter(id__in=_ids))
+        with prefetched_for_export(_resources):
+            for _res in _resources:
+                self.assertEqual(_expected[_res.id], to_xml_string(
+                    _res.export_to_elementtree(), encoding="utf-8"))
+        _res = resourceInfoType_model.objects.get(pk=self.resource_id)
+        self.assertEqual(_expected[_res.id], to_xml_string(
+            _res.export_to_elementtree(prefetch=True), encoding="utf-8"))
+
     def testImportExportRoundtrip(self):
         """
         Checks that there is no data lost when exporting an imported XML.
@@ -143,9 +175,10 @@ class ModelTest(TestCase):
         self.assert_import_equals_export(_roundtrip)
 
 
-class ModelUtilsTest(TestCase):
+class TestResourcesMixin(object):
     """
-    Tests for model_utils.py.
+    Imports a few test resources before each test and cleans the database
+    after it.
     """
     @classmethod
     def setUpClass(cls):
@@ -174,6 +207,11 @@ class ModelUtilsTest(TestCase):
         test_utils.clean_resources_db()
         test_utils.clean_storage()
 
+
+class ModelUtilsTest(TestResourcesMixin, TestCase):
+    """
+    Tests for model_utils.py.
+    """
     def test_get_root_resources(self):
         """
         Tests the `get_root_resources` method.
@@ -225,3 +263,197 @@ class ModelUtilsTest(TestCase):
                 + list(self.test_res_2.contactPerson.all())
                 + [self.test_res_1.identificationInfo,
                    self.test_res_2.identificationInfo])))
+
+    def test_resource_references_are_maintained(self):
+        """
+        Tests that the reverse-reference index follows the changes of the
+        object graphs of the resources and equals a rebuilt index.
+        """
+        person = self.test_res_2.contactPerson.all()[0]
+        resource_ids = get_resource_ids(person)
+        self.assertIn(self.test_res_2.pk, resource_ids)
+        self.assertNotIn(self.test_res_1.pk, resource_ids)
+        self.assertEqual(len(resource_ids), count_resources(person))
+        # the index follows changes of many-to-many relations
+        self.test_res_1.contactPerson.add(person)
+        self.assertSetEqual(resource_ids | set((self.test_res_1.pk,)),
+                            get_resource_ids(person))
+        self.test_res_1.contactPerson.remove(person)
+        self.assertSetEqual(resource_ids, get_resource_ids(person))
+        # the index is the same as a rebuilt one
+        maintained_references = sorted(ResourceReference.objects \
+            .values_list('model_name', 'object_id', 'resource_id'))
+        rebuild_reference_index()
+        self.assertEqual(maintained_references, sorted(ResourceReference \
+            .objects.values_list('model_name', 'object_id', 'resource_id')))
+        # the references of deleted resources are removed
+        res_2_id = self.test_res_2.pk
+        self.test_res_2.delete_deep()
+        self.assertFalse(ResourceReference.objects.filter(
+            resource_id=res_2_id).exists())
+        self.assertNotIn(res_2_id, get_resource_ids(person))
+
+    def test_parts_saved_on_their_own_are_referenced(self):
+        """
+        Tests that parts which are saved without saving their resource, e.g.,
+        in editor inlines, are added to the reverse-reference index and that
+        `get_root_resources` only searches the model graph if the index is
+        incomplete.
+        """
+        text_info = self.test_res_1.resourceComponentType.as_subclass() \
+            .corpusMediaType.corpustextinfotype_model_set.all()[0]
+        size_info = sizeInfoType_model.objects.create(size='10',
+            sizeUnit='words', back_to_corpustextinfotype_model=text_info)
+        self.assertSetEqual(set((self.test_res_1.pk,)),
+                            get_resource_ids(size_info))
+        ResourceReference.objects.filter(model_name='sizeInfoType_model',
+                                         object_id=size_info.pk).delete()
+        self.assertSetEqual(set(), get_root_resources(size_info))
+        ResourceReference.objects.all().delete()
+        self.assertSetEqual(set((self.test_res_1,)),
+                            get_root_resources(size_info))
+
+
+class DeepDeletionTest(TestResourcesMixin, TestCase):
+    """
+    Tests for deep_deletion.py.
+    """
+    def test_delete_deep_deletes_owned_instances_only(self):
+        """
+        Tests that `delete_deep()` deletes all instances which are owned by a
+        resource and neither the reusable entities nor other resources.
+        """
+        plan = plan_deep_deletion(self.test_res_1)
+        self.assertIn(self.test_res_1.pk, plan[resourceInfoType_model])
+        self.assertIn(self.test_res_1.identificationInfo.pk,
+                      plan[identificationInfoType_model])
+        other_plan = plan_deep_deletion(self.test_res_2)
+        contact_ids = [person.pk for person
+                       in self.test_res_1.contactPerson.all()]
+        identification_id = self.test_res_1.identificationInfo.pk
+        self.assertTrue(ResourceReference.objects.filter(
+            model_name='identificationInfoType_model',
+            object_id=identification_id).exists())
+        self.test_res_1.delete_deep()
+        for model, pks in plan.iteritems():
+            self.assertFalse(model.objects.filter(pk__in=pks).exists(),
+                             'owned {} instances must be deleted'
+                             .format(model.__name__))
+        for model, pks in other_plan.iteritems():
+            self.assertEqual(len(pks), model.objects.filter(pk__in=pks).count(),
+                             'instances of another resource must be kept')
+        self.assertEqual(len(contact_ids), personInfoType_model.objects
+                         .filter(pk__in=contact_ids).count())
+        # the references of the owned instances are removed in bulk
+        self.assertFalse(ResourceReference.objects.filter(
+            model_name='identificationInfoType_model',
+            object_id=identification_id).exists())
+
+
+class MultiTextFieldTest(TestCase):
+    """
+    Tests the storage format of `MultiTextField`s.
+    """
+    _VALUES = [u'http://www.example.org/', u'\u00fcber "quoted"', u'']
+
+    def test_json_and_legacy_values_are_decoded(self):
+        _json = encode_multitext(self._VALUES)
+        self.assertEqual(u'["http://www.example.org/","\u00fcber \\"quoted\\"",""]',
+                         _json)
+        self.assertEqual(self._VALUES, decode_multitext(_json))
+        self.assertEqual(self._VALUES, decode_multitext(
+            base64.b64encode(pickle.dumps(self._VALUES))))
+        self.assertTrue(len(_json) <
+                        len(base64.b64encode(pickle.dumps(self._VALUES))))
+
+    def test_legacy_values_are_migrated(self):
+        _comm = communicationInfoType_model.objects.create(
+            email=[u'someone@example.org'], url=self._VALUES)
+        self.assertEqual(1, communicationInfoType_model.objects.filter(
+            email__icontains='someone@example').count())
+        _field = communicationInfoType_model._meta.get_field('url')
+        connection.cursor().execute('UPDATE {0} SET {1} = %s WHERE id = %s'
+            .format(communicationInfoType_model._meta.db_table,
+                    _field.column),
+            [base64.b64encode(pickle.dumps(self._VALUES)), _comm.id])
+        self.assertEqual(self._VALUES, communicationInfoType_model.objects \
+                         .get(pk=_comm.id).url)
+        call_command('migrate_multitext_fields')
+        self.assertEqual([encode_multitext(self._VALUES)],
+            list(communicationInfoType_model.objects.filter(pk=_comm.id) \
+                 .values_list('url', flat=True)))
+        self.assertEqual(self._VALUES, communicationInfoType_model.objects \
+                         .get(pk=_comm.id).url)
+
+
+class MultiSelectFieldTest(TestCase):
+    """
+    Tests the bit vector encoding of `MultiSelectField`s.
+    """
+    def setUp(self):
+        self.field = modalityInfoType_model._meta.get_field('modalityType')
+
+    def test_values_are_encoded_as_bit_vectors(self):
+        # bits 2 and 6 of 12 bits are set
+        self.assertEqual('220',
+            self.field.get_prep_value([u'writtenLanguage', u'voice']))
+        self.assertEqual([u'voice', u'writtenLanguage'],
+                         self.field.to_python('220'))
+        # decoded values are copies
+        self.field.to_python('220').append(u'other')
+        self.assertEqual([u'voice', u'writtenLanguage'],
+                         self.field.to_python('220'))
+        self.assertEqual('000', self.field.get_prep_value([u'unknown']))
+        self.assertEqual([], self.field.to_python('000'))
+        _modality = modalityInfoType_model(
+            modalityType=[u'bodyGesture', u'other'])
+        self.assertEqual(u'Body Gesture, Other',
+                         _modality.get_modalityType_display())
+
+    def test_values_can_be_filtered_in_the_database(self):
+        _written = modalityInfoType_model.objects.create(
+            modalityType=[u'writtenLanguage'])
+        _both = modalityInfoType_model.objects.create(
+            modalityType=[u'spokenLanguage', u'writtenLanguage'])
+        modalityInfoType_model.objects.create(modalityType=[u'other'])
+        _ids = (_written.id, _both.id)
+        self.assertEqual([_written.id, _both.id],
+            list(modalityInfoType_model.objects.filter(
+                self.field.get_includes_query(u'writtenLanguage'))
+                 .order_by('id').values_list('id', flat=True)))
+        self.assertEqual([_both.id],
+            list(modalityInfoType_model.objects.filter(
+                self.field.get_includes_query(u'writtenLanguage',
+                                              u'spokenLanguage'))
+                 .values_list('id', flat=True)))
+        self.assertEqual(0, modalityInfoType_model.objects.filter(
+            self.field.get_includes_query(u'voice'), id__in=_ids).count())
+        self.assertRaises(ValueError, self.field.get_includes_query,
+                          u'unknown')
+
+
+class DictFieldTest(TestCase):
+    """
+    Tests the remembered default values of `DictField`s.
+    """
+    _NAMES = {u'de': u'Der Name', u'en': u'The name'}
+
+    def _create_info(self):
+        # the DB representation of the resource name is decoded on assignment
+        return identificationInfoType_model(resourceName=base64.b64encode(
+            pickle.dumps(self._NAMES)))
+
+    def test_default_value_is_remembered_until_changed(self):
+        _info = self._create_info()
+        self.assertIsInstance(_info.resourceName, DefaultCachingDict)
+        self.assertEqual(u'The name', _info.get_default_resourceName())
+        _info.resourceName[u'en'] = u'Another name'
+        self.assertEqual(u'Another name', _info.get_default_resourceName())
+        del _info.resourceName[u'en']
+        self.assertEqual(u'Der Name', _info.get_default_resourceName())
+        _info.resourceName = {u'und': u'Some name'}
+        self.assertEqual(u'Some name', _info.get_default_resourceName())
+        # the DB representation contains a plain dictionary
+        _field = identificationInfoType_model._meta.get_field('resourceName')
+        self.assertIs(dict, type(pickle.loads(base64.b64decode(
+            _field.get_prep_value(self._create_info().resourceName)))))
@@ -1,17 +1,30 @@
 import os
+import json
 import logging
 
 from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 from django.test.testcases import TestCase
 
+from haystack.models import SearchResult
 from haystack.query import SearchQuerySet
 
 from metashare import test_utils, settings
 from metashare.repository import views
+from metashare.repository.search_cache import CachedSearchResults, \
+    invalidate_search_results, search_results_cache_key, \
+    search_results_cache_timeout
+from metashare.repository.templatetags.resource_access_stats import \
+    ACCESS_STATS_MARKER, with_access_stats
+from metashare.repository.models import resourceInfoType_model, \
+    ResourceFacetSnapshot
+from metashare.repository.search_indexes import update_lr_index_counters, \
+    _get_cached_index_document, resourceInfoType_modelIndex, \
+    update_lr_index_entries, rebuild_lr_index
 from metashare.settings import DJANGO_BASE, ROOT_PATH, LOG_HANDLER
 from metashare.stats.models import LRStats
+from metashare.stats.model_utils import saveLRStats, VIEW_STAT
 from metashare.storage.models import INGESTED, PUBLISHED
 from metashare.test_utils import create_user
 
@@ -20,6 +33,8 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(LOG_HANDLER)
 
 _SEARCH_PAGE_PATH = '/{0}repository/search/'.format(DJANGO_BASE)
+_SEARCH_SUB_FILTERS_PATH = \
+    '/{0}repository/search/subfilters/'.format(DJANGO_BASE)
 
 
 class SearchIndexUpdateTests(test_utils.IndexAwareTestCase):
@@ -108,6 +123,34 @@ class SearchIndexUpdateTests(test_utils.IndexAwareTestCase):
         self.assertEqual(SearchQuerySet().count(), 0,
             "After a resource is deleted, the index must automatically change.")
 
+    def test_chunked_rebuild_can_be_resumed(self):
+        """
+        Verifies that an interrupted chunked reindexing can be continued.
+        """
+        self.assert_index_is_empty()
+        _ids = []
+        for res_path in (SearchIndexUpdateTests.RES_PATH_1,
+                         SearchIndexUpdateTests.RES_PATH_2):
+            resource = test_utils.import_xml(res_path)
+            resource.storage_object.publication_status = PUBLISHED
+            resource.storage_object.save()
+            _ids.append(resource.id)
+        _progress_file = os.path.join(settings.LOCK_DIR, 'test_lr_index_progress')
+        # pretend that only the first resource has been indexed so far
+        call_command('clear_index', interactive=False,
+                     using=settings.TEST_MODE_NAME)
+        update_lr_index_entries(_ids[:1])
+        with open(_progress_file, 'w') as _out:
+            _out.write(str(_ids[0]))
+        self.assertEqual(1, rebuild_lr_index(batch_size=1, resume=True,
+                                             progress_file=_progress_file))
+        self.assertEqual(SearchQuerySet().count(), 2)
+        self.assertFalse(os.path.isfile(_progress_file))
+        # without resuming, all resources are indexed again
+        self.assertEqual(2, rebuild_lr_index(batch_size=1,
+                                             progress_file=_progress_file))
+        self.assertEqual(SearchQuerySet().count(), 2)
+
     def assert_index_is_empty(self):
         """
         Asserts that the search index is empty.
@@ -225,6 +268,87 @@ class SearchTest(test_utils.IndexAwareTestCase):
         self.assertContains(response, 'title="Number of downloads" />&nbsp;1')
         self.assertContains(response, 'title="Number of views" />&nbsp;1')
 
+    def test_counters_are_updated_from_cached_index_documents(self):
+        """
+        Verifies that the view and download counts in the search index can be
+        updated without reindexing the complete resource.
+        """
+        test_res = test_utils.import_xml('{}/repository/test_fixtures/'
+                        'internal-corpus-Text-EngPers.xml'.format(ROOT_PATH))
+        test_res.storage_object.published = True
+        test_res.storage_object.save()
+        LRStats.objects.all().delete()
+        _storage_object = resourceInfoType_model.objects.get(pk=test_res.id) \
+            .storage_object
+        self.assertIsNotNone(_get_cached_index_document(test_res.id,
+            (_storage_object.revision, _storage_object.modified)))
+        self.assertEqual(SearchQuerySet().filter(view_count=1).count(), 0)
+        saveLRStats(test_res, VIEW_STAT)
+        _request = RequestFactory().get(_SEARCH_PAGE_PATH, {'q': 'test'})
+        _cache_key = search_results_cache_key(_request)
+        update_lr_index_counters([test_res.id])
+        self.assertEqual(SearchQuerySet().filter(view_count=1).count(), 1)
+        self.assertEqual(SearchQuerySet().filter(dl_count=0).count(), 1)
+        # counter updates do not invalidate the cached search results, but
+        # results sorted by the counters are only cached for a short time
+        self.assertEqual(_cache_key, search_results_cache_key(_request))
+        self.assertLess(search_results_cache_timeout(RequestFactory().get(
+                _SEARCH_PAGE_PATH, {'sort': 'view_count_desc'})),
+            search_results_cache_timeout(_request))
+
+    def test_facet_snapshot_is_used_until_resource_is_saved(self):
+        """
+        Verifies that the facet values of a resource are saved when indexing
+        it and that they are reused until the resource is saved again.
+        """
+        test_res = test_utils.import_xml('{}/repository/test_fixtures/'
+                        'internal-corpus-Text-EngPers.xml'.format(ROOT_PATH))
+        test_res.storage_object.published = True
+        test_res.storage_object.save()
+        test_res = resourceInfoType_model.objects.get(pk=test_res.id)
+        _snapshot = ResourceFacetSnapshot.objects.get(
+            lrid=test_res.storage_object.identifier)
+        self.assertEqual(
+            (test_res.storage_object.revision, test_res.storage_object.modified),
+            (_snapshot.revision, _snapshot.modified))
+        _index = resourceInfoType_modelIndex()
+        self.assertEqual(_index.prepare_languageNameFilter(test_res),
+            json.loads(_snapshot.facets)['prepare_languageNameFilter'])
+        # the snapshot is used for preparing the search index document
+        _snapshot.facets = json.dumps(
+            {'prepare_languageNameFilter': ['Snapshot language']})
+        _snapshot.save()
+        _doc = _index.prepare(test_res)
+        self.assertEqual(['Snapshot language'], _doc['languageNameFilter'])
+        self.assertEqual('snapshotlanguage', _doc['languageNameSort'])
+        # saving the resource recreates the snapshot
+        test_res.save()
+        self.assertNotIn('Snapshot language', ResourceFacetSnapshot.objects \
+            .get(lrid=test_res.storage_object.identifier).facets)
+
+    def test_search_results_are_cached_until_index_changes(self):
+        """
+        Verifies that search results are served from the cache and that the
+        cached results are invalidated by changes of the search index.
+        """
+        _request = RequestFactory().get(_SEARCH_PAGE_PATH, {'q': 'test'})
+        _sqs = SearchQuerySet().all()
+        _count = CachedSearchResults(_sqs,
+                                     search_results_cache_key(_request)).count()
+        # the cached count is returned even for another query set
+        self.assertEqual(_count, CachedSearchResults(_sqs.none(),
+                                search_results_cache_key(_request)).count())
+        invalidate_search_results()
+        self.assertEqual(0, CachedSearchResults(_sqs.none(),
+                                search_results_cache_key(_request)).count())
+        # indexing a resource invalidates the cached results, too
+        client = Client()
+        response = client.get(_SEARCH_PAGE_PATH)
+        self.assertContains(response, '0 Language Resources')
+        self.importOneFixture()
+        response = client.get(_SEARCH_PAGE_PATH)
+        self.assertContains(response, '1 Language Resource')
+
     def test_case_insensitive_search(self):
         """
         Asserts that case-insensitive searching is done.
@@ -373,6 +497,26 @@ class SearchTestPublishedResources(TestCase):
         self.assertEqual('repository/search.html', response.templates[0].name)
         self.assertContains(response, "1 Language Resource", status_code=200)
         
+    def testSubFiltersAreOnlyFacetedForSelectedItems(self):
+        client = Client()
+        response = client.get(_SEARCH_PAGE_PATH)
+        self.assertIn('resourceTypeFilter', response.context['facets']['fields'])
+        self.assertNotIn('corpusAnnotationTypeFilter',
+                         response.context['facets']['fields'])
+        _params = {'selected_facets': 'resourceTypeFilter_exact:corpus'}
+        response = client.get(_SEARCH_PAGE_PATH, data=_params)
+        self.assertIn('corpusAnnotationTypeFilter',
+                      response.context['facets']['fields'])
+        self.assertNotIn('toolServiceToolServiceTypeFilter',
+                         response.context['facets']['fields'])
+        _subresults = [f for f in response.context['filters']
+                       if f['removable']][0]['removable'][0]['subresults']
+        # the same sub filters are available on demand
+        _params.update({'filter': 'resourceTypeFilter', 'value': 'corpus'})
+        response = client.get(_SEARCH_SUB_FILTERS_PATH, data=_params)
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertEqual(_subresults, json.loads(response.content))
+
     def testMediaTypeFacet(self):   
         client = Client()
         response = client.get(_SEARCH_PAGE_PATH,
@@ -482,3 +626,92 @@ class SearchTestPublishedResources(TestCase):
           data={'q':'recordingFree', 'selected_facets':'languageNameFilter_exact:Chinese'})
         self.assertEqual('repository/search.html', response.templates[0].name)
         self.assertContains(response, "1 Language Resource", status_code=200)  
+
+
+class AccessStatsSnippetTest(TestCase):
+    """
+    Tests the insertion of the access statistics into the indexed snippets.
+    """
+    def _get_result(self, rendered_result):
+        _result = SearchResult('repository', 'resourceinfotype_model', '1', 1,
+                               rendered_result=rendered_result)
+        _result.dl_count = 3
+        _result.view_count = 4
+        return _result
+
+    def test_marker_is_replaced(self):
+        _rendered = with_access_stats(self._get_result(
+            u'<div>a</div>{0}<ul></ul>'.format(ACCESS_STATS_MARKER)))
+        self.assertNotIn(ACCESS_STATS_MARKER, _rendered)
+        self.assertIn(u'&nbsp;3', _rendered)
+        self.assertIn(u'&nbsp;4', _rendered)
+        self.assertTrue(_rendered.endswith(u'<ul></ul>'))
+
+    def test_snippets_without_marker(self):
+        # snippets indexed before the marker was introduced keep their stats
+        _old = u'<div class="accessStats">&nbsp;1&nbsp;2</div>'
+        self.assertEqual(_old, with_access_stats(self._get_result(_old)))
+        # snippets without any stats get the current ones
+        _rendered = with_access_stats(self._get_result(u'<div>a</div>'))
+        self.assertIn(u'class="accessStats"', _rendered)
+        self.assertIn(u'&nbsp;3', _rendered)
+
+
+class FilterStructureTest(TestCase):
+    """
+    Test the creation of the filters structure of the search page from a
+    realistic facet payload.
+    """
+    # the number of items of each top level filter and of each sub filter
+    TOP_LEVEL_ITEMS = 60
+    SUB_FILTER_ITEMS = 20
+
+    def _get_facet_fields(self):
+        facet_fields = {}
+        for name, _label, _facet_id, parent_id in views._FILTER_LABELS:
+            _count = parent_id and self.SUB_FILTER_ITEMS \
+                or self.TOP_LEVEL_ITEMS
+            # Solr returns the items sorted by count, including empty ones
+            facet_fields[name] = [(u'someValue{0}'.format(i), _count - i)
+                                  for i in range(_count + 1)]
+        facet_fields['resourceTypeFilter'][:4] = [(u'corpus', 500),
+            (u'lexicalConceptualResource', 300),
+            (u'languageDescription', 200), (u'toolService', 100)]
+        return facet_fields
+
+    def _create_filters_structure(self, selected_facets, facet_fields):
+        view = views.MetashareFacetedSearchView()
+        view.request = RequestFactory().get(_SEARCH_PAGE_PATH,
+            data={'selected_facets': selected_facets})
+        return view._create_filters_structure(facet_fields)
+
+    def test_filters_structure(self):
+        _selected = ['languageNameFilter_exact:someValue3',
+                     'resourceTypeFilter_exact:corpus',
+                     'corpusAnnotationTypeFilter_exact:someValue1']
+        _result = self._create_filters_structure(_selected,
+                                                 self._get_facet_fields())
+        self.assertEqual(len(views._TOP_LEVEL_FILTERS), len(_result))
+        # filters with selected items come first
+        self.assertEqual(['Language', 'Resource Type'],
+                         [f['label'] for f in _result[:2]])
+        _res_type = _result[1]
+        self.assertEqual(['Corpus'],
+                         [i['label'] for i in _res_type['removable']])
+        # removing the corpus item also removes its selected sub filter items
+        self.assertEqual([u'languageNameFilter_exact:someValue3'],
+                         _res_type['removable'][0]['targets'])
+        _annotation_type = [f for f in _res_type['removable'][0]['subresults']
+                            if f['label'] == 'Annotation Type'][0]
+        self.assertEqual(['Some Value1'],
+                         [i['label'] for i in _annotation_type['removable']])
+        self.assertEqual(self.SUB_FILTER_ITEMS - 1,
+                         len(_annotation_type['addable']))
+        _addable = _res_type['addable'][0]
+        self.assertEqual('Lexical Conceptual Resource', _addable['label'])
+        self.assertEqual(sorted(_selected + [
+            u'resourceTypeFilter_exact:lexicalConceptualResource']),
+                         sorted(_addable['targets']))
+        # items without results are not shown
+        self.assertEqual(self.TOP_LEVEL_ITEMS, len(_result[-1]['addable']))
+        self.assertEqual([], _result[-1]['removable'])
@@ -5,6 +5,7 @@ from datetime import datetime
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.humanize.templatetags import humanize
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.template.defaultfilters import urlizetrunc
 from django.test import TestCase
@@ -269,6 +270,22 @@ class ViewTest(TestCase):
         self.assertContains(response,
             "repository/resourceinfotype_model/{0}/".format(self.resource.id))
 
+    def test_detail_view_context_is_cached_until_resource_is_saved(self):
+        """
+        Tests that the request independent part of the detail view is cached
+        and that the cache entry is removed when the resource is saved
+        """
+        _cache_key = 'resource_view_{0}'.format(
+            self.resource.storage_object.identifier)
+        client = Client()
+        response = client.get(self.resource.get_absolute_url())
+        self.assertTemplateUsed(response, 'repository/resource_view/lr_view.html')
+        self.assertIsNotNone(cache.get(_cache_key))
+        response = client.get(self.resource.get_absolute_url())
+        self.assertContains(response, '<h2>Italian TTS Speech Corpus (Appen)')
+        self.resource.save()
+        self.assertIsNone(cache.get(_cache_key))
+
     def test_normal_user_cannot_edit_resource(self):
         """
         Tests that there is no edit button link for an unauthorized user
@@ -5,6 +5,9 @@ from haystack.query import SearchQuerySet
 from metashare.repository.forms import FacetedBrowseForm
 from metashare.repository.views import MetashareFacetedSearchView
 
+# only the top level filters are faceted for every search; sub filters are
+# faceted on demand, see MetashareFacetedSearchView.get_results() and
+# search_sub_filters()
 sqs = SearchQuerySet() \
   .facet("languageNameFilter") \
   .facet("resourceTypeFilter") \
@@ -24,42 +27,6 @@ sqs = SearchQuerySet() \
   .facet("geographicCoverageFilter") \
   .facet("timeCoverageFilter") \
   .facet("subjectFilter") \
-  .facet("corpusAnnotationTypeFilter") \
-  .facet("corpusAnnotationFormatFilter") \
-  .facet("languageDescriptionLDTypeFilter") \
-  .facet("languageDescriptionEncodingLevelFilter") \
-  .facet("languageDescriptionGrammaticalPhenomenaCoverageFilter") \
-  .facet("lexicalConceptualResourceLRTypeFilter") \
-  .facet("lexicalConceptualResourceEncodingLevelFilter") \
-  .facet("lexicalConceptualResourceLinguisticInformationFilter") \
-  .facet("toolServiceToolServiceTypeFilter") \
-  .facet("toolServiceToolServiceSubTypeFilter") \
-  .facet("toolServiceLanguageDependentTypeFilter") \
-  .facet("toolServiceInputOutputResourceTypeFilter") \
-  .facet("toolServiceInputOutputMediaTypeFilter") \
-  .facet("toolServiceAnnotationTypeFilter") \
-  .facet("toolServiceAnnotationFormatFilter") \
-  .facet("toolServiceEvaluatedFilter") \
-  .facet("textTextGenreFilter") \
-  .facet("textTextTypeFilter") \
-  .facet("textRegisterFilter") \
-  .facet("audioAudioGenreFilter") \
-  .facet("audioSpeechGenreFilter") \
-  .facet("audioRegisterFilter") \
-  .facet("audioSpeechItemsFilter") \
-  .facet("audioNaturalityFilter") \
-  .facet("audioConversationalTypeFilter") \
-  .facet("audioScenarioTypeFilter") \
-  .facet("videoVideoGenreFilter") \
-  .facet("videoTypeOfVideoContentFilter") \
-  .facet("videoNaturalityFilter") \
-  .facet("videoConversationalTypeFilter") \
-  .facet("videoScenarioTypeFilter") \
-  .facet("imageImageGenreFilter") \
-  .facet("imageTypeOfImageContentFilter") \
-  .facet("textnumericalTypeOfTnContentFilter") \
-  .facet("textngramBaseItemFilter") \
-  .facet("textngramOrderFilter") \
   .facet("languageVarietyFilter")
 
 urlpatterns = patterns('metashare.repository.views',
@@ -71,6 +38,8 @@ urlpatterns = patterns('metashare.repository.views',
     'download'),
   (r'^download_contact/(?P<object_id>\w+)/$',
     'download_contact'),
+  (r'^search/subfilters/$',
+    'search_sub_filters'),
   url(r'^search/$',
     search_view_factory(view_class=MetashareFacetedSearchView,
                         form_class=FacetedBrowseForm,
@@ -1,4 +1,7 @@
+import json
 import logging
+import re
+import time
 
 from datetime import datetime
 from os.path import split, getsize
@@ -6,6 +9,7 @@ from urllib import urlopen
 from mimetypes import guess_type
 
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse
 from django.shortcuts import render_to_response, get_object_or_404, redirect
@@ -13,23 +17,28 @@ from django.template import RequestContext
 from django.contrib import messages
 from django.template.loader import render_to_string
 from django.core.mail import send_mail
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext as _
 
+from haystack.query import SearchQuerySet
 from haystack.views import FacetedSearchView
 
 from metashare.repository.editor.resource_editor import has_edit_permission
-from metashare.repository.forms import LicenseSelectionForm, \
-    LicenseAgreementForm, DownloadContactForm, MORE_FROM_SAME_CREATORS, \
-    MORE_FROM_SAME_PROJECTS
+from metashare.repository.forms import FacetedBrowseForm, \
+    LicenseSelectionForm, LicenseAgreementForm, DownloadContactForm, \
+    MORE_FROM_SAME_CREATORS, MORE_FROM_SAME_PROJECTS
 from metashare.repository import model_utils
 from metashare.repository.models import licenceInfoType_model, \
     resourceInfoType_model
-from metashare.repository.search_indexes import resourceInfoType_modelIndex, \
-    update_lr_index_entry
-from metashare.settings import LOG_HANDLER, STATIC_URL, DJANGO_URL
-from metashare.stats.model_utils import getLRStats, saveLRStats, \
-    saveQueryStats, VIEW_STAT, DOWNLOAD_STAT
-from metashare.storage.models import PUBLISHED
+from metashare.repository.search_cache import CachedSearchResults, \
+    search_results_cache_key, search_results_cache_timeout
+from metashare.repository.search_indexes import resourceInfoType_modelIndex
+from metashare.settings import LOG_HANDLER, STATIC_URL, DJANGO_URL, \
+    RESOURCE_VIEW_CACHE_TIMEOUT
+from metashare.stats.model_utils import getLRStats, VIEW_STAT, DOWNLOAD_STAT
+from metashare.stats.stats_queue import record_lr_stats, record_query_stats
+from metashare.storage.models import PUBLISHED, StorageObject
 from metashare.recommendations.recommendations import SessionResourcesTracker, \
     get_download_recommendations, get_view_recommendations, \
     get_more_from_same_creators_qs, get_more_from_same_projects_qs
@@ -318,9 +327,8 @@ def _update_download_stats(resource, request):
     download request.
     """
     # maintain general download statistics
-    if saveLRStats(resource, DOWNLOAD_STAT, request):
-        # update download count in the search index, too
-        update_lr_index_entry(resource)
+    # (the download count in the search index is updated, too)
+    record_lr_stats(resource, DOWNLOAD_STAT, request)
     # update download tracker
     tracker = SessionResourcesTracker.getTracker(request)
     tracker.add_download(resource, datetime.now())
@@ -405,20 +413,43 @@ def download_contact(request, object_id):
                         dictionary, context_instance=RequestContext(request))
 
 
-def view(request, resource_name=None, object_id=None):
+def _get_resource_view_context(resource):
     """
-    Render browse or detail view for the repository application.
+    Returns the part of the template context for the detail view of the given
+    resource which does not depend on the current request or user.
+
+    The context is cached per resource until the resource is saved again or
+    its metadata revision changes.
     """
-    # only published resources may be viewed
-    resource = get_object_or_404(resourceInfoType_model,
-                                 storage_object__identifier=object_id,
-                                 storage_object__publication_status=PUBLISHED)
-    if request.path_info != resource.get_absolute_url():
-        return redirect(resource.get_absolute_url())
+    _storage_object = resource.storage_object
+    _cache_key = 'resource_view_{0}'.format(_storage_object.identifier)
+    _version = (_storage_object.revision, _storage_object.modified)
+    _cached = cache.get(_cache_key)
+    if _cached is not None and _cached[0] == _version:
+        return _cached[1]
+    context = _create_resource_view_context(resource)
+    cache.set(_cache_key, (_version, context), RESOURCE_VIEW_CACHE_TIMEOUT)
+    return context
+
+
+# pylint: disable-msg=W0613
+@receiver(post_save, sender=StorageObject)
+def _invalidate_resource_view_context(sender, instance, **kwargs):
+    """
+    Removes the cached detail view context of the resource of the given
+    storage object.
+    """
+    cache.delete('resource_view_{0}'.format(instance.identifier))
+
 
+def _create_resource_view_context(resource):
+    """
+    Creates the part of the template context for the detail view of the given
+    resource which does not depend on the current request or user.
+    """
     # Convert resource to ElementTree and then to template tuples.
     lr_content = _convert_to_template_tuples(
-        resource.export_to_elementtree(pretty=True))
+        resource.export_to_elementtree(pretty=True, prefetch=True))
 
     # get the 'best' language version of a "DictField" and all other versions
     resource_name = resource.identificationInfo.get_default_resourceName()
@@ -590,7 +621,6 @@ def view(request, resource_name=None, object_id=None):
                 'other_descriptions': other_descriptions,
                 'relation_dicts': relation_dicts,
                 'res_short_names': res_short_names,
-                'resource': resource,
                 'resource_component_dicts': resource_component_dicts,
                 'resource_component_dict': resource_component_dict,
                 'resourceName': resource_name,
@@ -603,6 +633,23 @@ def view(request, resource_name=None, object_id=None):
                 'text_counts': text_counts,
                 'video_counts': video_counts,
               }
+    return context
+
+
+def view(request, resource_name=None, object_id=None):
+    """
+    Render browse or detail view for the repository application.
+    """
+    # only published resources may be viewed
+    resource = get_object_or_404(resourceInfoType_model,
+                                 storage_object__identifier=object_id,
+                                 storage_object__publication_status=PUBLISHED)
+    if request.path_info != resource.get_absolute_url():
+        return redirect(resource.get_absolute_url())
+
+    # the user independent part of the context is cached
+    context = _get_resource_view_context(resource)
+    context['resource'] = resource
     template = 'repository/resource_view/lr_view.html'
 
     # For users who have edit permission for this resource, we have to add 
@@ -614,9 +661,8 @@ def view(request, resource_name=None, object_id=None):
               args=(resource.id,))
 
     # Update statistics:
-    if saveLRStats(resource, VIEW_STAT, request):
-        # update view count in the search index, too
-        update_lr_index_entry(resource)
+    # (the view count in the search index is updated, too)
+    record_lr_stats(resource, VIEW_STAT, request)
     # update view tracker
     tracker = SessionResourcesTracker.getTracker(request)
     tracker.add_view(resource, datetime.now())
@@ -712,12 +758,135 @@ def _format_recommendations(recommended_resources):
     return result
 
 
+def _get_filter_labels():
+    """
+    Returns a list of (name, label, facet ID, parent facet ID) tuples of all
+    filters of the search index, sorted by their facet IDs.
+    """
+    # pylint: disable-msg=E1101
+    result = [(name, field.label, field.facet_id, field.parent_id)
+              for name, field in resourceInfoType_modelIndex.fields.iteritems()
+              if name.endswith("Filter")]
+    result.sort(key=lambda f: f[2])
+    return result
+
+
+def _get_filter_hierarchy(filter_labels):
+    """
+    Returns the top level filters of the given filter label tuples and a
+    dictionary mapping the facet ID of each top level filter to the list of
+    its sub filters; both are sorted by facet IDs.
+    """
+    top_level_filters = [f for f in filter_labels if f[3] == 0]
+    sub_filters = dict((f[2], []) for f in top_level_filters)
+    for sub_filter in filter_labels:
+        if sub_filter[3] in sub_filters:
+            sub_filters[sub_filter[3]].append(sub_filter)
+    return top_level_filters, sub_filters
+
+
+# the filter hierarchy of the search index does not change at runtime, so it
+# is only computed once
+_FILTER_LABELS = _get_filter_labels()
+_TOP_LEVEL_FILTERS, _SUB_FILTERS = _get_filter_hierarchy(_FILTER_LABELS)
+_TOP_LEVEL_FACET_IDS = dict((f[0], f[2]) for f in _TOP_LEVEL_FILTERS)
+
+# splits a facet item value into its words, e.g., "primaryText"
+_FACET_LABEL_WORDS = re.compile('[A-Z\_]*[^A-Z]*')
+# the human readable labels of facet item values which have been shown before
+_FACET_LABELS = {}
+# the maximum number of facet item labels which are remembered
+_MAX_FACET_LABELS = 10000
+
+
+def _get_facet_label(value):
+    """
+    Returns the human readable label of the given (non-empty) facet item
+    value, e.g., "Primary Text" for "primaryText".
+    """
+    try:
+        return _FACET_LABELS[value]
+    except KeyError:
+        pass
+    label = " ".join(_FACET_LABEL_WORDS.findall(
+        value[0].capitalize() + value[1:]))[:-1]
+    if len(_FACET_LABELS) >= _MAX_FACET_LABELS:
+        _FACET_LABELS.clear()
+    _FACET_LABELS[value] = label
+    return label
+
+
+def _get_sub_filters(parent_name, value):
+    """
+    Returns the filter label tuples of the sub filters which belong to the
+    given item value of the top level filter with the given name.
+    """
+    return [f for f in _SUB_FILTERS.get(_TOP_LEVEL_FACET_IDS.get(parent_name),
+                                        ())
+            if value in f[0]]
+
+
+def _get_faceted_sub_filters(sel_facets):
+    """
+    Returns the names of all sub filters which have to be faceted for the
+    given selected facets, i.e., the sub filters of the selected items of
+    top level filters.
+    """
+    result = []
+    for name, _label, _facet_id, _parent_id in _TOP_LEVEL_FILTERS:
+        for value in sel_facets.get('{0}_exact'.format(name), []):
+            result.extend(sub_filter[0] for sub_filter
+                          in _get_sub_filters(name, value)
+                          if sub_filter[0] not in result)
+    return result
+
+
+def _get_selected_targets(sel_facets):
+    """
+    Returns a list of (field, value, target) tuples for all given selected
+    facets where target is the facet expression of the selected value.
+    """
+    return [(field, value, u'{0}:{1}'.format(field, value))
+            for field, values in sel_facets.iteritems() for value in values]
+
+
+def search_sub_filters(request):
+    """
+    Returns the sub filters of the item value `value` of the top level filter
+    `filter` for the search given by the remaining request parameters as JSON.
+
+    As sub filters are only faceted for selected items by the search view,
+    this allows for fetching the sub filters of other items on demand.
+    """
+    view = MetashareFacetedSearchView(form_class=FacetedBrowseForm,
+                                      searchqueryset=SearchQuerySet())
+    view.request = request
+    view.form = view.build_form()
+    sub_filters = _get_sub_filters(request.GET.get('filter', ''),
+                                   request.GET.get('value', ''))
+    result = []
+    if sub_filters:
+        sqs = view.form.search()
+        for sub_filter in sub_filters:
+            sqs = sqs.facet(sub_filter[0])
+        facet_fields = sqs.facet_counts().get('fields', {})
+        sel_facets = view._get_selected_facets()
+        sel_targets = _get_selected_targets(sel_facets)
+        for sub_filter in sub_filters:
+            result = view.show_subfilter(sub_filter, sel_facets, facet_fields,
+                                         result, sel_targets)
+    return HttpResponse(json.dumps(result), mimetype="application/json")
+
+
 class MetashareFacetedSearchView(FacetedSearchView):
     """
     A modified `FacetedSearchView` which makes sure that only such results will
     be returned that are accessible by the current user.
     """
     def get_results(self):
+        # the execution time of the query covers everything from here until
+        # the results and facets have been fetched; see extra_context()
+        self.starttime = time.time()
         sqs = super(MetashareFacetedSearchView, self).get_results()
 
         # Sort the results (on only one sorting value)
@@ -749,17 +918,34 @@ class MetashareFacetedSearchView(FacetedSearchView):
         else:
             sqs = sqs.order_by('resourceNameSort_exact')
 
-        # collect statistics about the query
-        starttime = datetime.now()
-        results_count = sqs.count()
-        if self.query:
-            saveQueryStats(self.query, \
-                str(sorted(self.request.GET.getlist("selected_facets"))), \
-                results_count, \
-                (datetime.now() - starttime).microseconds, self.request)
+        # sub filters are only shown for the selected items of their parent
+        # filters and therefore only faceted for these
+        for name in _get_faceted_sub_filters(self._get_selected_facets()):
+            sqs = sqs.facet(name)
+
+        # the results of identical requests are served from the cache until
+        # the search index changes
+        return CachedSearchResults(sqs, search_results_cache_key(self.request),
+                                   search_results_cache_timeout(self.request))
+
+    def build_page(self):
+        paginator, page = \
+            super(MetashareFacetedSearchView, self).build_page()
+        # the access statistics are not part of the indexed search result
+        # snippets; they are fetched for the shown page of results only
+        _identifiers = dict(resourceInfoType_model.objects \
+            .filter(id__in=[_result.pk for _result in page.object_list]) \
+            .values_list('id', 'storage_object__identifier'))
+        _dl_counts = model_utils.get_lr_stat_action_counts(
+            _identifiers.values(), DOWNLOAD_STAT)
+        _view_counts = model_utils.get_lr_stat_action_counts(
+            _identifiers.values(), VIEW_STAT)
+        for _result in page.object_list:
+            _identifier = _identifiers.get(int(_result.pk))
+            _result.dl_count = _dl_counts.get(_identifier, 0)
+            _result.view_count = _view_counts.get(_identifier, 0)
+        return (paginator, page)
 
-        return sqs
-    
     def _get_selected_facets(self):
         """
         Returns the selected facets from the current GET request as a more
@@ -784,21 +970,16 @@ class MetashareFacetedSearchView(FacetedSearchView):
         Takes the raw facet 'fields' dictionary which is (indirectly) returned
         by the `facet_counts()` method of a `SearchQuerySet`.
         """
-        import re
-
         result = []
-        # pylint: disable-msg=E1101
-        filter_labels = [(name, field.label, field.facet_id, field.parent_id)
-                         for name, field
-                         in resourceInfoType_modelIndex.fields.iteritems()
-                         if name.endswith("Filter")]
-        filter_labels.sort(key=lambda f: f[2])
         sel_facets = self._get_selected_facets()
+        sel_targets = _get_selected_targets(sel_facets)
+        # the targets of all selected facets to which the target of an addable
+        # item is appended
+        all_targets = [target for _field, _value, target in sel_targets]
         # Step (1): if there are any selected facets, then add these first:
         if sel_facets:
             # add all top level facets (sorted by their facet IDs):
-            for name, label, facet_id, _dummy in \
-              [f for f in filter_labels if f[3] == 0]:
+            for name, label, _facet_id, _dummy in _TOP_LEVEL_FILTERS:
                 name_exact = '{0}_exact'.format(name)
                 # only add selected facets in step (1)
                 if name_exact in sel_facets:
@@ -806,74 +987,56 @@ class MetashareFacetedSearchView(FacetedSearchView):
                     if items:
                         removable = []
                         addable = []
+                        sel_values = set(sel_facets[name_exact])
                         # only items with a count > 0 are shown
-                        for item in [i for i in items if i[1] > 0]:
-                            subfacets = [f for f in filter_labels if (f[3] == \
-                              facet_id and item[0] in f[0]) ]
-                            subfacets_exactname_list = []
-                            subfacets_exactname_list.extend( \
-                              [u'{0}_exact'.format(subfacet[0]) \
-                              for subfacet in subfacets])
+                        for item in items:
+                            if item[1] <= 0 or item[0] == "":
+                                continue
+                            subfacets = _get_sub_filters(name, item[0])
                             subresults = []
                             for facet in subfacets:
-                                subresults = self.show_subfilter( \
-                                  facet, sel_facets, facet_fields, subresults)
-                            if item[0] in sel_facets[name_exact]:
-                                if item[0] != "":
-                                    lab_item = " ".join(re.findall( \
-                                      '[A-Z\_]*[^A-Z]*', \
-                                      item[0][0].capitalize()+item[0][1:]))[:-1]
-                                    removable.append({'label': lab_item,
-                                        'count': item[1], 'targets':
-                                            [u'{0}:{1}'.format(name, value)
-                                             for name, values in
-                                             sel_facets.iteritems() for value in
-                                             values if (name != name_exact
-                                             or value != item[0]) and name \
-                                               not in subfacets_exactname_list], \
-                                               'subresults': subresults})
+                                subresults = self.show_subfilter(facet,
+                                  sel_facets, facet_fields, subresults,
+                                  sel_targets)
+                            if item[0] in sel_values:
+                                subfacets_exactnames = set(
+                                  u'{0}_exact'.format(subfacet[0])
+                                  for subfacet in subfacets)
+                                removable.append({
+                                  'label': _get_facet_label(item[0]),
+                                  'count': item[1],
+                                  'targets': [target for field, value, target
+                                    in sel_targets if (field != name_exact
+                                      or value != item[0])
+                                    and field not in subfacets_exactnames],
+                                  'subresults': subresults})
                             else:
-                                targets = [u'{0}:{1}'.format(name, value)
-                                           for name, values in
-                                           sel_facets.iteritems()
-                                           for value in values]
-                                targets.append(u'{0}:{1}'.format(name_exact,
-                                                                 item[0]))
-                                if item[0] != "":
-                                    lab_item = " ".join(re.findall( \
-                                      '[A-Z\_]*[^A-Z]*', \
-                                      item[0][0].capitalize()+item[0][1:]))[:-1]
-                                    addable.append({'label': lab_item,
-                                                'count': item[1],
-                                                'targets': targets,
-                                                'subresults': subresults})
+                                addable.append({
+                                  'label': _get_facet_label(item[0]),
+                                  'count': item[1],
+                                  'targets': all_targets + [u'{0}:{1}'.format(
+                                    name_exact, item[0])],
+                                  'subresults': subresults})
 
                         result.append({'label': label, 'removable': removable,
                                        'addable': addable})                    
 
         # Step (2): add all top level facets without selected facet items at the
         # end (sorted by their facet IDs):
-        for name, label, facet_id, _dummy in \
-          [f for f in filter_labels if f[3] == 0]:
+        for name, label, facet_id, _dummy in _TOP_LEVEL_FILTERS:
             name_exact = '{0}_exact'.format(name)
             # only add facets without selected items in step (2)
             if not name_exact in sel_facets:
                 items = facet_fields.get(name)
                 if items:
-                    addable = []
                     # only items with a count > 0 are shown
-                    for item in [i for i in items if i[1] > 0]:
-                        targets = [u'{0}:{1}'.format(name, value)
-                                   for name, values in sel_facets.iteritems()
-                                   for value in values]
-                        targets.append(u'{0}:{1}'.format(name_exact, item[0]))
-
-                        if item[0] != "":
-                            lab_item = " ".join(re.findall('[A-Z\_]*[^A-Z]*', 
-                              item[0][0].capitalize()+item[0][1:]))[:-1]
-                            addable.append({'label': lab_item, 'count': item[1],
-                                        'targets': targets})
-                    subresults = [f for f in filter_labels if f[3] == facet_id] 
+                    addable = [{'label': _get_facet_label(item[0]),
+                                'count': item[1],
+                                'targets': all_targets + [u'{0}:{1}'.format(
+                                  name_exact, item[0])]}
+                               for item in items
+                               if item[1] > 0 and item[0] != ""]
+                    subresults = list(_SUB_FILTERS[facet_id])
                     result.append({'label': label, 'removable': [],
                                    'addable': addable, 'subresults': subresults})
 
@@ -891,71 +1054,56 @@ class MetashareFacetedSearchView(FacetedSearchView):
             # this can happen with recommendations when using the
             # get_more_from_same_... methods
             extra['filters'] = []
+
+        # collect statistics about the query now that the count, the page of
+        # results and the facet counts have been fetched
+        if self.query:
+            record_query_stats(self.query, \
+                str(sorted(self.request.GET.getlist("selected_facets"))), \
+                self.results.count(),
+                int(round((time.time() - self.starttime) * 1000000)),
+                self.request)
         return extra
     
-    def show_subfilter(self, facet, sel_facets, facet_fields, results):
+    def show_subfilter(self, facet, sel_facets, facet_fields, results,
+                       sel_targets=None):
         """
         Creates a second level for faceting. 
         Sub filters are included after the parent filters.
-        """
-        import re
 
+        The (field, value, target) tuples of the selected facets may be passed
+        in `sel_targets` if they have already been computed.
+        """
         name = facet[0]
         label = facet[1]
 
         name_exact = '{0}_exact'.format(name)
-
-        if name_exact in sel_facets:
-            items = facet_fields.get(name)
-            if items:
-                removable = []
-                addable = []
-                # only items with a count > 0 are shown
-                for item in [i for i in items if i[1] > 0]:
-                    if item[0] in sel_facets[name_exact]:
-                        if item[0] != "":
-                            lab_item = " ".join(re.findall('[A-Z\_]*[^A-Z]*', 
-                              item[0][0].capitalize()+item[0][1:]))[:-1]
-                            removable.append({'label': lab_item,
-                                'count': item[1], 'targets':
-                                    [u'{0}:{1}'.format(name, value)
-                                     for name, values in
-                                     sel_facets.iteritems() for value in
-                                     values if name != name_exact
-                                     or value != item[0]]})
-                    else:
-                        targets = [u'{0}:{1}'.format(name, value)
-                                   for name, values in
-                                   sel_facets.iteritems()
-                                   for value in values]
-                        targets.append(u'{0}:{1}'.format(name_exact,
-                                                         item[0]))
-                        if item[0] != "":
-                            lab_item = " ".join(re.findall('[A-Z\_]*[^A-Z]*', 
-                              item[0][0].capitalize()+item[0][1:]))[:-1]
-                            addable.append({'label': lab_item,
-                                        'count': item[1],
-                                        'targets': targets})
-                if (addable+removable):
-                    results.append({'label': label, 'removable': removable,
-                               'addable': addable})
-        else:
-            items = facet_fields.get(name)
-            if items:
-                addable = []
-                # only items with a count > 0 are shown
-                for item in [i for i in items if i[1] > 0]:
-                    targets = [u'{0}:{1}'.format(name, value)
-                               for name, values in sel_facets.iteritems()
-                               for value in values]
-                    targets.append(u'{0}:{1}'.format(name_exact, item[0]))
-                    if item[0] != "":
-                        lab_item = " ".join(re.findall('[A-Z\_]*[^A-Z]*', 
-                          item[0][0].capitalize()+item[0][1:]))[:-1]
-                        addable.append({'label': lab_item, 'count': item[1],
-                                    'targets': targets})
-                if addable:
-                    results.append({'label': label, 'removable': [],
-                               'addable': addable})
+        if sel_targets is None:
+            sel_targets = _get_selected_targets(sel_facets)
+        all_targets = [target for _field, _value, target in sel_targets]
+
+        items = facet_fields.get(name)
+        if not items:
+            return results
+        removable = []
+        addable = []
+        sel_values = set(sel_facets.get(name_exact, ()))
+        # only items with a count > 0 are shown
+        for item in items:
+            if item[1] <= 0 or item[0] == "":
+                continue
+            if item[0] in sel_values:
+                removable.append({'label': _get_facet_label(item[0]),
+                    'count': item[1],
+                    'targets': [target for field, value, target in sel_targets
+                                if field != name_exact or value != item[0]]})
+            else:
+                addable.append({'label': _get_facet_label(item[0]),
+                    'count': item[1],
+                    'targets': all_targets + [u'{0}:{1}'.format(name_exact,
+                                                                item[0])]})
+        if addable or removable:
+            results.append({'label': label, 'removable': removable,
+                            'addable': addable})
 
         return results
@@ -84,10 +84,14 @@ if __name__ == "__main__":
             print "{}: {}".format(descriptor, exception)
     
     # Be nice and cleanup cache...
-    _cache_size = sum([len(x) for x in OBJECT_XML_CACHE.values()])
+    _cache_size = OBJECT_XML_CACHE.size()
     OBJECT_XML_CACHE.clear()
-    print "Cleared OBJECT_XML_CACHE ({} bytes)".format(_cache_size)
+    if _cache_size is None:
+        print "Cleared OBJECT_XML_CACHE"
+    else:
+        print "Cleared OBJECT_XML_CACHE ({} bytes)".format(_cache_size)
     
     from django.core.management import call_command
-    call_command('rebuild_index', interactive=False)
+    from multiprocessing import cpu_count
+    call_command('rebuild_resource_index', jobs=cpu_count())
 
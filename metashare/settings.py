@@ -3,6 +3,7 @@ ROOT_PATH = abspath(dirname(__file__))
 
 import os
 import logging
+import tempfile
 from logging.handlers import RotatingFileHandler
 
 # Import local settings, i.e., DEBUG, TEMPLATE_DEBUG, TIME_ZONE,
@@ -30,6 +31,37 @@ LOG_FORMATTER = logging.Formatter(LOG_FORMAT, LOG_DATE)
 # Allows to disable check for duplicate instances.
 CHECK_FOR_DUPLICATE_INSTANCES = True
 
+# The cache for the serialized XML of objects which is used by the check for
+# duplicate instances: 'local' for a least recently used cache per process
+# which is limited to OBJECT_XML_CACHE_MAX_BYTES; otherwise the alias of a
+# cache in CACHES which can then be shared between processes and whose entries
+# expire after OBJECT_XML_CACHE_TIMEOUT seconds.
+OBJECT_XML_CACHE_BACKEND = 'local'
+OBJECT_XML_CACHE_MAX_BYTES = 64 * 1024 * 1024
+OBJECT_XML_CACHE_TIMEOUT = 60 * 60
+
+# The number of seconds for which the request independent part of the detail
+# view of a resource is cached in the default cache (see CACHES); it is
+# invalidated whenever the resource changes.
+RESOURCE_VIEW_CACHE_TIMEOUT = 24 * 60 * 60
+
+# The number of seconds for which the search index document of a resource is
+# cached after indexing it; the cached documents allow for updating the view
+# and download counts in the search index without preparing the complete
+# documents again. The documents are shared between processes through the
+# default cache (see CACHES).
+INDEX_DOCUMENT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# The maximum number of seconds for which the results of a search request are
+# cached; all cached results are invalidated whenever the search index is
+# changed by any process sharing the default cache (see CACHES).
+SEARCH_RESULT_CACHE_TIMEOUT = 10 * 60
+
+# The maximum number of seconds for which the results of a search request
+# which is sorted by the number of downloads or views are cached; changes of
+# these counters do not invalidate any cached search results.
+SEARCH_RESULT_COUNTER_SORT_CACHE_TIMEOUT = 60
+
 # work around a problem on non-posix-compliant platforms by not using any
 # RotatingFileHandler there
 if os.name == "posix":
@@ -53,6 +85,24 @@ MAXIMUM_UPLOAD_SIZE = 10 * 1024 * 1024
 # Synchronization info:
 SYNC_NEEDS_AUTHENTICATION = True
 
+# If True, expired digests which are found while generating the
+# synchronization inventory are recreated in a background thread instead of
+# during the inventory request; the inventory then reports the last known
+# digest for these resources.
+SYNC_DEFER_DIGEST_UPDATES = True
+
+# If True, views and downloads of resources are recorded in the statistics and
+# in the search index by a background thread instead of during the request;
+# the same holds for the statistics of search queries. The events which are
+# waiting for the background thread are stored in the database, so they are
+# not lost when a server process is restarted or stopped.
+STATS_DEFER_UPDATES = True
+
+# The fraction of search queries which is recorded in the query statistics;
+# lower values reduce the load on very busy nodes, but the query statistics
+# then only contain a random sample of all queries.
+QUERY_STATS_SAMPLE_RATE = 1.0
+
 
 # URL for the Metashare Knowledge Base
 KNOWLEDGE_BASE_URL = 'http://www.meta-share.org/portal/knowledgebase/'
@@ -75,6 +125,20 @@ except:
     raise OSError, "STORAGE_PATH and LOCK_DIR must exist and be writable!"
 
 
+# If CACHES was not set in local_settings, set a default here; the default
+# cache has to be shared by all server processes as the cached detail views,
+# search results and search index documents are invalidated through it:
+try:
+    _ = CACHES
+except:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tempfile.gettempdir(),
+                                     'metashare-cache'),
+        }
+    }
+
 # If XDIFF_LOCATION was not set in local_settings, set a default here:
 try:
     _ = XDIFF_LOCATION
@@ -204,12 +268,12 @@ PROJECT_APPS = (
 TEST_MODE_NAME = 'testing'
 HAYSTACK_CONNECTIONS = {
     'default': {
-        'ENGINE': 'haystack.backends.solr_backend.SolrEngine',
+        'ENGINE': 'metashare.haystack_backends.MetashareSolrEngine',
         'URL': SOLR_URL,
         'SILENTLY_FAIL': False
     },
     TEST_MODE_NAME: {
-        'ENGINE': 'haystack.backends.solr_backend.SolrEngine',
+        'ENGINE': 'metashare.haystack_backends.MetashareSolrEngine',
         'URL': TESTING_SOLR_URL,
         'SILENTLY_FAIL': False
     },
@@ -254,6 +318,25 @@ MAX_DOWNLOAD_INTERVAL = 60 * 10
 
 # list of synchronization protocols supported by this node
 SYNC_PROTOCOLS = (
+    # batch requests for full metadata records
+    '1.2',
+    # incremental synchronization based on change journals
+    '1.1',
     '1.0',
 )
 
+# Maximum age of change journal entries in days; older entries are pruned
+# regularly, in which case nodes which have not synchronized in the meantime
+# fall back to a full synchronization
+SYNC_JOURNAL_MAX_AGE = 30
+
+# Number of seconds after which a change journal entry is assumed to have been
+# committed; the journal sequence number which is sent to other nodes never
+# covers younger entries, so that entries of transactions which commit late
+# are not skipped
+SYNC_JOURNAL_SAFETY_WINDOW = 600
+
+# Maximum number of full metadata records which other nodes may request with a
+# single batch request during synchronization
+SYNC_MAX_BATCH_SIZE = 500
+
@@ -62,8 +62,25 @@ def saveLRStats(resource, action, request=None):
     if (resource.storage_object.publication_status != PUBLISHED):
         return result
         
-    userid = _get_userid(request)
-    sessid = _get_sessionid(request)
+    result = save_lr_stats_record(lrid, action, _get_userid(request),
+        _get_sessionid(request), _get_ipaddress(request), ignored)
+    if action == UPDATE_STAT:
+        if (resource.storage_object.published):
+            UsageStats.objects.filter(lrid=lrid).delete()
+            update_usage_stats(lrid, resource.export_to_elementtree())
+            #LOGGER.debug('STATS: Updating usage statistics: resource {0} updated'.format(lrid))
+    return result
+
+def save_lr_stats_record(lrid, action, userid, sessid, ip_address,
+                         ignored=False):
+    """
+    Saves a single action on the resource with the given storage object
+    identifier which has been performed by the given user in the given session
+    from the given IP address.
+
+    Returns whether the stats counter was incremented or not.
+    """
+    result = False
     lrset = LRStats.objects.filter(userid=userid, lrid=lrid, sessid=sessid, action=action)
     if (lrset.count() > 0):
         record = lrset[0]
@@ -76,16 +93,11 @@ def saveLRStats(resource, action, request=None):
         record.lrid = lrid
         record.action = action
         record.sessid = sessid    
-        record.geoinfo = getcountry_code(_get_ipaddress(request))
+        record.geoinfo = getcountry_code(ip_address)
         record.ignored = ignored
         record.save(force_insert=True)
         #LOGGER.debug('SAVESTATS: Saved LR {0}, {1} action={2}.'.format(lrid, sessid, action))
         result = True
-    if action == UPDATE_STAT:
-        if (resource.storage_object.published):
-            UsageStats.objects.filter(lrid=lrid).delete()
-            update_usage_stats(lrid, resource.export_to_elementtree())
-            #LOGGER.debug('STATS: Updating usage statistics: resource {0} updated'.format(lrid))
     return result
 
 def saveQueryStats(query, facets, found, exectime=0, request=None): 
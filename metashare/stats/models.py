@@ -61,3 +61,16 @@ class UsageStats(models.Model):
     
     #def __unicode__(self):
     #    return "U>> " +str(self.lrid) + "," + str(self.elname) + "," + str(self.elparent) + "," +str(self.text)+ "," + str(self.count)
+
+class PendingStatsEvent(models.Model):
+    """
+    A statistics event which is waiting to be recorded by the background
+    worker; see stats_queue.py.
+    """
+    # the kind of the event, i.e., a view or download of a resource or a search
+    # query
+    kind = models.CharField(blank=False, max_length=8)
+    # the JSON encoded list of the values of the event
+    data = models.TextField(blank=False)
+    # the time of the event
+    lasttime = models.DateTimeField(blank=False)
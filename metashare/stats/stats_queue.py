@@ -0,0 +1,256 @@
+'''
+A durable background queue for recording view and download statistics and
+search query statistics outside of the request/response cycle of the views.
+
+The views only insert the statistics events into the `PendingStatsEvent`
+table, so that no event is lost when a server process ends. A worker thread
+drains the table in batches: duplicate events of the same user session are
+only saved once and the search index entries of all resources whose counters
+have changed are updated together afterwards; search queries are inserted
+together. Events which are left over by an ended server process are recorded
+by the worker of any other process. The processes of a host drain the table
+one at a time, and the events of a batch are locked in the database while
+they are recorded.
+'''
+import json
+import logging
+import os
+import random
+import threading
+from datetime import datetime
+
+from django.db import connection, transaction
+
+from metashare import settings
+from metashare.repository.search_indexes import update_lr_index_counters
+from metashare.settings import LOG_HANDLER
+from metashare.stats.geoip import getcountry_code
+from metashare.stats.model_utils import saveLRStats, save_lr_stats_record, \
+    saveQueryStats, _get_userid, _get_sessionid, _get_ipaddress
+from metashare.stats.models import PendingStatsEvent, QueryStats
+from metashare.storage.models import PUBLISHED
+from metashare.utils import Lock
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+# the maximum number of statistics events which are recorded together
+STATS_BATCH_SIZE = 100
+
+# the maximum number of seconds for which the worker thread waits before it
+# looks for pending statistics events again
+STATS_POLL_INTERVAL = 30
+
+# the kinds of statistics events in the queue
+_LR_STATS_EVENT = 'lr'
+_QUERY_STATS_EVENT = 'query'
+
+# an event for waking up the worker thread of this process
+_WAKEUP = threading.Event()
+# a lock for the thread-safe access to the worker thread
+_LOCK = threading.Lock()
+# the worker thread draining the queue; created lazily
+_WORKER = None
+
+
+def record_lr_stats(resource, action, request):
+    """
+    Records the given action of the given request on the given resource in the
+    statistics and updates the counters of the resource in the search index.
+
+    If STATS_DEFER_UPDATES is set, the action is only queued here and recorded
+    in a background thread.
+    """
+    if not getattr(settings, 'STATS_DEFER_UPDATES', False):
+        if saveLRStats(resource, action, request):
+            _update_index_counters([resource.id])
+        return
+    if resource.storage_object.publication_status != PUBLISHED:
+        return
+    # everything we need from the request has to be taken now as the request
+    # is gone as soon as the event is recorded
+    _queue_event(_LR_STATS_EVENT, (resource.id,
+      resource.storage_object.identifier, action, _get_userid(request),
+      _get_sessionid(request), _get_ipaddress(request)))
+
+
+def record_query_stats(query, facets, found, exectime, request):
+    """
+    Records the given search query of the given request in the statistics
+    together with its selected facets, its number of results and its execution
+    time in microseconds.
+
+    Only a random sample of QUERY_STATS_SAMPLE_RATE of all queries is recorded.
+    If STATS_DEFER_UPDATES is set, the query is only queued here and recorded
+    in a background thread.
+    """
+    if random.random() >= getattr(settings, 'QUERY_STATS_SAMPLE_RATE', 1.0):
+        return
+    if not getattr(settings, 'STATS_DEFER_UPDATES', False):
+        saveQueryStats(query, facets, found, exectime, request)
+        return
+    _queue_event(_QUERY_STATS_EVENT, (_get_userid(request),
+      _get_ipaddress(request), query, facets, found, exectime))
+
+
+def pending_lr_stats():
+    """
+    Returns the number of statistics events which are still waiting to be
+    recorded.
+    """
+    return PendingStatsEvent.objects.count()
+
+
+def _queue_event(kind, event):
+    """
+    Inserts the given statistics event of the given kind into the queue and
+    wakes up the worker thread.
+    """
+    PendingStatsEvent.objects.create(kind=kind, data=json.dumps(event),
+                                     lasttime=datetime.now())
+    _start_worker()
+    _WAKEUP.set()
+
+
+def _start_worker():
+    """
+    Starts the worker thread draining the queue unless it is already running.
+    """
+    global _WORKER
+    with _LOCK:
+        if _WORKER is None or not _WORKER.is_alive():
+            _WORKER = threading.Thread(target=_process_queue,
+                                       name='stats-update-worker')
+            _WORKER.daemon = True
+            _WORKER.start()
+
+
+def _process_queue():
+    """
+    Records the queued statistics events whenever new events are queued by
+    this process or STATS_POLL_INTERVAL seconds have passed; never returns.
+    """
+    while True:
+        _WAKEUP.wait(STATS_POLL_INTERVAL)
+        _WAKEUP.clear()
+        try:
+            record_pending_stats()
+        except:
+            LOGGER.error('Error while recording the pending statistics events',
+                         exc_info=True)
+        finally:
+            # the worker thread has its own database connection which should
+            # not be kept open while idle
+            connection.close()
+
+
+def record_pending_stats():
+    """
+    Records all queued statistics events in batches of at most
+    STATS_BATCH_SIZE events and returns their number.
+
+    The queue is locked against the other processes of this host in the
+    meantime; the queued events of a batch are locked in the database, too.
+    A batch which cannot be recorded is removed from the queue, so that it
+    does not block the following events.
+    """
+    _count = 0
+    _lock = Lock('stats_queue')
+    _lock.acquire()
+    try:
+        while True:
+            try:
+                _recorded, _changed = _record_pending_batch()
+            except:
+                LOGGER.error('Error while recording a batch of statistics '
+                             'events', exc_info=True)
+                _recorded, _changed = _remove_pending_batch(), set()
+            if not _recorded:
+                return _count
+            _update_index_counters(_changed)
+            _count += _recorded
+    finally:
+        _lock.release()
+
+
+@transaction.commit_on_success
+def _record_pending_batch():
+    """
+    Records the next batch of queued statistics events and removes it from
+    the queue in a single transaction.
+
+    Returns the number of recorded events and the set of the ids of the
+    resources whose counters have been incremented.
+    """
+    _pending = list(PendingStatsEvent.objects.select_for_update()
+                    .order_by('id')[:STATS_BATCH_SIZE])
+    _changed = record_lr_stats_events([tuple(json.loads(_event.data))
+        for _event in _pending if _event.kind == _LR_STATS_EVENT])
+    _query_events = [tuple(json.loads(_event.data)) + (_event.lasttime,)
+        for _event in _pending if _event.kind == _QUERY_STATS_EVENT]
+    if _query_events:
+        record_query_stats_events(_query_events)
+    PendingStatsEvent.objects.filter(
+        id__in=[_event.id for _event in _pending]).delete()
+    return len(_pending), _changed
+
+
+def _remove_pending_batch():
+    """
+    Removes the next batch of queued statistics events from the queue without
+    recording it and returns its size.
+    """
+    _ids = list(PendingStatsEvent.objects.order_by('id')
+                .values_list('id', flat=True)[:STATS_BATCH_SIZE])
+    PendingStatsEvent.objects.filter(id__in=_ids).delete()
+    return len(_ids)
+
+
+def record_lr_stats_events(events):
+    """
+    Saves the given statistics events, each a tuple of resource id, storage
+    object identifier, action, user id, session id and IP address.
+
+    Events of the same user session which would not change the counters are
+    only saved once. Returns the set of the ids of the resources whose
+    counters have been incremented.
+    """
+    _changed = set()
+    _seen = set()
+    for res_id, lrid, action, userid, sessid, ip_address in events:
+        _key = (lrid, action, userid, sessid)
+        if _key in _seen:
+            continue
+        _seen.add(_key)
+        if save_lr_stats_record(lrid, action, userid, sessid, ip_address):
+            _changed.add(res_id)
+    return _changed
+
+
+def record_query_stats_events(events):
+    """
+    Saves the given search query events, each a tuple of user id, IP address,
+    query, selected facets, number of results, execution time and time of the
+    query, with a single insert.
+    """
+    _countries = {}
+    _stats = []
+    for userid, ip_address, query, facets, found, exectime, lasttime \
+            in events:
+        if ip_address not in _countries:
+            _countries[ip_address] = getcountry_code(ip_address)
+        _stats.append(QueryStats(userid=userid,
+            geoinfo=_countries[ip_address], query=query, facets=facets,
+            found=found, exectime=exectime, lasttime=lasttime))
+    QueryStats.objects.bulk_create(_stats)
+
+
+def _update_index_counters(res_ids):
+    """
+    Updates the counters in the search index entries of the resources with the
+    given ids unless indexing is disabled.
+    """
+    if res_ids and \
+            os.environ.get('DISABLE_INDEXING_DURING_IMPORT', False) != 'True':
+        update_lr_index_counters(res_ids)
@@ -1,17 +1,22 @@
+import json
 import logging
 import urllib2
+from datetime import datetime
 from urllib import urlencode
 import uuid
 from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.test.client import Client
 from django.test.testcases import TestCase
-from metashare import test_utils
+from metashare import settings, test_utils
 from metashare.accounts.models import EditorGroup, EditorGroupManagers
 from metashare.repository.models import resourceInfoType_model
 from metashare.settings import ROOT_PATH, STORAGE_PATH, LOG_HANDLER, DJANGO_BASE, STATS_SERVER_URL, DJANGO_URL
 from metashare.storage.models import INGESTED
 from metashare.stats.model_utils import update_usage_stats, UsageStats, saveLRStats, getLRLast, getLastQuery, \
     UPDATE_STAT, VIEW_STAT, RETRIEVE_STAT, DOWNLOAD_STAT
+from metashare.stats.models import LRStats, QueryStats, PendingStatsEvent
+from metashare.stats.stats_queue import record_lr_stats_events, \
+    record_query_stats, record_query_stats_events, record_pending_stats
 from metashare.stats.views import callServerStats
 
 # Setup logging support.
@@ -97,6 +102,71 @@ class StatsTest(TestCase):
                 saveLRStats(resource, action)
                 self.assertEqual(len(getLRLast(action, 10)), i+1)
  
+    def test_stats_events_are_recorded_in_batches(self):
+        """
+        Tests that duplicate statistics events of a session are only recorded
+        once and that the changed resources are reported for reindexing.
+        """
+        resource = resourceInfoType_model.objects.all()[0]
+        lrid = resource.storage_object.identifier
+        _events = [(resource.id, lrid, VIEW_STAT, 'user', 'session1', ''),
+                   (resource.id, lrid, VIEW_STAT, 'user', 'session1', ''),
+                   (resource.id, lrid, DOWNLOAD_STAT, 'user', 'session1', '')]
+        self.assertEqual(set([resource.id]), record_lr_stats_events(_events))
+        self.assertEqual(1, LRStats.objects.filter(lrid=lrid,
+                                                   action=VIEW_STAT).count())
+        self.assertEqual(1, LRStats.objects.filter(lrid=lrid,
+                                                   action=DOWNLOAD_STAT).count())
+        # the same events do not change the counters again
+        self.assertEqual(set(), record_lr_stats_events(_events))
+        _events.append((resource.id, lrid, VIEW_STAT, 'user', 'session2', ''))
+        self.assertEqual(set([resource.id]), record_lr_stats_events(_events))
+        self.assertEqual(2, LRStats.objects.filter(lrid=lrid,
+                                                   action=VIEW_STAT).count())
+
+    def test_pending_stats_events_are_recorded(self):
+        """
+        Tests that the statistics events which are waiting in the queue table
+        are recorded and removed from the queue.
+        """
+        resource = resourceInfoType_model.objects.all()[0]
+        lrid = resource.storage_object.identifier
+        _lasttime = datetime(2012, 3, 4, 5, 6, 7)
+        PendingStatsEvent.objects.create(kind='lr', data=json.dumps(
+            (resource.id, lrid, VIEW_STAT, 'user', 'pending', '')),
+            lasttime=_lasttime)
+        PendingStatsEvent.objects.create(kind='query', data=json.dumps(
+            ('user', '', 'pending', "[]", 3, 1500)), lasttime=_lasttime)
+        self.assertEqual(2, record_pending_stats())
+        self.assertEqual(0, PendingStatsEvent.objects.count())
+        self.assertEqual(1, LRStats.objects.filter(lrid=lrid,
+            action=VIEW_STAT, sessid='pending').count())
+        self.assertEqual([(u'pending', 3, 1500)],
+            list(QueryStats.objects.filter(lasttime=_lasttime)
+                 .values_list('query', 'found', 'exectime')))
+
+    def test_query_stats_events_are_recorded_together(self):
+        """
+        Tests that queued search queries are recorded with their original
+        execution times and that queries can be sampled.
+        """
+        QueryStats.objects.all().delete()
+        _lasttime = datetime(2012, 3, 4, 5, 6, 7)
+        record_query_stats_events([
+            ('user', '', 'speech', "[]", 3, 1500000, _lasttime),
+            ('user', '', 'corpus', "[u'resourceTypeFilter_exact:corpus']",
+             0, 250, _lasttime)])
+        self.assertEqual([(u'speech', 3, 1500000), (u'corpus', 0, 250)],
+            list(QueryStats.objects.filter(lasttime=_lasttime)
+                 .order_by('id').values_list('query', 'found', 'exectime')))
+        _sample_rate = settings.QUERY_STATS_SAMPLE_RATE
+        settings.QUERY_STATS_SAMPLE_RATE = 0
+        try:
+            record_query_stats('speech', "[]", 3, 100, None)
+        finally:
+            settings.QUERY_STATS_SAMPLE_RATE = _sample_rate
+        self.assertEqual(2, QueryStats.objects.count())
+
     def test_visiting_stats(self):
         """
         Tries to load the visiting stats page of the META-SHARE website.
@@ -0,0 +1,90 @@
+'''
+A background queue for recreating expired resource digests outside of the
+request/response cycle of the synchronization views.
+'''
+import logging
+import threading
+from Queue import Queue
+
+from django.db import connection
+
+from metashare.settings import LOG_HANDLER
+from metashare.storage.models import StorageObject
+from metashare.utils import Lock
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+# the queue of storage object identifiers whose digests are to be updated
+_QUEUE = Queue()
+# the storage object identifiers which are currently in the queue; used to
+# avoid queuing the same storage object more than once
+_PENDING = set()
+# a lock for the thread-safe access to the pending set and the worker thread
+_LOCK = threading.Lock()
+# the worker thread draining the queue; created lazily
+_WORKER = None
+
+
+def schedule_digest_update(identifier):
+    """
+    Schedules the digest of the storage object with the given identifier for
+    being recreated in a background thread. Identifiers which are already
+    scheduled are ignored.
+    """
+    global _WORKER
+    with _LOCK:
+        if identifier in _PENDING:
+            return
+        _PENDING.add(identifier)
+        if _WORKER is None or not _WORKER.is_alive():
+            _WORKER = threading.Thread(target=_process_queue,
+                                       name='digest-update-worker')
+            _WORKER.daemon = True
+            _WORKER.start()
+    _QUEUE.put(identifier)
+
+
+def pending_digest_updates():
+    """
+    Returns the number of storage objects whose digests are still waiting to be
+    updated.
+    """
+    with _LOCK:
+        return len(_PENDING)
+
+
+def _process_queue():
+    """
+    Updates the storage of all storage objects taken from the queue, one at a
+    time; never returns.
+    """
+    while True:
+        identifier = _QUEUE.get()
+        try:
+            # make sure to lock the storage so that we don't get in the way of
+            # any other processes with heavy operations on the storage
+            lock = Lock('storage')
+            lock.acquire()
+            try:
+                _so = StorageObject.objects.get(identifier=identifier)
+                # the digest may have been updated in the meantime
+                if _so.is_digest_expired():
+                    LOGGER.info('updating digest of {}'.format(identifier))
+                    _so.update_storage()
+            finally:
+                lock.release()
+        except StorageObject.DoesNotExist:
+            LOGGER.info('storage object {} has been removed before its digest '
+                        'could be updated'.format(identifier))
+        except:
+            LOGGER.error('Error while updating the digest of {}'
+                         .format(identifier), exc_info=True)
+        finally:
+            with _LOCK:
+                _PENDING.discard(identifier)
+            # the worker thread has its own database connection which should
+            # not be kept open while idle
+            connection.close()
+            _QUEUE.task_done()
@@ -0,0 +1,38 @@
+"""
+Management utility to prune the synchronization change journal.
+"""
+import logging
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from metashare import settings
+from metashare.sync.models import prune_change_journal
+
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(settings.LOG_HANDLER)
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('-d', '--days', action='store', dest='days', type='int',
+                    default=None, help='maximum age of journal entries in '
+                    'days; defaults to SYNC_JOURNAL_MAX_AGE'),
+    )
+
+    help = 'Removes old entries from the synchronization change journal'
+
+    def handle(self, *args, **options):
+        """
+        Prune the change journal.
+        """
+        days = options.get('days', None)
+        if days is None:
+            days = settings.SYNC_JOURNAL_MAX_AGE
+        removed = prune_change_journal(datetime.now() - timedelta(days=days))
+        LOGGER.info("removed {} change journal entries older than {} days" \
+                    .format(removed, days))
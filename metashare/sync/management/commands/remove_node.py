@@ -4,6 +4,7 @@ Management utility to handle removed nodes.
 from django.core.management.base import BaseCommand
 from metashare import settings
 from metashare.storage.models import StorageObject
+from metashare.sync.models import NodeSyncState
 from metashare.sync.sync_utils import remove_resource
 import logging
 from metashare.utils import Lock
@@ -35,5 +36,7 @@ class Command(BaseCommand):
                     remove_resource(res)
                 LOGGER.info("removed {} resources of node {}" \
                         .format(remove_count, node_name))
+                # a re-added node has to be synchronized from scratch
+                NodeSyncState.objects.filter(node_id=node_name).delete()
         finally:
             lock.release()
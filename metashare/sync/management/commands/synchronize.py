@@ -3,11 +3,16 @@ Management utility to trigger synchronization.
 """
 import logging
 import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 from metashare import settings
-from metashare.sync.sync_utils import login, get_inventory, get_full_metadata, \
-    remove_resource
+from metashare.sync.models import NodeSyncState, DELETE
+from metashare.sync.sync_utils import login, get_inventory_changes, \
+    fetch_full_metadata, remove_resource, BATCH_SYNC_PROTOCOLS
 from django.core.management.base import BaseCommand
+from django.db import connection
 from optparse import make_option
 from metashare.storage.models import StorageObject, PROXY, REMOTE, add_or_update_resource
 from django.core.exceptions import ObjectDoesNotExist
@@ -18,6 +23,14 @@ from metashare.utils import Lock
 LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(settings.LOG_HANDLER)
 
+# the maximum number of resource identifiers to look up in a single query
+_LOOKUP_CHUNK_SIZE = 500
+
+# the number of processed resources after which the progress is reported
+_PROGRESS_INTERVAL = 100
+
+# a lock for serializing database writes of concurrently synchronized nodes
+_DB_WRITE_LOCK = threading.RLock()
 
 class Command(BaseCommand):
     
@@ -26,6 +39,17 @@ class Command(BaseCommand):
                     default=None, help='file for IDs of new/modified resource'),
         make_option('-n', '--node', action='store', dest='node',
                     default=None, help='sync only with specified node'),
+        make_option('-j', '--jobs', action='store', dest='jobs', type='int',
+                    default=getattr(settings, 'SYNC_JOBS', 1),
+                    help='number of resources to fetch concurrently per node'),
+        make_option('--node-jobs', action='store', dest='node_jobs',
+                    type='int', default=getattr(settings, 'SYNC_NODE_JOBS', 1),
+                    help='number of nodes to synchronize with concurrently'),
+        make_option('-b', '--batch-size', action='store', dest='batch_size',
+                    type='int', default=getattr(settings, 'SYNC_BATCH_SIZE', 100),
+                    help='number of resources to fetch with a single request '
+                    'from nodes supporting batch requests (at most '
+                    'SYNC_MAX_BATCH_SIZE)'),
     )
 
     help = 'Synchronizes with a predefined list of META-SHARE nodes'
@@ -50,22 +74,30 @@ class Command(BaseCommand):
         # our connections blocks forever
         socket.setdefaulttimeout(30.0)
 
+        jobs = max(1, options.get('jobs') or 1)
+        node_jobs = max(1, options.get('node_jobs') or 1)
+        batch_size = max(1, options.get('batch_size') or 1)
+
         node_name = options.get('node', None)
         if node_name is None:
-            Command.sync_with_nodes(getattr(settings, 'CORE_NODES', {}), False, id_file)
-            Command.sync_with_nodes(getattr(settings, 'PROXIED_NODES', {}), True, id_file)
+            Command.sync_with_nodes(getattr(settings, 'CORE_NODES', {}), False,
+                                    id_file, jobs, node_jobs, batch_size)
+            Command.sync_with_nodes(getattr(settings, 'PROXIED_NODES', {}),
+                                    True, id_file, jobs, node_jobs, batch_size)
         else:
             # Synchronize only with the given node
             core_nodes = getattr(settings, 'CORE_NODES', {})
             for key, value in core_nodes.items():
                 if value['NAME'] == node_name:
-                    Command.sync_with_nodes({key: value}, False, id_file)
+                    Command.sync_with_nodes({key: value}, False, id_file, jobs,
+                                            batch_size=batch_size)
                     break
 
             proxied_nodes = getattr(settings, 'PROXIED_NODES', {})
             for key, value in proxied_nodes.items():
                 if value['NAME'] == node_name:
-                    Command.sync_with_nodes({key: value}, True, id_file)
+                    Command.sync_with_nodes({key: value}, True, id_file, jobs,
+                                            batch_size=batch_size)
                     break
 
         # Close id file if used
@@ -73,7 +105,8 @@ class Command(BaseCommand):
             id_file.close()
 
     @staticmethod
-    def sync_with_nodes(nodes, is_proxy, id_file=None):
+    def sync_with_nodes(nodes, is_proxy, id_file=None, jobs=1, node_jobs=1,
+                        batch_size=1):
         """
         Synchronizes this META-SHARE node with the given other META-SHARE nodes.
         
@@ -81,7 +114,29 @@ class Command(BaseCommand):
             to synchronize with
         `is_proxy` must be True if this node is a proxy for the given nodes;
             it must be False if the given nodes are not proxied by this node
+        `jobs` is the number of resources to fetch concurrently per node
+        `node_jobs` is the number of nodes to synchronize with concurrently
+        `batch_size` is the number of resources to fetch with a single request
+            from nodes which support batch requests
         """
+        if node_jobs > 1 and len(nodes) > 1:
+            # the storage lock is held for all concurrently synchronized nodes
+            # at once as it cannot be shared between threads
+            lock = Lock('storage')
+            lock.acquire()
+            try:
+                pool = ThreadPool(min(node_jobs, len(nodes)))
+                try:
+                    pool.map(lambda item: Command._sync_with_node_in_thread(
+                        item[0], item[1], is_proxy, id_file, jobs, batch_size),
+                      nodes.items())
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                lock.release()
+            return
+
         for node_id, node in nodes.items():
             LOGGER.info("syncing with node {} at {} ...".format(
               node_id, node['URL']))
@@ -91,8 +146,8 @@ class Command(BaseCommand):
                 # operations on the storage don't get in our way
                 lock = Lock('storage')
                 lock.acquire()
-                Command.sync_with_single_node(
-                  node_id, node, is_proxy, id_file=id_file)
+                Command.sync_with_single_node(node_id, node, is_proxy,
+                  id_file=id_file, jobs=jobs, batch_size=batch_size)
             except:
                 LOGGER.error('There was an error while trying to sync with '
                     'node "%s":', node_id, exc_info=True)
@@ -100,7 +155,27 @@ class Command(BaseCommand):
                 lock.release()
 
     @staticmethod
-    def sync_with_single_node(node_id, node, is_proxy, id_file=None):
+    def _sync_with_node_in_thread(node_id, node, is_proxy, id_file, jobs,
+                                  batch_size):
+        """
+        Synchronizes this META-SHARE node with another META-SHARE node from
+        within a worker thread; the storage must already be locked.
+        """
+        LOGGER.info("syncing with node {} at {} ...".format(
+          node_id, node['URL']))
+        try:
+            Command.sync_with_single_node(node_id, node, is_proxy,
+              id_file=id_file, jobs=jobs, batch_size=batch_size)
+        except:
+            LOGGER.error('There was an error while trying to sync with '
+                'node "%s":', node_id, exc_info=True)
+        finally:
+            # each worker thread has its own database connection
+            connection.close()
+
+    @staticmethod
+    def sync_with_single_node(node_id, node, is_proxy, id_file=None, jobs=1,
+                              batch_size=1):
         """
         Synchronizes this META-SHARE node with another META-SHARE node using
         the given node description.
@@ -111,6 +186,10 @@ class Command(BaseCommand):
             synchronize with
         `is_proxy` must be True if this node is a proxy for the given nodes;
             it must be False if the given nodes are not proxied by this node
+        `jobs` is the number of resources to fetch concurrently; the fetched
+            resources are always written to the database one at a time
+        `batch_size` is the number of resources to fetch with a single request
+            if the remote node supports batch requests
         """
 
         # login
@@ -127,60 +206,31 @@ class Command(BaseCommand):
             if (index < len(settings.SYNC_PROTOCOLS) - 1):
                 inv_url = inv_url + "&"
         
-        # get the inventory list 
-        remote_inventory = get_inventory(opener, inv_url)
-        remote_inventory_count = len(remote_inventory)
-        LOGGER.info("Remote node {} contains {} resources".format(
-          node_id, remote_inventory_count))
-        
-        # create a dictionary of uuid's and digests of resource from the local 
-        # inventory that stem from the remote node
-        local_inventory = {}
-        remote_storage_objects = StorageObject.objects.filter(source_node=node_id)
-        for item in remote_storage_objects:
-            local_inventory[item.identifier] = item.digest_checksum
-        local_inventory_count = len(local_inventory)
-        LOGGER.info("Local node contains {} resources stemming from remote node {}".format(
-          local_inventory_count, node_id))
-        
-        # create three lists:
-        # 1. list of resources to be added - resources that exist in the remote
-        # inventory but not in the local
-        # 2. list of resources to be updated - resources that exist in both
-        # inventories but the remote is different from the local
-        # 3. list of resources to be removed - resources that exist in the local
-        # inventory but not in the remote
-        resources_to_add = []
-        resources_to_update = []
-        
-        for remote_res_id, remote_digest in remote_inventory.iteritems():
-            if remote_res_id in local_inventory:
-                # compare checksums; if they differ, the resource has to be updated
-                if remote_digest != local_inventory[remote_res_id]:
-                    resources_to_update.append(remote_res_id)
-                else:
-                    # resources have the same checksum, nothing to do
-                    pass
-                # remove the resource from the local inventory; what is left
-                # in the local inventory after this loop are the resources
-                # to delete
-                del local_inventory[remote_res_id]
-            else:
-                # resource exists in the remote inventory but not in the local;
-                # make sure that the remote node does not try to add a resource
-                # for which we now that it stems from ANOTHER node or OUR node 
-                try:
-                    local_so = StorageObject.objects.get(identifier=remote_res_id)
-                    source_node = local_so.source_node
-                    if not source_node:
-                        source_node = 'LOCAL NODE'
-                    LOGGER.warn(
-                      "Node {} wants to add resource {} that we already know from node {}".format(
-                      node_id, remote_res_id, source_node))
-                except ObjectDoesNotExist:
-                    resources_to_add.append(remote_res_id)
-        # remaining local inventory resources are to delete
-        resources_to_delete = local_inventory.keys()
+        # only ask for the changes since the last successful synchronization
+        # if the remote node supports change journals
+        sync_state, _ = NodeSyncState.objects.get_or_create(node_id=node_id)
+        if sync_state.journal_sequence is not None:
+            inv_url = inv_url + "&since={}".format(sync_state.journal_sequence)
+
+        # get the inventory list or the list of changes
+        sync_protocol, journal_sequence, remote_inventory, remote_changes = \
+          get_inventory_changes(opener, inv_url)
+        if sync_protocol not in BATCH_SYNC_PROTOCOLS:
+            batch_size = 1
+        if remote_changes is None:
+            LOGGER.info("Remote node {} contains {} resources".format(
+              node_id, len(remote_inventory)))
+            resources_to_add, resources_to_update, resources_to_delete = \
+              Command._diff_inventory(node_id, remote_inventory)
+            remote_digests = remote_inventory
+        else:
+            LOGGER.info("Remote node {} reports {} changed resources since "
+              "journal sequence {}".format(node_id, len(remote_changes),
+                                           sync_state.journal_sequence))
+            resources_to_add, resources_to_update, resources_to_delete = \
+              Command._diff_changes(node_id, remote_changes)
+            remote_digests = dict((change['identifier'], change['digest'])
+                                  for change in remote_changes)
 
         # print informative messages to the user
         resources_to_add_count = len(resources_to_add)
@@ -195,45 +245,61 @@ class Command(BaseCommand):
         else:
             _copy_status = REMOTE
 
-        # add resources from remote inventory
+        # fetch the resources to add and to update from the remote node
         num_added = 0
-        for res_id in resources_to_add:
-            try:
-                LOGGER.info("adding resource {0} from node {1}".format(res_id, node_id))
-                res_obj = Command._get_remote_resource(
-                  res_id, remote_inventory[res_id], node_id, node, opener, _copy_status)
-                if not id_file is None:
-                    id_file.write("--->RESOURCE_ID:{0};STORAGE_IDENTIFIER:{1}\n"\
-                        .format(res_obj.id, res_obj.storage_object.identifier))
-                num_added += 1
-            except:
-                LOGGER.error("Error while adding resource {}".format(res_id),
-                    exc_info=True)
-
-        # update resources from remote inventory
         num_updated = 0
-        for res_id in resources_to_update:
-            try:
-                LOGGER.info("updating resource {0} from node {1}".format(res_id, node_id))
-                res_obj = Command._get_remote_resource(
-                  res_id, remote_inventory[res_id], node_id, node, opener, _copy_status)
-                if not id_file is None:
-                    id_file.write("--->RESOURCE_ID:{0};STORAGE_IDENTIFIER:{1}\n"\
-                        .format(res_obj.id, res_obj.storage_object.identifier))
-                    if remote_inventory[res_id] != res_obj.storage_object.digest_checksum:
-                        id_file.write("Different digests!\n")
-                num_updated += 1
-            except:
-                LOGGER.error("Error while updating resource {}".format(res_id),
-                    exc_info=True)
+        _new_resources = set(resources_to_add)
+        _resources_to_fetch = [(res_id, remote_digests[res_id])
+                               for res_id in resources_to_add + resources_to_update]
+        _fetch_start = time.time()
+        for num_fetched, (res_id, full_metadata, error) in enumerate(
+                fetch_full_metadata(opener, url, _resources_to_fetch, jobs,
+                                    batch_size),
+                1):
+            if res_id in _new_resources:
+                _action = 'adding'
+            else:
+                _action = 'updating'
+            if error is not None:
+                LOGGER.error("Error while {} resource {}:\n{}".format(
+                  _action, res_id, error))
+            else:
+                try:
+                    LOGGER.info("{0} resource {1} from node {2}".format(
+                      _action, res_id, node_id))
+                    with _DB_WRITE_LOCK:
+                        res_obj = Command._add_or_update_remote_resource(
+                          full_metadata, remote_digests[res_id], node_id,
+                          _copy_status)
+                        if not id_file is None:
+                            id_file.write("--->RESOURCE_ID:{0};STORAGE_IDENTIFIER:{1}\n"\
+                                .format(res_obj.id, res_obj.storage_object.identifier))
+                            if res_id not in _new_resources and remote_digests[res_id] \
+                                    != res_obj.storage_object.digest_checksum:
+                                id_file.write("Different digests!\n")
+                    if res_id in _new_resources:
+                        num_added += 1
+                    else:
+                        num_updated += 1
+                except:
+                    LOGGER.error("Error while {} resource {}".format(
+                      _action, res_id), exc_info=True)
+            if num_fetched % _PROGRESS_INTERVAL == 0 \
+                    or num_fetched == len(_resources_to_fetch):
+                _elapsed = time.time() - _fetch_start
+                LOGGER.info("{} of {} resources fetched from node {} "
+                  "({:.1f} resources/s)".format(num_fetched,
+                    len(_resources_to_fetch), node_id,
+                    num_fetched / max(_elapsed, 0.001)))
 
         # delete resources from remote inventory
         num_deleted = 0
         for res_id in resources_to_delete:
             try:
                 LOGGER.info("removing resource {0} from node {1}".format(res_id, node_id))
-                _so_to_remove = StorageObject.objects.get(identifier=res_id)
-                remove_resource(_so_to_remove)
+                with _DB_WRITE_LOCK:
+                    _so_to_remove = StorageObject.objects.get(identifier=res_id)
+                    remove_resource(_so_to_remove)
                 num_deleted += 1
             except:
                 LOGGER.error("Error while removing resource {}".format(res_id),
@@ -246,18 +312,121 @@ class Command(BaseCommand):
         LOGGER.info("{} of {} resources successfully removed." \
             .format(num_deleted, resources_to_delete_count))
 
+        # remember up to which journal sequence number we are synchronized; if
+        # there were errors, the same changes have to be requested again
+        if num_added == resources_to_add_count \
+                and num_updated == resources_to_update_count \
+                and num_deleted == resources_to_delete_count:
+            sync_state.journal_sequence = journal_sequence
+            sync_state.save()
+        elif remote_changes is None:
+            sync_state.journal_sequence = None
+            sync_state.save()
+
+    @staticmethod
+    def _diff_inventory(node_id, remote_inventory):
+        """
+        Compares the given full inventory of the given remote node with the
+        local resources stemming from that node.
+        
+        Returns a triple of lists of the resources to add, to update and to
+        delete.
+        """
+        # create a dictionary of uuid's and digests of resource from the local 
+        # inventory that stem from the remote node
+        local_inventory = dict(StorageObject.objects.filter(source_node=node_id)
+                               .values_list('identifier', 'digest_checksum'))
+        LOGGER.info("Local node contains {} resources stemming from remote node {}".format(
+          len(local_inventory), node_id))
+        
+        # create three lists:
+        # 1. list of resources to be added - resources that exist in the remote
+        # inventory but not in the local
+        # 2. list of resources to be updated - resources that exist in both
+        # inventories but the remote is different from the local
+        # 3. list of resources to be removed - resources that exist in the local
+        # inventory but not in the remote
+        resources_to_add = []
+        resources_to_update = []
+        
+        for remote_res_id, remote_digest in remote_inventory.iteritems():
+            if remote_res_id in local_inventory:
+                # compare checksums; if they differ, the resource has to be updated
+                if remote_digest != local_inventory[remote_res_id]:
+                    resources_to_update.append(remote_res_id)
+                else:
+                    # resources have the same checksum, nothing to do
+                    pass
+                # remove the resource from the local inventory; what is left
+                # in the local inventory after this loop are the resources
+                # to delete
+                del local_inventory[remote_res_id]
+            elif not Command._is_known_from_other_node(node_id, remote_res_id):
+                resources_to_add.append(remote_res_id)
+        # remaining local inventory resources are to delete
+        resources_to_delete = local_inventory.keys()
+        return resources_to_add, resources_to_update, resources_to_delete
+
+    @staticmethod
+    def _diff_changes(node_id, remote_changes):
+        """
+        Compares the given list of changes of the given remote node with the
+        local resources stemming from that node.
+        
+        Returns a triple of lists of the resources to add, to update and to
+        delete.
+        """
+        # only look up the local resources which are affected by the changes
+        local_inventory = {}
+        _changed_ids = [change['identifier'] for change in remote_changes]
+        for _start in range(0, len(_changed_ids), _LOOKUP_CHUNK_SIZE):
+            local_inventory.update(StorageObject.objects.filter(
+                source_node=node_id,
+                identifier__in=_changed_ids[_start:_start + _LOOKUP_CHUNK_SIZE])
+              .values_list('identifier', 'digest_checksum'))
+
+        resources_to_add = []
+        resources_to_update = []
+        resources_to_delete = []
+        for change in remote_changes:
+            remote_res_id = change['identifier']
+            if change['op'] == DELETE:
+                if remote_res_id in local_inventory:
+                    resources_to_delete.append(remote_res_id)
+            elif remote_res_id in local_inventory:
+                if change['digest'] != local_inventory[remote_res_id]:
+                    resources_to_update.append(remote_res_id)
+            elif not Command._is_known_from_other_node(node_id, remote_res_id):
+                resources_to_add.append(remote_res_id)
+        return resources_to_add, resources_to_update, resources_to_delete
+
+    @staticmethod
+    def _is_known_from_other_node(node_id, res_id):
+        """
+        Returns whether the resource with the given id which the given remote
+        node wants to add is already known from ANOTHER node or OUR node.
+        """
+        try:
+            local_so = StorageObject.objects.get(identifier=res_id)
+        except ObjectDoesNotExist:
+            return False
+        source_node = local_so.source_node
+        if not source_node:
+            source_node = 'LOCAL NODE'
+        LOGGER.warn(
+          "Node {} wants to add resource {} that we already know from node {}".format(
+          node_id, res_id, source_node))
+        return True
+
 
     @staticmethod
-    def _get_remote_resource(resource_id, resource_digest, node_id, node, opener, copy_status):
+    def _add_or_update_remote_resource(full_metadata, resource_digest, node_id,
+                                       copy_status):
         """
-        Retrieves from the given node the resource for the given id and
-        adds/updates it at the current node with the given copy status using the
-        given opener 
+        Adds/updates the given full metadata record fetched from the given node
+        at the current node with the given copy status.
         """
-        # Get the json storage object and the actual metadata xml
-        storage_json, resource_xml_string = \
-          get_full_metadata(opener, "{0}/sync/{1}/metadata/" \
-                .format(node['URL'], resource_id), resource_digest)
+        storage_json, resource_xml_string = full_metadata
         res_obj = add_or_update_resource(storage_json, resource_xml_string,
                         resource_digest, copy_status, source_node=node_id)
         return res_obj
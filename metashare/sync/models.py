@@ -0,0 +1,223 @@
+import logging
+from datetime import datetime, timedelta
+
+from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from metashare import settings
+from metashare.settings import LOG_HANDLER
+from metashare.storage.models import StorageObject, MASTER, PROXY, INTERNAL
+
+# Setup logging support.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(LOG_HANDLER)
+
+# Change journal operation constants and choice:
+ADD = 'a'
+UPDATE = 'u'
+DELETE = 'd'
+OPERATION_CHOICES = (
+    (ADD, 'add'),
+    (UPDATE, 'update'),
+    (DELETE, 'delete'),
+)
+
+
+class ChangeJournalEntry(models.Model):
+    """
+    Records a single change of the synchronization inventory of this node.
+
+    The primary key of an entry serves as its sequence number so that other
+    nodes can ask for all changes since a sequence number they already know.
+    """
+    identifier = models.CharField(max_length=64, db_index=True,
+      help_text="The identifier of the storage object that has changed.")
+
+    digest_checksum = models.CharField(blank=True, null=True, max_length=32,
+      help_text="The digest checksum of the storage object after the change; " \
+      "empty for deletions.")
+
+    operation = models.CharField(max_length=1, choices=OPERATION_CHOICES,
+      help_text="The kind of change.")
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True,
+      help_text="The date at which the change has been recorded.")
+
+    class Meta:
+        ordering = ('id',)
+
+    def __unicode__(self):
+        return u'<ChangeJournalEntry #{0} {1} {2}>'.format(
+          self.id, self.get_operation_display(), self.identifier)
+
+
+class NodeSyncState(models.Model):
+    """
+    Remembers per remote node up to which change journal sequence number the
+    local node has successfully synchronized with it.
+    """
+    node_id = models.CharField(max_length=32, unique=True,
+      help_text="The id of the remote node as set in CORE_NODES and " \
+      "PROXIED_NODES.")
+
+    journal_sequence = models.PositiveIntegerField(null=True, blank=True,
+      help_text="The sequence number of the last change journal entry of " \
+      "the remote node which has been synchronized; empty if a full " \
+      "synchronization is required.")
+
+    def __unicode__(self):
+        return u'<NodeSyncState "{0}": {1}>'.format(self.node_id,
+                                                     self.journal_sequence)
+
+
+def get_journal_head():
+    """
+    Returns the sequence number up to which the change journal is known to be
+    complete or 0 if there is no such sequence number.
+
+    Sequence numbers are assigned when the entries are recorded, but the
+    entries only become visible when their transactions are committed, which
+    need not happen in the same order. Therefore only entries which are older
+    than SYNC_JOURNAL_SAFETY_WINDOW seconds count for the head, and other
+    nodes ask for the newer ones again the next time.
+    """
+    _settled = datetime.now() \
+        - timedelta(seconds=settings.SYNC_JOURNAL_SAFETY_WINDOW)
+    _head = ChangeJournalEntry.objects.filter(created__lte=_settled) \
+        .aggregate(models.Max('id'))['id__max']
+    if _head is None:
+        # all entries are recent; the head precedes the first one
+        _first = ChangeJournalEntry.objects.aggregate(models.Min('id'))
+        _head = (_first['id__min'] or 1) - 1
+    return _head
+
+
+def is_journal_complete_since(sequence):
+    """
+    Returns whether the change journal contains all changes after the given
+    sequence number, i.e., whether it has not been truncated in the meantime
+    and whether the sequence number is known at all.
+    """
+    _bounds = ChangeJournalEntry.objects.aggregate(models.Min('id'),
+                                                   models.Max('id'))
+    _first = _bounds['id__min'] or 1
+    _head = _bounds['id__max'] or 0
+    return _first - 1 <= sequence <= _head
+
+
+def get_changes_since(sequence):
+    """
+    Returns a list of the changes after the given sequence number; only the
+    latest change per storage object is contained, in the order in which the
+    changes occurred.
+    """
+    _latest = {}
+    for _id, identifier, digest, operation in ChangeJournalEntry.objects \
+            .filter(id__gt=sequence) \
+            .values_list('id', 'identifier', 'digest_checksum', 'operation') \
+            .iterator():
+        _latest[identifier] = (_id, digest, operation)
+    return [{'identifier': identifier, 'digest': digest, 'op': operation}
+            for identifier, (_, digest, operation)
+            in sorted(_latest.items(), key=lambda item: item[1][0])]
+
+
+def prune_change_journal(before):
+    """
+    Removes all change journal entries which have been recorded before the
+    given date. The latest entry is always kept so that sequence numbers are
+    never reused.
+
+    Returns the number of removed entries.
+    """
+    _head = ChangeJournalEntry.objects.aggregate(models.Max('id'))['id__max']
+    _entries = ChangeJournalEntry.objects.filter(created__lt=before,
+                                                 id__lt=_head or 0)
+    _count = _entries.count()
+    _entries.delete()
+    return _count
+
+
+def _is_in_inventory(storage_object):
+    """
+    Returns whether the given storage object is part of the synchronization
+    inventory of this node.
+    """
+    return storage_object.copy_status in (MASTER, PROXY) \
+      and storage_object.publication_status != INTERNAL \
+      and storage_object.digest_checksum is not None
+
+
+def _journal_latest_entry(identifier):
+    """
+    Returns the latest change journal entry for the given storage object
+    identifier or None if there is no such entry.
+    """
+    _entries = ChangeJournalEntry.objects.filter(identifier=identifier) \
+        .order_by('-id')[:1]
+    if _entries:
+        return _entries[0]
+    return None
+
+
+def _needs_delete_entry(storage_object, latest_entry):
+    """
+    Returns whether a deletion of the given storage object from the
+    synchronization inventory has to be journaled, given the latest change
+    journal entry for it.
+    """
+    if latest_entry is None:
+        # master and proxy copies which have not been journaled may
+        # nevertheless have been part of an inventory if they have been
+        # created before the journal existed or before its oldest entry, as
+        # their entries may have been pruned; all later copies have been
+        # journaled when they entered the inventory
+        return storage_object.copy_status in (MASTER, PROXY) \
+            and _precedes_journal(storage_object)
+    return latest_entry.operation != DELETE
+
+
+def _precedes_journal(storage_object):
+    """
+    Returns whether the given storage object has been created before the
+    oldest change journal entry; this is the case for all storage objects if
+    the journal is empty.
+    """
+    _first = ChangeJournalEntry.objects.order_by('id') \
+        .values_list('created', flat=True)[:1]
+    return not _first or storage_object.created < _first[0]
+
+
+# pylint: disable-msg=W0613
+@receiver(post_save, sender=StorageObject)
+def journal_storage_object_change(sender, instance, **kwargs):
+    """
+    Records changes of the synchronization inventory caused by saving the given
+    storage object in the change journal.
+    """
+    _latest = _journal_latest_entry(instance.identifier)
+    if _is_in_inventory(instance):
+        if _latest is None or _latest.operation == DELETE:
+            _operation = ADD
+        elif _latest.digest_checksum != instance.digest_checksum:
+            _operation = UPDATE
+        else:
+            return
+        ChangeJournalEntry.objects.create(identifier=instance.identifier,
+          digest_checksum=instance.digest_checksum, operation=_operation)
+    elif _needs_delete_entry(instance, _latest):
+        ChangeJournalEntry.objects.create(identifier=instance.identifier,
+                                          operation=DELETE)
+
+
+# pylint: disable-msg=W0613
+@receiver(post_delete, sender=StorageObject)
+def journal_storage_object_deletion(sender, instance, **kwargs):
+    """
+    Records the removal of the given storage object from the synchronization
+    inventory in the change journal.
+    """
+    if _needs_delete_entry(instance, _journal_latest_entry(instance.identifier)):
+        ChangeJournalEntry.objects.create(identifier=instance.identifier,
+                                          operation=DELETE)
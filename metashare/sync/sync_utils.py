@@ -10,7 +10,11 @@ import json
 import os
 import shutil
 import logging
-from zipfile import ZipFile
+import struct
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile, ZIP_DEFLATED
 from StringIO import StringIO
 from traceback import format_exc
 from metashare import settings
@@ -21,6 +25,14 @@ from metashare.settings import LOG_HANDLER
 LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(LOG_HANDLER)
 
+# synchronization protocol versions which support incremental synchronization
+# based on the change journal of the remote node
+JOURNAL_SYNC_PROTOCOLS = ('1.1', '1.2')
+
+# synchronization protocol versions which support fetching the full metadata
+# records of several resources with a single request
+BATCH_SYNC_PROTOCOLS = ('1.2',)
+
 # Idea taken from 
 # http://stackoverflow.com/questions/5082128/how-do-i-authenticate-a-urllib2-script-in-order-to-access-https-web-services-fro
 def login(login_url, username, password):
@@ -66,6 +78,20 @@ def get_inventory(opener, inventory_url):
     Obtain the inventory from a logged-in opener and fill it into a JSON structure.
     Returns the JSON structure.
     """
+    return get_inventory_changes(opener, inventory_url)[2]
+
+
+def get_inventory_changes(opener, inventory_url):
+    """
+    Obtain either the full inventory or the list of inventory changes from a
+    logged-in opener and fill it into a JSON structure.
+    
+    Returns a 4-tuple of the sync protocol version chosen by the remote node,
+    the change journal sequence number of the remote node (None if the remote
+    node does not support change journals), the full inventory JSON structure
+    (None if only changes were sent) and the list of changes (None if the full
+    inventory was sent).
+    """
     try:
         with contextlib.closing(opener.open(inventory_url)) as response:
             if not 'sync-protocol' in response.headers:
@@ -73,11 +99,19 @@ def get_inventory(opener, inventory_url):
                     'send any sync protocol version along with its metadata '
                     'inventory. This indicates an incompatible pre-v3.0 node.'
                     .format(inventory_url))
+            sync_protocol = response.headers['sync-protocol']
+            journal_sequence = None
+            if sync_protocol in JOURNAL_SYNC_PROTOCOLS:
+                journal_sequence = \
+                  int(response.headers['sync-journal-sequence'])
             data = response.read()
             with ZipFile(StringIO(data), 'r') as inzip:
+                if 'changes.json' in inzip.namelist():
+                    return sync_protocol, journal_sequence, None, \
+                      json.load(inzip.open('changes.json'))
                 json_inventory = json.load(inzip.open('inventory.json'))
                 # TODO: add error handling and verification of json structure
-                return json_inventory
+                return sync_protocol, journal_sequence, json_inventory, None
     except ConnectionException:
         raise
     except:
@@ -96,18 +130,192 @@ def get_full_metadata(opener, full_metadata_url, expected_digest):
     with contextlib.closing(opener.open(full_metadata_url)) as response:
         data = response.read()
         with ZipFile(StringIO(data), 'r') as inzip:
-            with inzip.open('metadata.xml') as resource_xml:
-                resource_xml_string = resource_xml.read()
-            with inzip.open('storage-global.json') as storage_file:
-                # read json string
-                storage_json_string = storage_file.read() 
-                # convert to json object
-                storage_json = json.loads(storage_json_string)
-            if not expected_digest == \
-              compute_digest_checksum(resource_xml_string, storage_json_string):
-                raise CorruptDataException("Checksum error for resource '{0}'." \
-                  .format(full_metadata_url))
-            return storage_json, resource_xml_string
+            return _read_full_metadata(inzip, '', expected_digest,
+                                       full_metadata_url)
+
+
+def get_full_metadata_batch(opener, batch_url, resources):
+    """
+    Obtain the full metadata records for several resources with one request.
+    
+    `resources` is a list of pairs of resource identifiers and expected digest
+        checksums
+    
+    Returns a list of triples of resource identifier, full metadata record (a
+    pair of storage_json_string, resource_xml_string) and error description;
+    exactly one of record and error description is None. Records which are not
+    sent by the remote node or which do not have an md5 digest identical to the
+    expected digest are reported as errors.
+    """
+    post_data = urllib.urlencode([('identifier', resource_id)
+                                  for resource_id, _ in resources])
+    with contextlib.closing(opener.open(batch_url, post_data)) as response:
+        data = response.read()
+    results = []
+    with ZipFile(StringIO(data), 'r') as inzip:
+        _names = set(inzip.namelist())
+        for resource_id, expected_digest in resources:
+            if '{0}/metadata.xml'.format(resource_id) not in _names:
+                results.append((resource_id, None, "Resource '{0}' was not " \
+                  "sent by '{1}'.".format(resource_id, batch_url)))
+                continue
+            try:
+                results.append((resource_id, _read_full_metadata(inzip,
+                  '{0}/'.format(resource_id), expected_digest, batch_url),
+                  None))
+            except:
+                results.append((resource_id, None, format_exc()))
+    return results
+
+
+def _read_full_metadata(inzip, prefix, expected_digest, source_url):
+    """
+    Reads the full metadata record stored under the given name prefix from the
+    given zip file.
+    
+    Returns a pair of storage_json_string, resource_xml_string.
+    
+    Raises CorruptDataException if the record does not have an md5 digest
+    identical to expected_digest.
+    """
+    with inzip.open('{0}metadata.xml'.format(prefix)) as resource_xml:
+        resource_xml_string = resource_xml.read()
+    with inzip.open('{0}storage-global.json'.format(prefix)) as storage_file:
+        # read json string
+        storage_json_string = storage_file.read() 
+        # convert to json object
+        storage_json = json.loads(storage_json_string)
+    if not expected_digest == \
+      compute_digest_checksum(resource_xml_string, storage_json_string):
+        raise CorruptDataException("Checksum error for resource '{0}{1}'." \
+          .format(source_url, prefix))
+    return storage_json, resource_xml_string
+
+
+def fetch_full_metadata(opener, node_url, resources, jobs=1, batch_size=1):
+    """
+    Obtain the full metadata records for the given resources from the node with
+    the given URL, using up to `jobs` concurrent threads.
+    
+    `resources` is a list of pairs of resource identifiers and expected digest
+        checksums
+    `batch_size` is the number of records to fetch with a single request; if it
+        is greater than 1, the remote node must support the batch endpoint (see
+        BATCH_SYNC_PROTOCOLS); it is limited to `settings.SYNC_MAX_BATCH_SIZE`
+        and batches which the remote node rejects as too large are split
+    
+    Generates triples of resource identifier, full metadata record (the pair
+    returned by `get_full_metadata()`) and error description as soon as the
+    records are available; exactly one of record and error description is None.
+    Only a small number of requests are run in advance of the consumption of
+    their records.
+    """
+    def _fetch(batch):
+        if batch_size > 1:
+            try:
+                return get_full_metadata_batch(opener,
+                  "{0}/sync/metadata/".format(node_url), batch)
+            except urllib2.HTTPError, exc:
+                if exc.code != 400 or len(batch) == 1:
+                    _error = format_exc()
+                    return [(resource_id, None, _error)
+                            for resource_id, _ in batch]
+                # the remote node may accept fewer records per request than we
+                # do; fetch both halves of the batch separately
+                LOGGER.info("Splitting a batch of {0} resources rejected by " \
+                  "'{1}'.".format(len(batch), node_url))
+                _half = (len(batch) + 1) // 2
+                return _fetch(batch[:_half]) + _fetch(batch[_half:])
+            except:
+                _error = format_exc()
+                return [(resource_id, None, _error)
+                        for resource_id, _ in batch]
+        resource_id, expected_digest = batch[0]
+        try:
+            return [(resource_id, get_full_metadata(opener,
+              "{0}/sync/{1}/metadata/".format(node_url, resource_id),
+              expected_digest), None)]
+        except:
+            return [(resource_id, None, format_exc())]
+
+    batch_size = min(max(1, batch_size), settings.SYNC_MAX_BATCH_SIZE)
+    batches = [resources[_start:_start + batch_size]
+               for _start in range(0, len(resources), batch_size)]
+    if jobs <= 1:
+        for batch in batches:
+            for result in _fetch(batch):
+                yield result
+        return
+    pool = ThreadPool(jobs)
+    try:
+        # hand out the batches in windows so that fetched records do not pile
+        # up in memory if they are consumed slower than they are fetched
+        _window = jobs * 2
+        for _start in range(0, len(batches), _window):
+            for results in pool.imap_unordered(_fetch,
+                                               batches[_start:_start + _window]):
+                for result in results:
+                    yield result
+    finally:
+        pool.terminate()
+
+
+def zip_stream(entries):
+    """
+    Generates the bytes of a zip archive with the given entries incrementally,
+    i.e., without ever holding the complete archive in memory.
+
+    `entries` is an iterable of pairs of an archive member name and an iterable
+        of byte string chunks making up the content of that member
+
+    As the sizes and checksums of the members are not known in advance, they
+    are written in data descriptors after each member. The resulting archive can
+    be read with the standard `zipfile` module.
+    """
+    _now = time.localtime()
+    _dos_time = (_now.tm_hour << 11) | (_now.tm_min << 5) | (_now.tm_sec // 2)
+    _dos_date = ((_now.tm_year - 1980) << 9) | (_now.tm_mon << 5) | _now.tm_mday
+    _central_directory = []
+    _offset = 0
+    for _name, _chunks in entries:
+        if isinstance(_name, unicode):
+            _name = _name.encode('utf-8')
+        _header_offset = _offset
+        # local file header with bit 3 set to signal a trailing data descriptor
+        _header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08,
+          ZIP_DEFLATED, _dos_time, _dos_date, 0, 0, 0, len(_name), 0) \
+          + _name
+        _offset += len(_header)
+        yield _header
+        _crc = 0
+        _size = 0
+        _compressed_size = 0
+        _compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                       zlib.DEFLATED, -15)
+        for _chunk in _chunks:
+            if isinstance(_chunk, unicode):
+                _chunk = _chunk.encode('utf-8')
+            _crc = zlib.crc32(_chunk, _crc)
+            _size += len(_chunk)
+            _compressed = _compressor.compress(_chunk)
+            if _compressed:
+                _compressed_size += len(_compressed)
+                yield _compressed
+        _compressed = _compressor.flush()
+        _compressed_size += len(_compressed)
+        _crc &= 0xffffffff
+        _descriptor = struct.pack('<IIII', 0x08074b50, _crc, _compressed_size,
+                                  _size)
+        _offset += _compressed_size + len(_descriptor)
+        yield _compressed + _descriptor
+        _central_directory.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50,
+          20, 20, 0x08, ZIP_DEFLATED, _dos_time, _dos_date, _crc,
+          _compressed_size, _size, len(_name), 0, 0, 0, 0, 0o600 << 16,
+          _header_offset) + _name)
+    _central_directory_data = ''.join(_central_directory)
+    yield _central_directory_data + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+      len(_central_directory), len(_central_directory),
+      len(_central_directory_data), _offset, 0)
 
 
 def remove_resource(storage_object, keep_stats=False):
@@ -2,7 +2,9 @@ import datetime
 import os
 import json
 import logging
+import urllib2
 
+from urlparse import parse_qs
 from xml.etree.ElementTree import fromstring
 from StringIO import StringIO
 from zipfile import ZipFile
@@ -18,6 +20,8 @@ from metashare.repository.models import resourceInfoType_model
 from metashare.storage.models import INGESTED, INTERNAL, StorageObject, \
     PUBLISHED, compute_digest_checksum, MASTER, PROXY
 from metashare.settings import DJANGO_BASE, LOGIN_URL, LOG_HANDLER
+from metashare.sync.models import DELETE
+from metashare.sync.sync_utils import fetch_full_metadata
 from metashare.test_utils import set_index_active
 
 # Setup logging support.
@@ -37,6 +41,10 @@ class MetadataSyncTest (TestCase):
         with ZipFile(StringIO(response.content), 'r') as inzip:
             return json.load(inzip.open('inventory.json'))
 
+    def extract_changes(self, response):
+        with ZipFile(StringIO(response.content), 'r') as inzip:
+            return json.load(inzip.open('changes.json'))
+
     def assertIsRedirectToLogin(self, response):
         self.assertEquals(302, response.status_code)
         self.assertTrue(LOGIN_URL in response['Location'])
@@ -95,6 +103,12 @@ class MetadataSyncTest (TestCase):
         """
         LOGGER.info("running '{}' tests...".format(cls.__name__))
         
+        # expired digests have to be updated within the tests' transactions
+        cls._defer_digest_updates = settings.SYNC_DEFER_DIGEST_UPDATES
+        settings.SYNC_DEFER_DIGEST_UPDATES = False
+        # the change journal entries of the tests are committed immediately
+        cls._journal_safety_window = settings.SYNC_JOURNAL_SAFETY_WINDOW
+        settings.SYNC_JOURNAL_SAFETY_WINDOW = 0
         set_index_active(False)
         test_utils.setup_test_storage()
         syncuser = User.objects.create_user('syncuser', 'staff@example.com',
@@ -149,6 +163,8 @@ class MetadataSyncTest (TestCase):
         test_utils.clean_storage()
         test_utils.clean_user_db()
         set_index_active(True)
+        settings.SYNC_DEFER_DIGEST_UPDATES = cls._defer_digest_updates
+        settings.SYNC_JOURNAL_SAFETY_WINDOW = cls._journal_safety_window
         LOGGER.info("finished '{}' tests".format(cls.__name__))
     
 
@@ -224,6 +240,18 @@ class MetadataSyncTest (TestCase):
             self.assertTrue(storage_object.publication_status in (INGESTED, PUBLISHED),
               "Resource {0} should not be included in inventory because it is not ingested or published".format(resource_id))
 
+    def test_inventory_contains_current_digests(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        client = Client()
+        response = client.get(self.INVENTORY_URL + "?sync_protocol=1.0")
+        self.assertValidInventoryResponse(response)
+        json_inventory = self.extract_inventory(response)
+        for resource_id, digest in json_inventory.items():
+            storage_object = StorageObject.objects.get(identifier=resource_id)
+            self.assertIsNotNone(digest)
+            self.assertEquals(storage_object.digest_checksum, digest)
+            self.assertFalse(storage_object.is_digest_expired())
+
     def test_can_get_ingested_metadata(self):
         settings.SYNC_NEEDS_AUTHENTICATION = False
         client = Client()
@@ -265,6 +293,74 @@ class MetadataSyncTest (TestCase):
         self.assertEquals(expected_digest, compute_digest_checksum(
           resource_xml_string, storage_json_string))
 
+    def test_full_metadata_batch(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        identifiers = [so.identifier for so in StorageObject.objects.all()]
+        response = Client().post('{0}metadata/'.format(self.SYNC_BASE),
+                                 {'identifier': identifiers})
+        self.assertEquals(200, response.status_code)
+        self.assertEquals('application/zip', response['Content-Type'])
+        with ZipFile(StringIO(response.content), 'r') as inzip:
+            names = inzip.namelist()
+            for storage_object in StorageObject.objects.all():
+                prefix = '{0}/'.format(storage_object.identifier)
+                if storage_object.publication_status == INTERNAL:
+                    self.assertFalse(prefix + 'metadata.xml' in names)
+                    continue
+                self.assertEquals(storage_object.digest_checksum,
+                                  inzip.read(prefix + 'digest'))
+                self.assertEquals(storage_object.digest_checksum,
+                  compute_digest_checksum(inzip.read(prefix + 'metadata.xml'),
+                    inzip.read(prefix + 'storage-global.json')))
+
+    def test_rejected_full_metadata_batches_are_split(self):
+        requested = []
+        class _Opener(object):
+            def open(self, url, post_data):
+                identifiers = parse_qs(post_data)['identifier']
+                requested.append(len(identifiers))
+                if len(identifiers) > 2:
+                    raise urllib2.HTTPError(url, 400, 'Bad request', {}, None)
+                empty_zip = StringIO()
+                ZipFile(empty_zip, 'w').close()
+                return StringIO(empty_zip.getvalue())
+        resources = [('id{0}'.format(i), 'digest') for i in range(5)]
+        results = list(fetch_full_metadata(_Opener(), 'http://node',
+                                           resources, batch_size=5))
+        self.assertEquals([5, 3, 2, 1, 2], requested)
+        self.assertEquals([resource_id for resource_id, _ in resources],
+                          [resource_id for resource_id, _, _ in results])
+        # the records are missing from the empty archives
+        for _, record, error in results:
+            self.assertIsNone(record)
+            self.assertIn('was not sent', error)
+
+    def test_anonymous_cannot_reach_full_metadata_batch(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = True
+        resource = resourceInfoType_model.objects.all()[0]
+        response = Client().post('{0}metadata/'.format(self.SYNC_BASE),
+          {'identifier': [resource.storage_object.identifier]})
+        self.assertIsForbidden(response)
+
+    def test_full_metadata_etag(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        client = Client()
+        storage_object = \
+          StorageObject.objects.filter(publication_status=PUBLISHED)[0]
+        url = '{0}{1}/metadata/'.format(self.SYNC_BASE,
+                                        storage_object.identifier)
+        response = client.get(url)
+        self.assertValidFullMetadataResponse(response)
+        etag = '"{0}"'.format(storage_object.digest_checksum)
+        self.assertEquals(etag, response['ETag'])
+        # unchanged records are not sent again
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.status_code)
+        self.assertEquals('', response.content)
+        # outdated records are sent again
+        response = client.get(url, HTTP_IF_NONE_MATCH='"outdated"')
+        self.assertValidFullMetadataResponse(response)
+
     def test_inventory_no_sync_protocol(self):
         settings.SYNC_NEEDS_AUTHENTICATION = False
         response = Client().get(self.INVENTORY_URL)
@@ -285,6 +381,71 @@ class MetadataSyncTest (TestCase):
         inventory = self.extract_inventory(response)
         self.assertNotEquals(0, len(inventory))
      
+    def test_inventory_changes_since_journal_sequence(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        client = Client()
+        response = client.get(self.INVENTORY_URL + "?sync_protocol=1.1")
+        self.assertValidInventoryResponse(response)
+        sequence = int(response['Sync-Journal-Sequence'])
+        # no changes so far
+        response = client.get(self.INVENTORY_URL
+          + "?sync_protocol=1.1&since={}".format(sequence))
+        self.assertEquals(200, response.status_code)
+        self.assertEquals([], self.extract_changes(response))
+        # unpublishing a resource removes it from the inventory
+        storage_object = \
+          StorageObject.objects.filter(publication_status=PUBLISHED)[0]
+        storage_object.publication_status = INTERNAL
+        storage_object.save()
+        response = client.get(self.INVENTORY_URL
+          + "?sync_protocol=1.1&since={}".format(sequence))
+        self.assertEquals([{'identifier': storage_object.identifier,
+                            'digest': None, 'op': DELETE}],
+                          self.extract_changes(response))
+        self.assertTrue(int(response['Sync-Journal-Sequence']) > sequence)
+
+    def test_journal_sequence_excludes_recent_changes(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        client = Client()
+        response = client.get(self.INVENTORY_URL + "?sync_protocol=1.1")
+        sequence = int(response['Sync-Journal-Sequence'])
+        storage_object = \
+          StorageObject.objects.filter(publication_status=PUBLISHED)[0]
+        storage_object.publication_status = INTERNAL
+        storage_object.save()
+        settings.SYNC_JOURNAL_SAFETY_WINDOW = 600
+        try:
+            # the change may not have been committed in the order of its
+            # sequence number, so it is sent again the next time
+            for _ in range(2):
+                response = client.get(self.INVENTORY_URL
+                  + "?sync_protocol=1.1&since={}".format(sequence))
+                self.assertEquals([{'identifier': storage_object.identifier,
+                                    'digest': None, 'op': DELETE}],
+                                  self.extract_changes(response))
+                self.assertEquals(sequence,
+                                  int(response['Sync-Journal-Sequence']))
+        finally:
+            settings.SYNC_JOURNAL_SAFETY_WINDOW = 0
+
+    def test_unjournaled_new_storage_objects_are_not_deleted(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        client = Client()
+        response = client.get(self.INVENTORY_URL + "?sync_protocol=1.1")
+        sequence = int(response['Sync-Journal-Sequence'])
+        # a resource which has never been part of the inventory
+        self.import_test_resource('ILSP10.xml', INTERNAL).delete_deep()
+        response = client.get(self.INVENTORY_URL
+          + "?sync_protocol=1.1&since={}".format(sequence))
+        self.assertEquals([], self.extract_changes(response))
+
+    def test_inventory_unknown_journal_sequence_sends_full_inventory(self):
+        settings.SYNC_NEEDS_AUTHENTICATION = False
+        response = Client().get(self.INVENTORY_URL
+          + "?sync_protocol=1.1&since=999999")
+        self.assertValidInventoryResponse(response)
+        self.assertEquals(2, len(self.extract_inventory(response)))
+
     def test_proxy_check(self):
         
         # define proxied nodes
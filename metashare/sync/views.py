@@ -1,11 +1,20 @@
 from django.http import HttpResponse
 import json
+from os.path import getsize
 from zipfile import ZipFile
 from metashare import settings
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
 from metashare.storage.models import StorageObject, MASTER, PROXY, INTERNAL, \
-    REMOTE
+    REMOTE, is_digest_expired
+from metashare.sync.digest_queue import schedule_digest_update
+from metashare.sync.models import get_journal_head, \
+    is_journal_complete_since, get_changes_since
+from metashare.sync.sync_utils import zip_stream, JOURNAL_SYNC_PROTOCOLS
+
+
+MAXIMUM_READ_BLOCK_SIZE = 4096
 
 
 def inventory(request):
@@ -27,14 +36,28 @@ def inventory(request):
         # protocols
         return HttpResponse(status=501)
     
-    response = HttpResponse(status=200, content_type='application/zip')
-    response['Metashare-Version'] = settings.METASHARE_VERSION
-    response['Content-Disposition'] = 'attachment; filename="inventory.zip"'
-    response['Sync-Protocol'] = sync_protocol
+    # for journal based sync protocols, the client may restrict the inventory
+    # to the changes since the given journal sequence number; if the journal
+    # does not cover all these changes anymore, the full inventory is sent
+    journal_sequence = None
+    if sync_protocol in JOURNAL_SYNC_PROTOCOLS:
+        # the journal head has to be determined before collecting the inventory
+        # so that concurrent changes are contained in the next inventory
+        journal_sequence = get_journal_head()
+        try:
+            since = int(request.GET.get('since', ''))
+        except ValueError:
+            since = None
+        if since is not None and is_journal_complete_since(since):
+            response = HttpResponse(status=200, content_type='application/zip')
+            _set_inventory_headers(response, sync_protocol, journal_sequence)
+            with ZipFile(response, 'w') as outzip:
+                outzip.writestr('changes.json',
+                                json.dumps(get_changes_since(since)))
+            return response
 
     # collect inventory for existing resources;
     # consists of key - value pairs of resource identifiers and digest checksums
-    json_response = {}
     objects_to_sync = StorageObject.objects \
         .filter(Q(copy_status=MASTER) | Q(copy_status=PROXY)) \
         .exclude(publication_status=INTERNAL)
@@ -47,13 +70,65 @@ def inventory(request):
 #        except ValueError:
 #            # If we cannot parse the date string, act as if none was provided
 #            pass
-    for obj in objects_to_sync:
-        json_response[obj.identifier] = obj.get_digest_checksum()
-    
-    with ZipFile(response, 'w') as outzip:
-        outzip.writestr('inventory.json', json.dumps(json_response))
+
+    # the inventory is streamed to the client while it is collected
+    response = HttpResponse(
+      zip_stream((('inventory.json', _inventory_json(objects_to_sync)),)),
+      status=200, content_type='application/zip')
+    _set_inventory_headers(response, sync_protocol, journal_sequence)
     return response
 
+
+def _set_inventory_headers(response, sync_protocol, journal_sequence):
+    """
+    Sets the headers of the given inventory response.
+    """
+    response['Metashare-Version'] = settings.METASHARE_VERSION
+    response['Content-Disposition'] = 'attachment; filename="inventory.zip"'
+    response['Sync-Protocol'] = sync_protocol
+    if journal_sequence is not None:
+        response['Sync-Journal-Sequence'] = str(journal_sequence)
+
+
+def _inventory_json(objects_to_sync):
+    """
+    Generates the JSON serialization of the inventory for the given storage
+    objects in chunks of one inventory item each.
+    """
+    yield '{'
+    _separator = ''
+    for identifier, digest in _inventory_items(objects_to_sync):
+        yield '{0}{1}:{2}'.format(_separator, json.dumps(identifier),
+                                  json.dumps(digest))
+        _separator = ','
+    yield '}'
+
+
+def _inventory_items(objects_to_sync):
+    """
+    Generates pairs of identifiers and digest checksums for the given storage
+    objects.
+    
+    Only the required columns are fetched from the database. Expired digests
+    are either updated immediately or, if SYNC_DEFER_DIGEST_UPDATES is set,
+    scheduled for being updated in the background. Missing digests are always
+    created immediately.
+    """
+    _defer_updates = getattr(settings, 'SYNC_DEFER_DIGEST_UPDATES', False)
+    for identifier, digest, digest_modified, digest_last_checked in \
+            objects_to_sync.values_list('identifier', 'digest_checksum',
+                'digest_modified', 'digest_last_checked').iterator():
+        if digest is not None \
+                and not is_digest_expired(digest_modified, digest_last_checked):
+            yield identifier, digest
+        elif digest is not None and _defer_updates:
+            schedule_digest_update(identifier)
+            yield identifier, digest
+        else:
+            yield identifier, StorageObject.objects.get(identifier=identifier) \
+                .get_digest_checksum()
+
+
 def full_metadata(request, resource_uuid):
     if settings.SYNC_NEEDS_AUTHENTICATION and not request.user.has_perm('storage.can_sync'):
         return HttpResponse("Forbidden: only synchronization users can access this page.", status=403)
@@ -63,19 +138,106 @@ def full_metadata(request, resource_uuid):
     if storage_object.copy_status == REMOTE:
         return HttpResponse("Forbidden: the specified resource is a `REMOTE` " \
             "resource and cannot be distributed by this node.", status=403)
-    response = HttpResponse(status=200, content_type='application/zip')
-    response['Metashare-Version'] = settings.METASHARE_VERSION
-    response['Content-Disposition'] = 'attachment; filename="full-metadata.zip"'
     if storage_object.digest_checksum is None:
         storage_object.update_storage()
     #if storage_object.digest_checksum is None: # still no digest? something is very wrong here:
     #    raise Exception("Object {0} has no digest".format(resource_uuid))
+
+    # the digest checksum identifies the content of the digest zip-archive, so
+    # clients which already have the current version don't get it again
+    etag = '"{0}"'.format(storage_object.digest_checksum)
+    if _etag_matches(request, etag):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
     zipfilename = "{0}/resource.zip".format(storage_object._storage_folder())
-    with open(zipfilename, 'rb') as inzip:
-        zipfiledata = inzip.read()
-        response.write(zipfiledata)
+    sendfile_header = getattr(settings, 'SYNC_SENDFILE_HEADER', None)
+    if sendfile_header:
+        # let the web server send the file
+        response = HttpResponse(status=200, content_type='application/zip')
+        sendfile_prefix = getattr(settings, 'SYNC_SENDFILE_PREFIX', None)
+        if sendfile_prefix:
+            response[sendfile_header] = '{0}/{1}/resource.zip'.format(
+              sendfile_prefix.rstrip('/'), storage_object.identifier)
+        else:
+            response[sendfile_header] = zipfilename
+    else:
+        def zip_stream_generator():
+            with open(zipfilename, 'rb') as inzip:
+                _chunk = inzip.read(MAXIMUM_READ_BLOCK_SIZE)
+                while _chunk:
+                    yield _chunk
+                    _chunk = inzip.read(MAXIMUM_READ_BLOCK_SIZE)
+
+        response = HttpResponse(zip_stream_generator(), status=200,
+                                content_type='application/zip')
+        response['Content-Length'] = getsize(zipfilename)
+    response['Metashare-Version'] = settings.METASHARE_VERSION
+    response['Content-Disposition'] = 'attachment; filename="full-metadata.zip"'
+    response['ETag'] = etag
 #    with ZipFile(response, 'w') as outzip:
 #        outzip.writestr('storage-global.json', str(storage_object.identifier))
 #        outzip.writestr('metadata.xml', storage_object.metadata.encode('utf-8'))
     return response
+
+
+def _etag_matches(request, etag):
+    """
+    Returns whether the If-None-Match header of the given request matches the
+    given entity tag.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    _tags = [_tag.strip() for _tag in if_none_match.split(',')]
+    return '*' in _tags or etag in _tags
+
+
+@csrf_exempt
+def full_metadata_batch(request):
+    """
+    Sends the full metadata records of all resources whose identifiers are
+    POSTed as `identifier` parameters in a single zip archive.
+    
+    For each resource, the archive contains the files `metadata.xml`,
+    `storage-global.json` and `digest` in a folder named after the resource
+    identifier. Unknown, internal and `REMOTE` resources are left out.
+    """
+    if settings.SYNC_NEEDS_AUTHENTICATION and not request.user.has_perm('storage.can_sync'):
+        return HttpResponse("Forbidden: only synchronization users can access this page.", status=403)
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+    identifiers = request.POST.getlist('identifier')
+    if len(identifiers) > settings.SYNC_MAX_BATCH_SIZE:
+        return HttpResponse("Bad request: at most {0} resources can be " \
+            "requested at once.".format(settings.SYNC_MAX_BATCH_SIZE),
+            status=400)
+    response = HttpResponse(zip_stream(_full_metadata_entries(identifiers)),
+                            status=200, content_type='application/zip')
+    response['Metashare-Version'] = settings.METASHARE_VERSION
+    response['Content-Disposition'] = 'attachment; filename="full-metadata.zip"'
+    return response
+
+
+def _full_metadata_entries(identifiers):
+    """
+    Generates the zip archive entries for the full metadata records of the
+    resources with the given identifiers, one resource at a time.
+    """
+    for storage_object in StorageObject.objects \
+            .filter(identifier__in=identifiers) \
+            .exclude(publication_status=INTERNAL).exclude(copy_status=REMOTE):
+        if storage_object.digest_checksum is None:
+            storage_object.update_storage()
+        zipfilename = "{0}/resource.zip".format(storage_object._storage_folder())
+        with ZipFile(zipfilename, 'r') as inzip:
+            resource_xml_string = inzip.read('metadata.xml')
+            storage_json_string = inzip.read('storage-global.json')
+        yield u'{0}/metadata.xml'.format(storage_object.identifier), \
+          (resource_xml_string,)
+        yield u'{0}/storage-global.json'.format(storage_object.identifier), \
+          (storage_json_string,)
+        yield u'{0}/digest'.format(storage_object.identifier), \
+          (storage_object.digest_checksum,)
     
\ No newline at end of file
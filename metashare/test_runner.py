@@ -1,6 +1,7 @@
 import logging
 
 from django_selenium.selenium_runner import SeleniumTestRunner
+from django.core.cache import cache
 from django.core.management import call_command
 from metashare import settings
 
@@ -17,6 +18,12 @@ def _run_custom_test_db_setup():
     """
     # from now on, redirect any search index access to the test index
     MetashareRouter.in_test_mode = True
+    # statistics must be recorded within the test transactions, i.e., not by
+    # a background thread with its own database connection
+    settings.STATS_DEFER_UPDATES = False
+    # the default cache may be shared with earlier test runs or a running
+    # server, so drop whatever it contains
+    cache.clear()
     # clear the test index
     call_command('clear_index', interactive=False,
                  using=settings.TEST_MODE_NAME)
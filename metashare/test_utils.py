@@ -62,7 +62,7 @@ def clean_resources_db():
     for tgm in TogetherManager.objects.all():
         tgm.delete()
     # delete object cache used for duplicate recognition in import
-    supermodel.OBJECT_XML_CACHE = {}
+    supermodel.OBJECT_XML_CACHE.clear()
 
 def clean_user_db():
     """
@@ -7,15 +7,21 @@ import logging
 import os
 import re
 import sys
+import threading
+import time
+from functools import partial
+from multiprocessing import Pool
 from subprocess import call, STDOUT
 from zipfile import is_zipfile, ZipFile
 
 from django import db
+from django.db import transaction
 from django.contrib.admin.models import LogEntry, ADDITION
 from django.contrib.contenttypes.models import ContentType
 from django.utils.encoding import force_unicode
 
 from metashare.repository.models import User
+from metashare.repository.supermodel import import_in_progress
 from metashare.settings import LOG_HANDLER, XDIFF_LOCATION
 from metashare.stats.model_utils import saveLRStats, UPDATE_STAT
 from xml.etree import ElementTree
@@ -33,6 +39,14 @@ XML_DECL = re.compile(r'\s*<\?xml version=".+" encoding=".+"\?>\s*\n?',
 XML_DECL_2 = re.compile(r"\s*<\?xml version='.+' encoding='.+'\?>\s*\n?",
   re.I|re.S|re.U)
 
+# the default number of resources which are imported in a single database
+# transaction during a bulk import
+BULK_IMPORT_BATCH_SIZE = 100
+
+# the maximum number of records per worker process which are read or parsed
+# ahead of the database writer during a parallel import
+PARSE_AHEAD_PER_PROCESS = 4
+
 def xml_compare(file1, file2, outfile=None):
     """
     Compare two XML files with the external program xdiff.
@@ -68,59 +82,210 @@ if __name__ == "__main__":
         print "not equal"
 
 
-def import_from_string(xml_string, targetstatus, copy_status, owner_id=None):
+def import_from_string(xml_string, targetstatus, copy_status, owner_id=None,
+                       defer_storage=False):
     """
     Import a single resource from a string representation of its XML tree, 
     and save it with the given target status.
     
+    If defer_storage is True, then neither the storage folder of the resource
+    is written nor are the statistics updated; the caller is responsible for
+    calling finish_import() on the resource later on.
+    
     Returns the imported resource object on success, raises and Exception on failure.
     """
-    from metashare.repository.models import resourceInfoType_model
-    result = resourceInfoType_model.import_from_string(xml_string, copy_status=copy_status)
+    return import_from_elementtree(ElementTree.fromstring(xml_string),
+      targetstatus, copy_status, owner_id, defer_storage)
+
+
+def import_from_elementtree(element_tree, targetstatus, copy_status,
+                            owner_id=None, defer_storage=False):
+    """
+    Import a single resource from its parsed XML tree and save it with the
+    given target status; see import_from_string().
     
-    if not result[0]:
-        msg = u''
-        if len(result) > 2:
-            msg = u'{}'.format(result[2])
-        raise Exception(msg)
+    Returns the imported resource object on success, raises and Exception on failure.
+    """
+    from metashare.repository.models import resourceInfoType_model
+    # the resource is saved again after the import, which must neither reset
+    # its content hash nor update its references before the import is done
+    with import_in_progress():
+        result = resourceInfoType_model.import_from_elementtree(
+          element_tree, copy_status=copy_status)
+
+        if not result[0]:
+            msg = u''
+            if len(result) > 2:
+                msg = u'{}'.format(result[2])
+            raise Exception(msg)
     
-    resource = result[0]
+        resource = result[0]
     
-    # Set publication_status for the new object. Also make sure that the
-    # deletion flag is not set (may happen in case of re-importing a previously
-    # deleted resource).
-    resource.storage_object.publication_status = targetstatus
-    resource.storage_object.deleted = False
-    if owner_id:
-        resource.owners.add(owner_id)
-        for edt_grp in User.objects.get(id=owner_id).get_profile() \
-                .default_editor_groups.all():
-            resource.editor_groups.add(edt_grp)
-        # this also takes care of saving the storage_object
-        resource.save()
-    else:
-        resource.storage_object.save()
+        # Set publication_status for the new object. Also make sure that the
+        # deletion flag is not set (may happen in case of re-importing a previously
+        # deleted resource).
+        resource.storage_object.publication_status = targetstatus
+        resource.storage_object.deleted = False
+        if owner_id:
+            resource.owners.add(owner_id)
+            for edt_grp in User.objects.get(id=owner_id).get_profile() \
+                    .default_editor_groups.all():
+                resource.editor_groups.add(edt_grp)
+            # this also takes care of saving the storage_object
+            resource.save()
+        else:
+            resource.storage_object.save()
 
-    # explicitly write metadata XML and storage object to the storage folder
-    resource.storage_object.update_storage()
+        # Create log ADDITION message for the new object, but only if we have a user:
+        if owner_id:
+            LogEntry.objects.log_action(
+                user_id         = owner_id,
+                content_type_id = ContentType.objects.get_for_model(resource).pk,
+                object_id       = resource.pk,
+                object_repr     = force_unicode(resource),
+                action_flag     = ADDITION
+            )
+
+    if not defer_storage:
+        finish_import(resource)
 
-    # Create log ADDITION message for the new object, but only if we have a user:
-    if owner_id:
-        LogEntry.objects.log_action(
-            user_id         = owner_id,
-            content_type_id = ContentType.objects.get_for_model(resource).pk,
-            object_id       = resource.pk,
-            object_repr     = force_unicode(resource),
-            action_flag     = ADDITION
-        )
+    return resource
 
+
+def finish_import(resource):
+    """
+    Concludes the import of the given resource by writing its metadata XML and
+    storage object to the storage folder and by updating its statistics.
+    """
+    # explicitly write metadata XML and storage object to the storage folder
+    resource.storage_object.update_storage()
     # Update statistics
     saveLRStats(resource, UPDATE_STAT)
 
-    return resource
-    
-    
-def import_from_file(filehandle, descriptor, targetstatus, copy_status, owner_id=None):
+
+def _xml_records(filehandle, descriptor):
+    """
+    Returns the xml metadata record(s) contained in the opened file identified
+    by filehandle as a list of pairs of a record descriptor and a function which
+    returns the XML string of the record.
+    """
+    handling_zip_file = is_zipfile(filehandle)
+    # Reset file handle for proper reading of the file contents.
+    filehandle.seek(0)
+
+    if not handling_zip_file:
+        LOGGER.info('Importing XML file: "{0}"'.format(descriptor))
+        return [(descriptor, filehandle.read)]
+
+    temp_zip = ZipFile(filehandle)
+    LOGGER.info('Importing ZIP file: "{0}"'.format(descriptor))
+    return [(xml_name, partial(temp_zip.read, xml_name))
+            for xml_name in temp_zip.namelist()
+            if not (xml_name.endswith('/') or xml_name.endswith('\\'))]
+
+
+def _read_records(records):
+    """
+    Yields a triple of the record descriptor, the XML string (or None) and the
+    problem which occurred while reading it (or None) for each of the given
+    pairs of record descriptors and functions returning XML strings.
+    """
+    for record_count, (xml_name, read_xml) in enumerate(records, 1):
+        LOGGER.info('Reading {0}. XML record: "{1}"'.format(record_count,
+                                                            xml_name))
+        try:
+            yield xml_name, read_xml(), None
+        # pylint: disable-msg=W0703
+        except Exception as problem:
+            yield xml_name, None, problem
+
+
+def _parse_xml_record(record):
+    """
+    Parses and pre-checks the given triple as yielded by _read_records(); may
+    be run in a worker process of a parallel import.
+
+    Returns a tuple of the record descriptor, the parsed element tree without
+    name space information (or None), the problem which occurred while
+    reading or parsing the record (or None) and the time in seconds it took to
+    parse the record.
+    """
+    from metashare.repository.models import resourceInfoType_model
+    from metashare.repository.supermodel import _remove_namespace_from_tags
+    xml_name, xml_string, problem = record
+    if problem:
+        return xml_name, None, problem, 0.0
+    start = time.time()
+    try:
+        element_tree = _remove_namespace_from_tags(
+          ElementTree.fromstring(xml_string))
+        if element_tree.tag != resourceInfoType_model.__schema_name__:
+            raise Exception(u"Tags don't match: {}!={}".format(element_tree.tag,
+              resourceInfoType_model.__schema_name__))
+    # pylint: disable-msg=W0703
+    except Exception as problem:
+        return xml_name, None, problem, time.time() - start
+    return xml_name, element_tree, None, time.time() - start
+
+
+def _parsed_records(records, pool=None, processes=1):
+    """
+    Yields the parsed XML records for the given list of pairs of record
+    descriptors and functions returning XML strings in the order of the list;
+    see _parse_xml_record() for the yielded tuples.
+
+    If a process pool with the given number of processes is given, then the
+    records are parsed in parallel by the pool while at most
+    PARSE_AHEAD_PER_PROCESS records per process are read ahead of the consumer.
+    """
+    if pool is None:
+        for record in _read_records(records):
+            yield _parse_xml_record(record)
+        return
+
+    # the records are fed into the pool by a separate thread which we have to
+    # keep from reading the whole file into memory at once
+    window = threading.Semaphore(processes * PARSE_AHEAD_PER_PROCESS)
+    stopped = []
+    def _throttled_records():
+        for record in _read_records(records):
+            window.acquire()
+            if stopped:
+                return
+            yield record
+
+    try:
+        for parsed_record in pool.imap(_parse_xml_record, _throttled_records()):
+            yield parsed_record
+            window.release()
+    finally:
+        # wake up the feeding thread in case the records have not been
+        # consumed completely
+        stopped.append(True)
+        window.release()
+
+
+def _create_pool(processes):
+    """
+    Returns a new process pool for parsing XML records if more than one
+    process is requested, otherwise None.
+    """
+    if processes > 1:
+        return Pool(processes)
+    return None
+
+
+def _close_pool(pool):
+    """
+    Shuts down the given process pool as created by _create_pool().
+    """
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def import_from_file(filehandle, descriptor, targetstatus, copy_status,
+                     owner_id=None, processes=1, timings=None):
     """
     Import the xml metadata record(s) contained in the opened file identified by filehandle.
     filehandle: an opened file handle to either a single XML file or a zip archive containing
@@ -130,6 +295,12 @@ def import_from_file(filehandle, descriptor, targetstatus, copy_status, owner_id
         All imported records will be assigned this status.
     owner_id (optional): if present, the given user ID will be added to the list of owners of the
         resource.
+    processes (optional): if larger than 1, the XML records are read and parsed
+        by this many worker processes in parallel while the calling process
+        writes the parsed records to the database.
+    timings (optional): if present, a triple of the record descriptor, the
+        parsing time and the database import time in seconds is appended to
+        this list for each record.
 
     Returns a pair of lists, the first list containing the successfully imported resource objects,
          the second containing pairs of descriptors of the erroneous XML file(s) and error messages.
@@ -137,47 +308,221 @@ def import_from_file(filehandle, descriptor, targetstatus, copy_status, owner_id
     imported_resources = []
     erroneous_descriptors = []
 
-    handling_zip_file = is_zipfile(filehandle)
-    # Reset file handle for proper reading of the file contents.
-    filehandle.seek(0)
+    records = _xml_records(filehandle, descriptor)
+    pool = _create_pool(min(processes, len(records)))
+    try:
+        for xml_name, element_tree, problem, parse_time \
+                in _parsed_records(records, pool, processes):
+            start = time.time()
+            if not problem:
+                try:
+                    resource = import_from_elementtree(element_tree,
+                      targetstatus, copy_status, owner_id)
+                    imported_resources.append(resource)
+                # pylint: disable-msg=W0703
+                except Exception as exc:
+                    problem = exc
+                    LOGGER.warn('Caught an exception while importing %s from %s:',
+                        xml_name, descriptor, exc_info=True)
+                    if isinstance(problem, db.utils.DatabaseError):
+                        # reset database connection (required for PostgreSQL)
+                        db.close_connection()
+            else:
+                LOGGER.warn(u'Could not read or parse %s from %s: %s',
+                            xml_name, descriptor, problem)
+            if problem:
+                erroneous_descriptors.append((xml_name, problem))
+            if timings is not None:
+                timings.append((xml_name, parse_time, time.time() - start))
+    finally:
+        _close_pool(pool)
+    return imported_resources, erroneous_descriptors
 
-    if not handling_zip_file:
+
+def bulk_import_from_files(files, targetstatus, copy_status, owner_id=None,
+                           batch_size=BULK_IMPORT_BATCH_SIZE, processes=1,
+                           timings=None):
+    """
+    Import the xml metadata records contained in the given files, optimized for
+    large numbers of records.
+    files: an iterable of pairs of an opened file handle (see import_from_file())
+        and a descriptor for the file handle, e.g. the file name.
+    targetstatus, copy_status, owner_id: see import_from_file().
+    batch_size (optional): the number of records to import in a single database
+        transaction.
+    processes, timings (optional): see import_from_file(); the import time of
+        a record only covers its database import.
+
+    The import runs in three phases: first all records are imported into the
+    database, committing after every batch_size records; then the storage
+    folders are written and the statistics are updated for all imported
+    resources; finally the search index entries of the imported resources are
+    created in bulk. Real-time indexing should therefore be disabled during
+    the import using the DISABLE_INDEXING_DURING_IMPORT environment variable.
+
+    Returns a pair of lists like import_from_file().
+    """
+    from metashare.repository.search_indexes import update_lr_index_entries
+    imported_ids, erroneous_descriptors = \
+        _bulk_import_records(files, targetstatus, copy_status, owner_id,
+                             batch_size, processes, timings)
+    LOGGER.info('Imported {0} resources into the database, now writing their '
+                'storage folders.'.format(len(imported_ids)))
+    imported_resources = []
+    for start in range(0, len(imported_ids), batch_size):
+        _resources, _failures = \
+            _finish_bulk_import(imported_ids[start:start + batch_size])
+        imported_resources.extend(_resources)
+        erroneous_descriptors.extend(_failures)
+    LOGGER.info('Indexing {0} imported resources.'
+                .format(len(imported_resources)))
+    update_lr_index_entries([res.id for res in imported_resources],
+                            batch_size=batch_size)
+    return imported_resources, erroneous_descriptors
+
+
+def _import_record(element_tree, targetstatus, copy_status, owner_id):
+    """
+    Imports the given XML tree as part of a bulk import.
+
+    Returns the id of the imported resource on success, raises an Exception on
+    failure; in the latter case the current transaction has been spoiled if
+    the connection has been reset or if a DatabaseError has been raised.
+    """
+    return import_from_elementtree(element_tree, targetstatus, copy_status,
+                                   owner_id, defer_storage=True).id
+
+
+def _is_transaction_spoiled(problem):
+    """
+    Returns whether the current database transaction cannot be committed
+    anymore after the given problem occurred during an import.
+    """
+    # the import may have reset the database connection itself on integrity
+    # errors in which case all uncommitted changes are lost
+    return isinstance(problem, db.utils.DatabaseError) \
+        or db.connection.connection is None
+
+
+@transaction.commit_manually
+def _bulk_import_records(files, targetstatus, copy_status, owner_id,
+                         batch_size, processes, timings):
+    """
+    Imports the records in the given files into the database, committing after
+    every batch_size records.
+
+    Returns a pair of the list of the ids of the imported resources and the
+    list of pairs of descriptors of the erroneous XML file(s) and error
+    messages.
+    """
+    from metashare.repository import supermodel
+    imported_ids = []
+    erroneous_descriptors = []
+    # triples of descriptor, XML tree and resource id of the records imported
+    # in the current transaction
+    batch = []
+    pool = _create_pool(processes)
+    try:
+        for filehandle, descriptor in files:
+            for xml_name, element_tree, problem, parse_time in _parsed_records(
+                    _xml_records(filehandle, descriptor), pool, processes):
+                start = time.time()
+                if problem:
+                    LOGGER.warn(u'Could not read or parse %s from %s: %s',
+                                xml_name, descriptor, problem)
+                    erroneous_descriptors.append((xml_name, problem))
+                    if timings is not None:
+                        timings.append((xml_name, parse_time, 0.0))
+                    continue
+                try:
+                    batch.append((xml_name, element_tree, _import_record(
+                      element_tree, targetstatus, copy_status, owner_id)))
+                # pylint: disable-msg=W0703
+                except Exception as problem:
+                    LOGGER.warn('Caught an exception while importing %s from '
+                        '%s:', xml_name, descriptor, exc_info=True)
+                    erroneous_descriptors.append((xml_name, problem))
+                    if _is_transaction_spoiled(problem):
+                        # the uncommitted records of the batch are lost; they
+                        # have to be imported again, one by one
+                        transaction.rollback()
+                        db.close_connection()
+                        # the duplicate detection cache may refer to objects
+                        # which do not exist anymore
+                        supermodel.OBJECT_XML_CACHE.clear()
+                        _lost_records = [(name, tree) for name, tree, _ in batch]
+                        del batch[:]
+                        _ids, _failures = _reimport_records(_lost_records,
+                          targetstatus, copy_status, owner_id)
+                        imported_ids.extend(_ids)
+                        erroneous_descriptors.extend(_failures)
+                finally:
+                    if timings is not None:
+                        timings.append((xml_name, parse_time,
+                                        time.time() - start))
+                if len(batch) >= batch_size:
+                    transaction.commit()
+                    imported_ids.extend(res_id for _, _, res_id in batch)
+                    del batch[:]
+                    LOGGER.info('Committed {0} imported resources so far.'
+                                .format(len(imported_ids)))
+        transaction.commit()
+        imported_ids.extend(res_id for _, _, res_id in batch)
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        _close_pool(pool)
+    return imported_ids, erroneous_descriptors
+
+
+def _reimport_records(records, targetstatus, copy_status, owner_id):
+    """
+    Imports the given pairs of descriptors and XML trees, committing after
+    each single record. Must be called within a manually managed transaction.
+
+    Returns a pair of lists like _bulk_import_records().
+    """
+    imported_ids = []
+    erroneous_descriptors = []
+    for xml_name, element_tree in records:
         try:
-            LOGGER.info('Importing XML file: "{0}"'.format(descriptor))
-            xml_string = filehandle.read()
-            resource = import_from_string(xml_string, targetstatus, copy_status, owner_id)
-            imported_resources.append(resource)
+            imported_ids.append(_import_record(element_tree, targetstatus,
+                                               copy_status, owner_id))
+            transaction.commit()
         # pylint: disable-msg=W0703
         except Exception as problem:
-            LOGGER.warn('Caught an exception while importing %s:',
-                descriptor, exc_info=True)
-            if isinstance(problem, db.utils.DatabaseError):
-                # reset database connection (required for PostgreSQL)
+            LOGGER.warn('Caught an exception while importing %s again:',
+                        xml_name, exc_info=True)
+            transaction.rollback()
+            if _is_transaction_spoiled(problem):
                 db.close_connection()
-            erroneous_descriptors.append((descriptor, problem))
-    
-    else:
-        temp_zip = ZipFile(filehandle)
-        
-        LOGGER.info('Importing ZIP file: "{0}"'.format(descriptor))
-        file_count = 0
-        for xml_name in temp_zip.namelist():
-            try:
-                if xml_name.endswith('/') or xml_name.endswith('\\'):
-                    continue
-                file_count += 1
-                LOGGER.info('Importing {0}. extracted XML file: "{1}"'.format(file_count, xml_name))
-                xml_string = temp_zip.read(xml_name)
-                resource = import_from_string(xml_string, targetstatus, copy_status, owner_id)
-                imported_resources.append(resource)
-            # pylint: disable-msg=W0703
-            except Exception as problem:
-                LOGGER.warn('Caught an exception while importing %s from %s:',
-                    xml_name, descriptor, exc_info=True)
-                if isinstance(problem, db.utils.DatabaseError):
-                    # reset database connection (required for PostgreSQL)
-                    db.close_connection()
-                erroneous_descriptors.append((xml_name, problem))
+            erroneous_descriptors.append((xml_name, problem))
+    return imported_ids, erroneous_descriptors
+
+
+@transaction.commit_on_success
+def _finish_bulk_import(resource_ids):
+    """
+    Writes the storage folders and updates the statistics of the resources
+    with the given ids in a single transaction.
+
+    Returns a pair of lists like import_from_file().
+    """
+    from metashare.repository.models import resourceInfoType_model
+    imported_resources = []
+    erroneous_descriptors = []
+    for resource in resourceInfoType_model.objects \
+            .filter(id__in=resource_ids).select_related('storage_object'):
+        try:
+            finish_import(resource)
+            imported_resources.append(resource)
+        # pylint: disable-msg=W0703
+        except Exception as problem:
+            LOGGER.warn('Caught an exception while writing the storage folder '
+                'of %s:', resource.storage_object.identifier, exc_info=True)
+            erroneous_descriptors.append(
+              (resource.storage_object.identifier, problem))
     return imported_resources, erroneous_descriptors
 
 